@@ -6,8 +6,11 @@ from misc.IOUtils import Stream
 from base.Pattern import Pattern
 from evaluation.EvaluationMechanismFactory import EvaluationMechanismParameters, \
     EvaluationMechanismTypes, EvaluationMechanismFactory, NegationMode
+from evaluation.EvaluationMechanism import ConsumptionPolicies, SelectionStrategies
+from evaluation.PartitionedEvaluationMechanism import PartitionedEvaluationMechanism, TimeSlicedEvaluationMechanism
+from evaluation.ReorderingEvaluationMechanism import ReorderingEvaluationMechanism
 from typing import List
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class PerformanceSpecifications:
@@ -27,19 +30,57 @@ class CEP:
     def __init__(self, patterns: List[Pattern],
                  eval_mechanism_type: EvaluationMechanismTypes = EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE,
                  eval_mechanism_params: EvaluationMechanismParameters = EvaluationMechanismParameters(),
-                 performance_specs: PerformanceSpecifications = None):
+                 performance_specs: PerformanceSpecifications = None,
+                 partition_key_func: callable = None, partitions_count: int = None,
+                 time_segments_count: int = None,
+                 allowed_lateness: timedelta = None, reordering_buffer_size: int = None):
         """
         Constructor of the class.
+        If a partition key function is given, the input stream is partitioned according to the key it returns for the
+        payload of each event, and the partitions are evaluated in parallel by partitions_count processes (the number
+        of CPUs by default). All events of each match are expected to share their partition key.
+        Alternatively, if time_segments_count is given, the time range of the (finite) input stream is sliced into
+        this number of segments, evaluated in parallel.
+        Under key partitioning, the consumption policy applies to the events of each key separately. Selection
+        strategies other than skip-till-any-match are not supported, as each partition interleaves the events of
+        several keys, such that the events separating those of a match would depend on the number of partitions.
+        If an allowed lateness is given, the input stream may arrive out of the order of the timestamps of its events, as
+        long as no event arrives more than the allowed lateness after a later one. The events are reordered through a
+        buffer of at most reordering_buffer_size events (unlimited by default), and the events arriving too late are
+        dropped (see ReorderingEvaluationMechanism).
         """
         if patterns is None:
             raise Exception("No patterns are provided")
+        if partition_key_func is not None and time_segments_count is not None:
+            raise Exception("Key partitioning and time slicing cannot be combined")
+        if allowed_lateness is not None and time_segments_count is not None:
+            raise Exception("Time slicing requires the input stream to be ordered in advance")
+        if allowed_lateness is None and reordering_buffer_size is not None:
+            raise Exception("A reordering buffer requires an allowed lateness")
+        if partition_key_func is not None and eval_mechanism_params is not None and \
+                eval_mechanism_params.selection_strategy != SelectionStrategies.SKIP_TILL_ANY_MATCH:
+            raise Exception("Key partitioning cannot be combined with a selection strategy, as the events of several "
+                            "keys are interleaved in each partition")
+        if time_segments_count is not None and eval_mechanism_params is not None and \
+                eval_mechanism_params.consumption_policy != ConsumptionPolicies.REUSE:
+            raise Exception("Time slicing cannot be combined with a consumption policy, as the segments would consume "
+                            "the events of their overlaps independently")
         if len(patterns) > 1:
-            raise NotImplementedError("Multi-pattern support is not yet available")
-
-
-        self.__eval_mechanism = EvaluationMechanismFactory.build_single_pattern_eval_mechanism(eval_mechanism_type,
-                                                                                               eval_mechanism_params,
-                                                                                               patterns[0])
+            self.__eval_mechanism = EvaluationMechanismFactory.build_multi_pattern_eval_mechanism(eval_mechanism_type,
+                                                                                                  eval_mechanism_params,
+                                                                                                  patterns)
+        else:
+            self.__eval_mechanism = EvaluationMechanismFactory.build_single_pattern_eval_mechanism(
+                eval_mechanism_type, eval_mechanism_params, patterns[0])
+        if partition_key_func is not None:
+            self.__eval_mechanism = PartitionedEvaluationMechanism(self.__eval_mechanism, partition_key_func,
+                                                                   partitions_count)
+        elif time_segments_count is not None:
+            self.__eval_mechanism = TimeSlicedEvaluationMechanism(self.__eval_mechanism, patterns,
+                                                                  time_segments_count)
+        if allowed_lateness is not None:
+            self.__eval_mechanism = ReorderingEvaluationMechanism(self.__eval_mechanism, allowed_lateness,
+                                                                  reordering_buffer_size)
 
         self.__pattern_matches = None
         self.__performance_specs = performance_specs
@@ -50,8 +91,9 @@ class CEP:
         """
         Applies the evaluation mechanism to detect the predefined patterns in a given stream of events.
         Returns the total time elapsed during evaluation.
+        The matches are produced by the calling thread, hence the output stream is not synchronized.
         """
-        self.__pattern_matches = Stream()
+        self.__pattern_matches = Stream(is_thread_safe=False)
         start = datetime.now()
         self.__eval_mechanism.eval(event_stream, self.__pattern_matches)
         return (datetime.now() - start).total_seconds()
@@ -73,6 +115,38 @@ class CEP:
         """
         return self.__pattern_matches
 
+    def get_statistics(self):
+        """
+        Returns the statistics collected during the last run for each pattern, in the format of
+        StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES, such that they can be set to the patterns for constructing
+        their trees in the next runs. Returns None if statistics collection was not requested in the evaluation
+        mechanism parameters, or if the evaluation was performed in parallel.
+        """
+        return self.__eval_mechanism.get_statistics()
+
+    def get_dropped_partial_matches_count(self):
+        """
+        Returns the number of partial matches dropped by load shedding so far, or None if load shedding is not applied
+        or the evaluation is performed in parallel.
+        """
+        return self.__eval_mechanism.get_dropped_partial_matches_count()
+
+    def get_migrations_count(self):
+        """
+        Returns the number of times the evaluation migrated to a new tree so far, or None if the evaluation is not
+        adaptive or is performed in parallel.
+        """
+        return self.__eval_mechanism.get_migrations_count()
+
+    def get_late_events_count(self):
+        """
+        Returns the number of events dropped for arriving more than the allowed lateness after a later event, or None if
+        no allowed lateness was given.
+        """
+        if not isinstance(self.__eval_mechanism, ReorderingEvaluationMechanism):
+            return None
+        return self.__eval_mechanism.get_late_events_count()
+
     # For future support of dynamic workload modification
     def add_pattern(self, pattern: Pattern, priority: int = 0):
         raise NotImplementedError()
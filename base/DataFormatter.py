@@ -10,6 +10,7 @@ class DataFormatter(ABC):
         """
         Transforms a raw data object representing a single event into a dictionary of objects, each corresponding
         to a single event attribute.
+        If the data formatter declares an event schema, a compact payload following this schema may be returned instead.
         """
         raise NotImplementedError()
 
@@ -24,3 +25,10 @@ class DataFormatter(ABC):
         Deduces and returns the timestamp of the event specified by the given payload.
         """
         raise NotImplementedError()
+
+    def get_event_schema(self):
+        """
+        Returns the schema of the compact payloads created by this data formatter, or None if the payloads are
+        represented as dictionaries.
+        """
+        return None
@@ -0,0 +1,114 @@
+"""
+This file contains the classes supporting a compact representation of event payloads.
+Instead of creating a dictionary for each event, a data formatter may declare the schema of its events once, and
+represent each payload as a tuple of attribute values ordered according to this schema.
+The evaluation mechanisms detect the compact payloads by the first event of a stream and compile their conditions
+accordingly, hence a stream may not mix compact payloads and dictionaries.
+"""
+import dis
+from typing import List
+
+
+class EventSchema:
+    """
+    An ordered list of the attribute names shared by all events created by some data formatter.
+    """
+    def __init__(self, attribute_names: List[str]):
+        self.attribute_names = list(attribute_names)
+        self.indices = {attribute_names[i]: i for i in range(len(attribute_names))}
+
+    def get_index(self, attribute_name: str):
+        """
+        Returns the position of the given attribute in the payloads following this schema, or None if there is no such
+        attribute.
+        """
+        return self.indices.get(attribute_name)
+
+    def __len__(self):
+        return len(self.attribute_names)
+
+
+class CompactPayload:
+    """
+    An event payload storing the attribute values in a tuple ordered according to a shared schema.
+    It supports the read-only part of the dictionary interface, so that the attribute getters used in pattern
+    conditions (e.g., lambda x: x["Peak Price"]) work for both representations.
+    """
+    __slots__ = ("schema", "fields")
+
+    def __init__(self, schema: EventSchema, fields: tuple):
+        if len(fields) != len(schema):
+            raise Exception("Expected %d attribute values, got %d" % (len(schema), len(fields)))
+        self.schema = schema
+        self.fields = tuple(fields)
+
+    def __getitem__(self, attribute_name: str):
+        return self.fields[self.schema.indices[attribute_name]]
+
+    def get(self, attribute_name: str, default: object = None):
+        index = self.schema.indices.get(attribute_name)
+        return default if index is None else self.fields[index]
+
+    def __contains__(self, attribute_name: str):
+        return attribute_name in self.schema.indices
+
+    def __iter__(self):
+        return iter(self.schema.attribute_names)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def keys(self):
+        return list(self.schema.attribute_names)
+
+    def values(self):
+        return list(self.fields)
+
+    def items(self):
+        return list(zip(self.schema.attribute_names, self.fields))
+
+    def to_dict(self):
+        """
+        Returns the dictionary representation of this payload.
+        """
+        return dict(zip(self.schema.attribute_names, self.fields))
+
+    def __eq__(self, other):
+        if isinstance(other, CompactPayload):
+            return self.schema.attribute_names == other.schema.attribute_names and self.fields == other.fields
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def get_accessed_attribute(getattr_func: callable):
+    """
+    Returns the name of the attribute returned as is by the given getter, or None if the getter does anything else.
+    Only a getter whose code consists of a single subscript of its argument by a constant string (e.g.,
+    lambda x: x["Peak Price"]) is recognized, such that it may safely be replaced by a direct lookup of the attribute's
+    position. Any other getter, even if it reads a single attribute (e.g., lambda x: x["Volume"] or 1), is not.
+    """
+    code = getattr(getattr_func, "__code__", None)
+    if code is None or code.co_argcount != 1 or getattr_func.__defaults__ is not None:
+        return None
+    instructions = [instruction for instruction in dis.get_instructions(code)
+                    if instruction.opname not in _IGNORED_OPCODES]
+    if len(instructions) != 4:
+        return None
+    load_argument, load_attribute_name, subscript, return_value = instructions
+    if not load_argument.opname.startswith("LOAD_FAST") or load_argument.argval != code.co_varnames[0]:
+        return None
+    if load_attribute_name.opname != "LOAD_CONST" or type(load_attribute_name.argval) != str:
+        return None
+    if subscript.opname != "BINARY_SUBSCR" and (subscript.opname != "BINARY_OP" or subscript.argrepr != "[]"):
+        return None
+    if return_value.opname != "RETURN_VALUE":
+        return None
+    return load_attribute_name.argval
+
+
+# the instructions not affecting the behavior of a function
+_IGNORED_OPCODES = {"RESUME", "NOP", "CACHE", "EXTENDED_ARG"}
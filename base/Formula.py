@@ -1,4 +1,58 @@
 from abc import ABC  # Abstract Base Class
+from time import perf_counter
+from typing import List
+
+from base.EventSchema import EventSchema, get_accessed_attribute
+
+
+def _register(namespace: dict, prefix: str, obj: object):
+    """
+    Adds the given object to the namespace of a compiled expression and returns the symbol it is referred to by.
+    """
+    symbol = "%s%d" % (prefix, len(namespace))
+    namespace[symbol] = obj
+    return symbol
+
+
+def _get_binding_source(name_to_index: dict, namespace: dict):
+    """
+    Returns an expression creating a name-value binding out of the list of events a compiled expression receives.
+    Used for the terms and formulas that cannot be compiled into a dedicated expression.
+    """
+    items = ", ".join("%s: events[%d].payload" % (_register(namespace, "_n", name), index)
+                      for name, index in name_to_index.items())
+    return "{%s}" % items
+
+
+def _compile(source: str, namespace: dict):
+    """
+    Creates a function receiving a list of events out of the given expression.
+    """
+    return eval("lambda events: " + source, namespace)
+
+
+def _get_function_signature(func: callable):
+    """
+    Returns a hashable object identifying the behavior of the given function. Functions sharing their code and having
+    no captured variables and no default arguments (e.g., lambda x: x["Peak Price"] defined in two places) are
+    considered identical. Functions referring to global names (e.g., lambda x: scale(x["Peak Price"])) must also share
+    their globals, as the same names may be bound to different objects elsewhere. Any other function is only identical
+    to itself.
+    """
+    code = getattr(func, "__code__", None)
+    if code is None or func.__closure__ is not None or func.__defaults__ is not None:
+        return func
+    if _refers_to_global_names(code):
+        return code.co_code, code.co_consts, code.co_names, id(func.__globals__)
+    return code.co_code, code.co_consts, code.co_names
+
+
+def _refers_to_global_names(code):
+    """
+    Returns True if the given code object or any code object nested in it refers to names, which may be global.
+    """
+    return len(code.co_names) > 0 or \
+        any(_refers_to_global_names(const) for const in code.co_consts if type(const) == type(code))
 
 
 class Term(ABC):
@@ -12,6 +66,31 @@ class Term(ABC):
     def get_term_of(self, names: set):
         raise NotImplementedError()
 
+    def compile(self, name_to_index: dict, schema: EventSchema = None):
+        """
+        Compiles this term into a function receiving a list of events and returning the value of the term.
+        The event bound to each name is expected at the position specified by name_to_index.
+        If a schema is given, the events are expected to carry compact payloads following it.
+        """
+        namespace = {}
+        return _compile(self._get_source(name_to_index, namespace, schema), namespace)
+
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        """
+        Returns a Python expression calculating this term out of a list of events named "events".
+        The objects referred to by the expression are added to the given namespace.
+        By default, the term is evaluated on a name-value binding created out of the events.
+        """
+        return "%s.eval(%s)" % (_register(namespace, "_t", self), _get_binding_source(name_to_index, namespace))
+
+    def get_signature(self, name_to_index: dict):
+        """
+        Returns a hashable object such that terms with equal signatures evaluate to the same value on the same list of
+        events, where the event bound to each name is at the position specified by name_to_index.
+        By default, a term is only equivalent to itself.
+        """
+        return self
+
 
 class AtomicTerm(Term):
     """
@@ -26,6 +105,16 @@ class AtomicTerm(Term):
     def get_term_of(self, names: set):
         return self
 
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        return _register(namespace, "_v", self.value)
+
+    def get_signature(self, name_to_index: dict):
+        try:
+            hash(self.value)
+        except TypeError:
+            return self
+        return AtomicTerm, type(self.value), self.value
+
 
 class IdentifierTerm(Term):
     """
@@ -44,6 +133,21 @@ class IdentifierTerm(Term):
         if self.name in names:
             return self
 
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        if self.name not in name_to_index:
+            raise NameError("Name %s is not bound to a value" % self.name)
+        if schema is not None:
+            # a getter merely reading an attribute is replaced by a direct access to the position of this attribute
+            attribute_index = schema.get_index(get_accessed_attribute(self.getattr_func))
+            if attribute_index is not None:
+                return "events[%d].payload.fields[%d]" % (name_to_index[self.name], attribute_index)
+        return "%s(events[%d].payload)" % (_register(namespace, "_g", self.getattr_func), name_to_index[self.name])
+
+    def get_signature(self, name_to_index: dict):
+        attribute_name = get_accessed_attribute(self.getattr_func)
+        getattr_signature = _get_function_signature(self.getattr_func) if attribute_name is None else attribute_name
+        return IdentifierTerm, name_to_index[self.name], getattr_signature
+
 
 
 class BinaryOperationTerm(Term):
@@ -61,6 +165,24 @@ class BinaryOperationTerm(Term):
     def get_term_of(self, names: set):
         raise NotImplementedError()
 
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        lhs = self.lhs._get_source(name_to_index, namespace, schema)
+        rhs = self.rhs._get_source(name_to_index, namespace, schema)
+        operator = self._get_operator_source()
+        if operator is not None:
+            return "(%s %s %s)" % (lhs, operator, rhs)
+        return "%s(%s, %s)" % (_register(namespace, "_o", self.binary_op), lhs, rhs)
+
+    def get_signature(self, name_to_index: dict):
+        return BinaryOperationTerm, _get_function_signature(self.binary_op), \
+            self.lhs.get_signature(name_to_index), self.rhs.get_signature(name_to_index)
+
+    def _get_operator_source(self):
+        """
+        Returns the Python operator equivalent to the operation of this term, or None if there is no such operator.
+        """
+        return None
+
 
 class PlusTerm(BinaryOperationTerm):
     def __init__(self, lhs: Term, rhs: Term):
@@ -72,6 +194,9 @@ class PlusTerm(BinaryOperationTerm):
         if lhs and rhs:
             return PlusTerm(lhs, rhs)
 
+    def _get_operator_source(self):
+        return "+"
+
 
 class MinusTerm(BinaryOperationTerm):
     def __init__(self, lhs: Term, rhs: Term):
@@ -83,6 +208,9 @@ class MinusTerm(BinaryOperationTerm):
         if lhs and rhs:
             return MinusTerm(lhs, rhs)
 
+    def _get_operator_source(self):
+        return "-"
+
 
 class MulTerm(BinaryOperationTerm):
     def __init__(self, lhs: Term, rhs: Term):
@@ -94,6 +222,9 @@ class MulTerm(BinaryOperationTerm):
         if lhs and rhs:
             return MulTerm(lhs, rhs)
 
+    def _get_operator_source(self):
+        return "*"
+
 
 class DivTerm(BinaryOperationTerm):
     def __init__(self, lhs: Term, rhs: Term):
@@ -105,6 +236,9 @@ class DivTerm(BinaryOperationTerm):
         if lhs and rhs:
             return DivTerm(lhs, rhs)
 
+    def _get_operator_source(self):
+        return "/"
+
 
 class Formula(ABC):
     """
@@ -120,6 +254,47 @@ class Formula(ABC):
     def get_all_terms(self, term_set: set):
         NotImplementedError()
 
+    def get_conjuncts(self):
+        """
+        Returns the list of formulas whose conjunction is equivalent to this formula.
+        """
+        return [self]
+
+    def compile(self, name_to_index: dict, schema: EventSchema = None):
+        """
+        Compiles this formula into a function receiving a list of events and returning whether they satisfy it.
+        The event bound to each name is expected at the position specified by name_to_index.
+        If a schema is given, the events are expected to carry compact payloads following it.
+        Unlike eval, the compiled function neither creates a binding nor recursively traverses the formula.
+        """
+        namespace = {}
+        return _compile(self._get_source(name_to_index, namespace, schema), namespace)
+
+    def compile_counter(self, name_to_index: dict, schema: EventSchema = None):
+        """
+        Compiles this formula into a function receiving an iterable of event lists and returning the number of lists
+        satisfying it. The whole batch is evaluated by a single expression, rather than by a function call per list.
+        """
+        namespace = {}
+        source = "sum(1 for events in batch if %s)" % self._get_source(name_to_index, namespace, schema)
+        return eval("lambda batch: " + source, namespace)
+
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        """
+        Returns a Python expression evaluating this formula on a list of events named "events".
+        The objects referred to by the expression are added to the given namespace.
+        By default, the formula is evaluated on a name-value binding created out of the events.
+        """
+        return "%s.eval(%s)" % (_register(namespace, "_f", self), _get_binding_source(name_to_index, namespace))
+
+    def get_signature(self, name_to_index: dict):
+        """
+        Returns a hashable object such that formulas with equal signatures are satisfied by the same lists of events,
+        where the event bound to each name is at the position specified by name_to_index.
+        By default, a formula is only equivalent to itself.
+        """
+        return self
+
 
 class AtomicFormula(Formula):
     """
@@ -133,6 +308,24 @@ class AtomicFormula(Formula):
     def eval(self, binding: dict = None):
         return self.relation_op(self.left_term.eval(binding), self.right_term.eval(binding))
 
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        left = self.left_term._get_source(name_to_index, namespace, schema)
+        right = self.right_term._get_source(name_to_index, namespace, schema)
+        operator = self._get_operator_source()
+        if operator is not None:
+            return "(%s %s %s)" % (left, operator, right)
+        return "%s(%s, %s)" % (_register(namespace, "_o", self.relation_op), left, right)
+
+    def get_signature(self, name_to_index: dict):
+        return AtomicFormula, _get_function_signature(self.relation_op), \
+            self.left_term.get_signature(name_to_index), self.right_term.get_signature(name_to_index)
+
+    def _get_operator_source(self):
+        """
+        Returns the Python operator equivalent to the relation of this formula, or None if there is no such operator.
+        """
+        return None
+
     def get_all_terms(self, term_set: set):
         if type(self.left_term) == IdentifierTerm:
             term_set.add(self.left_term.name)
@@ -152,6 +345,9 @@ class EqFormula(AtomicFormula):
         if left_term and right_term:
             return EqFormula(left_term, right_term)
 
+    def _get_operator_source(self):
+        return "=="
+
     def get_events_in_a_condition_with(self, name: str):
         """
         Returns names of all events involved in the same condition as the event sent in param
@@ -178,6 +374,9 @@ class NotEqFormula(AtomicFormula):
         if left_term and right_term:
             return NotEqFormula(left_term, right_term)
 
+    def _get_operator_source(self):
+        return "!="
+
     def get_events_in_a_condition_with(self, name: str):
         """
         Returns names of all events involved in the same condition as the event sent in param
@@ -203,6 +402,9 @@ class GreaterThanFormula(AtomicFormula):
         if left_term and right_term:
             return GreaterThanFormula(left_term, right_term)
 
+    def _get_operator_source(self):
+        return ">"
+
     def get_events_in_a_condition_with(self, name: str):
         """
         Returns names of all events involved in the same condition as the event sent in param
@@ -228,6 +430,9 @@ class SmallerThanFormula(AtomicFormula):
         if left_term and right_term:
             return SmallerThanFormula(left_term, right_term)
 
+    def _get_operator_source(self):
+        return "<"
+
     def get_events_in_a_condition_with(self, name: str):
         """
         Returns names of all events involved in the same condition as the event sent in param
@@ -253,6 +458,9 @@ class GreaterThanEqFormula(AtomicFormula):
         if left_term and right_term:
             return GreaterThanEqFormula(left_term, right_term)
 
+    def _get_operator_source(self):
+        return ">="
+
     def get_events_in_a_condition_with(self, name: str):
         """
         Returns names of all events involved in the same condition as the event sent in param
@@ -278,6 +486,9 @@ class SmallerThanEqFormula(AtomicFormula):
         if left_term and right_term:
             return SmallerThanEqFormula(left_term, right_term)
 
+    def _get_operator_source(self):
+        return "<="
+
     def get_events_in_a_condition_with(self, name: str):
         """
         Returns names of all events involved in the same condition as the event sent in param
@@ -305,6 +516,15 @@ class BinaryLogicOpFormula(Formula):
     def eval(self, binding: dict = None):
         return self.binary_logic_op(self.left_formula.eval(binding), self.right_formula.eval(binding))
 
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        return "%s(%s, %s)" % (_register(namespace, "_o", self.binary_logic_op),
+                               self.left_formula._get_source(name_to_index, namespace, schema),
+                               self.right_formula._get_source(name_to_index, namespace, schema))
+
+    def get_signature(self, name_to_index: dict):
+        return BinaryLogicOpFormula, _get_function_signature(self.binary_logic_op), \
+            self.left_formula.get_signature(name_to_index), self.right_formula.get_signature(name_to_index)
+
     def get_all_terms(self, term_set: set):
         self.left_formula.get_all_terms(term_set)
         self.right_formula.get_all_terms(term_set)
@@ -326,6 +546,29 @@ class AndFormula(BinaryLogicOpFormula):
         if right_formula:
             return right_formula
 
+    def eval(self, binding: dict = None):
+        # the right formula is only evaluated if the left one is satisfied
+        return self.left_formula.eval(binding) and self.right_formula.eval(binding)
+
+    def get_conjuncts(self):
+        return self.left_formula.get_conjuncts() + self.right_formula.get_conjuncts()
+
+    def compile(self, name_to_index: dict, schema: EventSchema = None):
+        """
+        The nested conjunctions are flattened into a single conjunction whose order of evaluation is adapted at runtime.
+        """
+        return AdaptiveConjunction(self.get_conjuncts(), name_to_index, schema)
+
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        return "(%s and %s)" % (self.left_formula._get_source(name_to_index, namespace, schema),
+                                self.right_formula._get_source(name_to_index, namespace, schema))
+
+    def get_signature(self, name_to_index: dict):
+        """
+        The order of the conjuncts does not affect the signature.
+        """
+        return AndFormula, frozenset(conjunct.get_signature(name_to_index) for conjunct in self.get_conjuncts())
+
     def get_events_in_a_condition_with(self, name: str):
         """
         Returns names of all events involved in the same condition as the event sent in param
@@ -342,3 +585,96 @@ class AndFormula(BinaryLogicOpFormula):
 class TrueFormula(Formula):
     def eval(self, binding: dict = None):
         return True
+
+    def _get_source(self, name_to_index: dict, namespace: dict, schema: EventSchema = None):
+        return "True"
+
+    def get_signature(self, name_to_index: dict):
+        return TrueFormula
+
+
+class AdaptiveConjunction:
+    """
+    A compiled conjunction of formulas, evaluated in a short-circuit manner.
+    Once in a while, an evaluation is sampled: all conjuncts are evaluated and timed separately. Periodically, the
+    conjuncts are reordered according to the sampled statistics, such that the conjuncts with the lowest ratio between
+    the evaluation cost and the probability to be unsatisfied (i.e., the cheapest and most selective) come first.
+    """
+    SAMPLING_INTERVAL = 64
+    SAMPLES_PER_REORDERING = 16
+
+    def __init__(self, conjuncts: List[Formula], name_to_index: dict, schema: EventSchema = None):
+        self.__conjuncts = conjuncts
+        self.__name_to_index = name_to_index
+        self.__schema = schema
+        self.__compiled_conjuncts = [conjunct.compile(name_to_index, schema) for conjunct in conjuncts]
+        self.__order = list(range(len(conjuncts)))
+        self.__evaluation_function = self.__create_evaluation_function()
+        self.__calls_count = 0
+        # the number of samples taken since the last reordering
+        self.__samples_count = 0
+        # the weighted number of samples the statistics consist of, halved on each reordering like the statistics
+        self.__samples_weight = 0.0
+        self.__pass_counts = [0.0] * len(conjuncts)
+        self.__total_costs = [0.0] * len(conjuncts)
+
+    def __call__(self, events: list):
+        self.__calls_count += 1
+        if self.__calls_count == AdaptiveConjunction.SAMPLING_INTERVAL:
+            return self.__sample(events)
+        return self.__evaluation_function(events)
+
+    def get_order(self):
+        """
+        Returns the current order of evaluation as a list of conjunct indices.
+        """
+        return list(self.__order)
+
+    def __create_evaluation_function(self):
+        """
+        Compiles the conjuncts into a single short-circuiting expression following the current order.
+        """
+        namespace = {}
+        source = " and ".join(self.__conjuncts[i]._get_source(self.__name_to_index, namespace, self.__schema)
+                              for i in self.__order)
+        return _compile(source, namespace)
+
+    def __sample(self, events: list):
+        """
+        Evaluates all conjuncts on the given events and updates their statistics.
+        """
+        self.__calls_count = 0
+        result = True
+        for i in range(len(self.__compiled_conjuncts)):
+            start = perf_counter()
+            is_satisfied = self.__compiled_conjuncts[i](events)
+            self.__total_costs[i] += perf_counter() - start
+            if is_satisfied:
+                self.__pass_counts[i] += 1
+            else:
+                result = False
+        self.__samples_count += 1
+        self.__samples_weight += 1
+        if self.__samples_count == AdaptiveConjunction.SAMPLES_PER_REORDERING:
+            self.__reorder()
+        return result
+
+    def __reorder(self):
+        """
+        Sorts the conjuncts by the ratio between their average cost and their rejection rate.
+        The statistics are then halved, so that the recent samples outweigh the older ones.
+        """
+        def rank(i: int):
+            rejection_rate = 1 - self.__pass_counts[i] / self.__samples_weight
+            if rejection_rate == 0:
+                return float("inf")
+            return self.__total_costs[i] / self.__samples_weight / rejection_rate
+
+        new_order = sorted(range(len(self.__conjuncts)), key=rank)
+        if new_order != self.__order:
+            self.__order = new_order
+            self.__evaluation_function = self.__create_evaluation_function()
+        self.__samples_count = 0
+        self.__samples_weight /= 2
+        self.__pass_counts = [count / 2 for count in self.__pass_counts]
+        self.__total_costs = [cost / 2 for cost in self.__total_costs]
@@ -5,7 +5,9 @@ from typing import List
 class PatternMatch:
     """
     This class's instances are the output results of an evaluation mechanism's eval function.
-    It has one field which is the list of events in the pattern match.
+    It contains the list of events in the pattern match. When multiple patterns are evaluated, it also contains the
+    index of the matched pattern.
     """
-    def __init__(self, events: List[Event]):
+    def __init__(self, events: List[Event], pattern_id: int = None):
         self.events = events
+        self.pattern_id = pattern_id
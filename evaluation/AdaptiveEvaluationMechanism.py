@@ -0,0 +1,292 @@
+"""
+This file contains the adaptive tree-based evaluation mechanism.
+The evaluation tree is initially constructed by a tree builder according to the statistics of the pattern, as usual.
+During the evaluation, the arrival rates of the event types and the selectivities of the conditions are measured, and
+the tree builder is periodically invoked again on the measured statistics. If the estimated cost of the new tree is
+sufficiently lower than that of the current one, the evaluation migrates to the new tree.
+The partial matches of the current tree are recreated in the new tree by replaying the events buffered at the leaves of
+the current tree that are still within the time window, i.e., the only events that may participate in future matches.
+The matches found during the replay were already reported by the current tree, hence they are discarded.
+"""
+from copy import copy
+from datetime import timedelta, datetime
+
+from base.Event import Event
+from base.EventSchema import CompactPayload
+from base.Pattern import Pattern
+from base.PatternMatch import PatternMatch
+from evaluation.EvaluationMechanism import EvaluationMechanism, SelectionStrategies, ConsumptionPolicies
+from evaluation.EventDispatcher import EventDispatcher
+from evaluation.TreeBasedEvaluationMechanism import Tree, InternalNode
+from misc.IOUtils import Stream
+from misc.Statistics import calculate_bushy_tree_cost_function
+from misc.StatisticsCollector import StatisticsCollector
+from misc.StatisticsTypes import StatisticsTypes
+
+
+class AdaptationParameters:
+    """
+    Parameters of the adaptive evaluation mode:
+    - the time (according to the timestamps of the events) between consecutive attempts to re-optimize the tree, during
+      which the statistics are measured;
+    - the minimal relative reduction of the estimated cost required for migrating to a new tree, e.g., 0.2 for 20%.
+    """
+    def __init__(self, reoptimization_interval: timedelta = timedelta(minutes=30), min_cost_gain: float = 0.2):
+        if reoptimization_interval <= timedelta(0):
+            raise Exception("The re-optimization interval must be positive")
+        self.reoptimization_interval = reoptimization_interval
+        self.min_cost_gain = min_cost_gain
+
+
+class TreeStatisticsMonitor:
+    """
+    Measures the statistics required by the tree builders during the evaluation of a pattern by a tree.
+    The arrival rate of each event type is the number of its events divided by the duration of the measurement. The
+    selectivity of the condition of a single item is the fraction of the events of its type accepted by its leaf.
+    The selectivity of the conditions between the items is estimated by the internal nodes of the tree: the fraction of
+    the compared pairs of partial matches combined by a node is split evenly (in terms of the product) among the pairs of
+    its items that are subject to a condition, or among all of its pairs of items if there are none.
+    Selectivities that were not measured retain their previous estimates, initially taken from the pattern statistics.
+    """
+    def __init__(self, pattern: Pattern):
+        args = pattern.structure.args
+        self.__event_types = [qitem.event_type for qitem in args]
+        self.__arrivals_counts = {event_type: 0 for event_type in self.__event_types}
+        self.__acceptances_counts = [0] * len(args)
+        if pattern.statistics_type == StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES:
+            selectivity_matrix, arrival_rates = pattern.statistics
+            self.__selectivity_matrix = [list(row) for row in selectivity_matrix]
+            self.__arrival_rates = list(arrival_rates)
+        else:
+            self.__selectivity_matrix = [[1.0 for _ in args] for _ in args]
+            self.__arrival_rates = [0.0 for _ in args]
+        self.__conditioned_pairs = {
+            (i, j) for i in range(len(args)) for j in range(len(args))
+            if i != j and pattern.condition is not None and
+            pattern.condition.get_formula_of({args[i].name, args[j].name}) is not None}
+        self.__leaf_indices = {}
+        self.__internal_nodes = []
+
+    def set_tree(self, tree: Tree):
+        """
+        Starts monitoring the given tree, discarding the measurements of its internal nodes so far.
+        """
+        self.__leaf_indices = {leaf: leaf.get_event_definitions()[0][0] for leaf in tree.get_leaves()}
+        self.__internal_nodes = []
+        nodes_to_visit = [tree.get_root()]
+        while len(nodes_to_visit) > 0:
+            node = nodes_to_visit.pop()
+            if isinstance(node, InternalNode):
+                node.reset_join_statistics()
+                self.__internal_nodes.append(node)
+                nodes_to_visit.extend(node.get_subtrees())
+
+    def register_event(self, event: Event):
+        """
+        Counts the arrival of the given event.
+        """
+        if event.event_type in self.__arrivals_counts:
+            self.__arrivals_counts[event.event_type] += 1
+
+    def register_accepted_event(self, leaf):
+        """
+        Counts the acceptance of an event by the given leaf.
+        """
+        self.__acceptances_counts[self.__leaf_indices[leaf]] += 1
+
+    def get_statistics(self, duration: timedelta):
+        """
+        Updates the estimates according to the measurements of the given duration, starts a new measurement, and returns
+        the selectivity matrix and the arrival rates.
+        """
+        seconds = duration.total_seconds()
+        for i in range(len(self.__event_types)):
+            arrivals_count = self.__arrivals_counts[self.__event_types[i]]
+            self.__arrival_rates[i] = arrivals_count / seconds
+            if arrivals_count > 0:
+                self.__selectivity_matrix[i][i] = self.__acceptances_counts[i] / arrivals_count
+        for node in self.__internal_nodes:
+            self.__update_node_selectivities(node)
+        self.__reset()
+        return [list(row) for row in self.__selectivity_matrix], list(self.__arrival_rates)
+
+    def __update_node_selectivities(self, node: InternalNode):
+        """
+        Updates the selectivities of the pairs of items joined by the given node according to its counters.
+        """
+        compared_pairs_count, created_partial_matches_count = node.get_join_statistics()
+        if compared_pairs_count == 0:
+            return
+        left_subtree, right_subtree = node.get_subtrees()
+        pairs = [(left_item[0], right_item[0]) for left_item in left_subtree.get_event_definitions()
+                 for right_item in right_subtree.get_event_definitions()]
+        conditioned_pairs = [pair for pair in pairs if pair in self.__conditioned_pairs]
+        if len(conditioned_pairs) > 0:
+            pairs = conditioned_pairs
+        if created_partial_matches_count > 0:
+            node_selectivity = created_partial_matches_count / compared_pairs_count
+        else:
+            # no partial match was created yet, hence the selectivity is only known to be low
+            node_selectivity = 1 / (compared_pairs_count + 1)
+        pair_selectivity = node_selectivity ** (1 / len(pairs))
+        for i, j in pairs:
+            self.__selectivity_matrix[i][j] = self.__selectivity_matrix[j][i] = pair_selectivity
+
+    def __reset(self):
+        for event_type in self.__arrivals_counts.keys():
+            self.__arrivals_counts[event_type] = 0
+        self.__acceptances_counts = [0] * len(self.__acceptances_counts)
+        for node in self.__internal_nodes:
+            node.reset_join_statistics()
+
+
+class AdaptiveTreeBasedEvaluationMechanism(EvaluationMechanism):
+    """
+    A tree-based evaluation mechanism periodically re-optimizing its tree according to the statistics measured during
+    the evaluation. The tree structures are created by the given function, receiving a pattern along with its
+    statistics, such as the tree building method of a tree builder.
+    Patterns with negative events, as well as selection strategies and consumption policies other than the default
+    ones, are not supported, as the state of their trees cannot be recreated by replaying the events.
+    If statistics collection parameters are given, the tree is re-optimized according to the statistics collected over
+    the sliding window of the statistics collector rather than those measured by the tree itself.
+    """
+    def __init__(self, pattern: Pattern, tree_structure: tuple, tree_structure_builder: callable,
+                 eval_mechanism_params):
+        if len(pattern.negative_event.get_args()) > 0:
+            raise NotImplementedError("Negation is not supported by the adaptive evaluation mechanism")
+        if eval_mechanism_params.selection_strategy != SelectionStrategies.SKIP_TILL_ANY_MATCH or \
+                eval_mechanism_params.consumption_policy != ConsumptionPolicies.REUSE:
+            raise NotImplementedError("Selection strategies and consumption policies are not supported by the adaptive "
+                                      "evaluation mechanism")
+        if eval_mechanism_params.load_shedding_params is not None:
+            raise NotImplementedError("Load shedding is not supported by the adaptive evaluation mechanism")
+        if eval_mechanism_params.micro_batching:
+            raise NotImplementedError("The micro-batch mode is not supported by the adaptive evaluation mechanism")
+        self.__pattern = pattern
+        self.__tree_structure_builder = tree_structure_builder
+        self.__eval_mechanism_params = eval_mechanism_params
+        self.__adaptation_params = eval_mechanism_params.adaptation_params
+        self.__tree_structure = tree_structure
+        self.__tree = Tree(tree_structure, pattern, eval_mechanism_params)
+        self.__monitor = TreeStatisticsMonitor(pattern)
+        self.__monitor.set_tree(self.__tree)
+        self.__statistics_collector = None
+        if eval_mechanism_params.statistics_collection_params is not None:
+            self.__statistics_collector = StatisticsCollector(pattern,
+                                                              eval_mechanism_params.statistics_collection_params)
+        self.__event_schema = None
+        self.__migrations_count = 0
+
+    def get_statistics(self):
+        if self.__statistics_collector is None:
+            return None
+        return [self.__statistics_collector.get_statistics()]
+
+    def get_migrations_count(self):
+        """
+        Returns the number of times the evaluation migrated to a new tree.
+        """
+        return self.__migrations_count
+
+    def eval(self, events: Stream, matches: Stream):
+        event_dispatcher = EventDispatcher(self.__tree.get_leaves())
+        reoptimization_interval = self.__adaptation_params.reoptimization_interval
+        measurement_start = None
+
+        is_schema_checked = False
+        sequence_number = 0
+        last_timestamp = None
+        for event in events:
+            event.sequence_number = sequence_number
+            sequence_number += 1
+            if not is_schema_checked:
+                is_schema_checked = True
+                if isinstance(event.payload, CompactPayload):
+                    self.__event_schema = event.payload.schema
+                    self.__tree.set_event_schema(self.__event_schema)
+                    event_dispatcher.set_event_schema(self.__event_schema)
+                    if self.__statistics_collector is not None:
+                        self.__statistics_collector.set_event_schema(self.__event_schema)
+            if measurement_start is None:
+                measurement_start = event.timestamp
+            elif event.timestamp - measurement_start >= reoptimization_interval:
+                # the tree is replaced before the event arrives, hence the event does not have to be replayed
+                if self.__reoptimize(event.timestamp - measurement_start, event.timestamp):
+                    event_dispatcher = self.__create_event_dispatcher()
+                measurement_start = event.timestamp
+            if event.timestamp != last_timestamp:
+                last_timestamp = event.timestamp
+                self.__tree.clean_expired_partial_matches(last_timestamp)
+            self.__monitor.register_event(event)
+            if self.__statistics_collector is not None:
+                self.__statistics_collector.handle_event(event)
+            for leaf in event_dispatcher.get_accepting_leaves(event):
+                self.__monitor.register_accepted_event(leaf)
+                leaf.handle_verified_event(event)
+                for match in self.__tree.get_matches():
+                    matches.add_item(PatternMatch(match))
+
+        matches.close()
+
+    def __create_event_dispatcher(self):
+        """
+        Creates an event dispatcher for the leaves of the current tree.
+        """
+        event_dispatcher = EventDispatcher(self.__tree.get_leaves())
+        if self.__event_schema is not None:
+            event_dispatcher.set_event_schema(self.__event_schema)
+        return event_dispatcher
+
+    def __reoptimize(self, measurement_duration: timedelta, current_timestamp: datetime):
+        """
+        Invokes the tree builder on the statistics measured during the given duration, and migrates to the new tree if
+        its estimated cost is sufficiently lower than that of the current tree. Returns True if a migration took place
+        and False otherwise.
+        """
+        selectivity_matrix, arrival_rates = self.__monitor.get_statistics(measurement_duration)
+        if self.__statistics_collector is not None:
+            selectivity_matrix, arrival_rates = self.__statistics_collector.get_statistics()
+        if len(arrival_rates) < 2:
+            return False
+        pattern = copy(self.__pattern)
+        pattern.set_statistics(StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES, (selectivity_matrix, arrival_rates))
+        new_tree_structure = self.__tree_structure_builder(pattern)
+        if new_tree_structure == self.__tree_structure:
+            return False
+        window = pattern.window.total_seconds()
+        current_cost = calculate_bushy_tree_cost_function(self.__tree_structure, selectivity_matrix, arrival_rates,
+                                                          window)
+        new_cost = calculate_bushy_tree_cost_function(new_tree_structure, selectivity_matrix, arrival_rates, window)
+        if new_cost > (1 - self.__adaptation_params.min_cost_gain) * current_cost:
+            return False
+        self.__migrate(new_tree_structure, current_timestamp)
+        return True
+
+    def __migrate(self, tree_structure: tuple, current_timestamp: datetime):
+        """
+        Replaces the current tree with a new tree of the given structure, recreating the partial matches that may still
+        be extended by replaying the events within the time window in the order of their arrival.
+        """
+        window = self.__pattern.window
+        expiration_timestamp = None if window == timedelta.max else current_timestamp - window
+        events = {}
+        for leaf in self.__tree.get_leaves():
+            for partial_match in leaf.get_partial_matches():
+                event = partial_match.events[0]
+                if expiration_timestamp is None or event.timestamp >= expiration_timestamp:
+                    events[event.sequence_number] = event
+
+        self.__tree = Tree(tree_structure, self.__pattern, self.__eval_mechanism_params)
+        self.__tree_structure = tree_structure
+        if self.__event_schema is not None:
+            self.__tree.set_event_schema(self.__event_schema)
+        event_dispatcher = self.__create_event_dispatcher()
+        for sequence_number in sorted(events.keys()):
+            event = events[sequence_number]
+            for leaf in event_dispatcher.get_accepting_leaves(event):
+                leaf.handle_verified_event(event)
+                # these matches were already reported by the previous tree
+                for _ in self.__tree.get_matches():
+                    pass
+        self.__monitor.set_tree(self.__tree)
+        self.__migrations_count += 1
@@ -4,7 +4,9 @@ This file contains the implementations of algorithms constructing a generic (bus
 from typing import List
 
 from evaluation.EvaluationMechanismBuilder import EvaluationMechanismBuilder
-from evaluation.TreeBasedEvaluationMechanism import TreeBasedEvaluationMechanism
+from evaluation.AdaptiveEvaluationMechanism import AdaptiveTreeBasedEvaluationMechanism
+from evaluation.TreeBasedEvaluationMechanism import TreeBasedEvaluationMechanism, \
+    MultiPatternTreeBasedEvaluationMechanism
 from base.Pattern import Pattern
 from misc.Utils import get_all_disjoint_sets
 from misc.Statistics import calculate_bushy_tree_cost_function, MissingStatisticsException
@@ -17,16 +19,26 @@ class BushyTreeBuilder(EvaluationMechanismBuilder):
     """
     An abstract class for left-deep tree builders.
     """
-    def build_single_pattern_eval_mechanism(self, pattern: Pattern):
+    def build_single_pattern_eval_mechanism(self, pattern: Pattern, eval_mechanism_params):
+        tree_structure = self._create_tree_structure(pattern)
+        if eval_mechanism_params.adaptation_params is not None:
+            return AdaptiveTreeBasedEvaluationMechanism(pattern, tree_structure, self._create_tree_structure,
+                                                        eval_mechanism_params)
+        return TreeBasedEvaluationMechanism(pattern, tree_structure, eval_mechanism_params)
+
+    def build_multi_pattern_eval_mechanism(self, patterns: List[Pattern], eval_mechanism_params):
+        tree_structures = [self._create_tree_structure(pattern) for pattern in patterns]
+        return MultiPatternTreeBasedEvaluationMechanism(patterns, tree_structures, eval_mechanism_params)
+
+    def _create_tree_structure(self, pattern: Pattern):
+        """
+        Creates a bushy tree structure for the given pattern according to its statistics.
+        """
         if pattern.statistics_type == StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES:
             (selectivityMatrix, arrivalRates) = pattern.statistics
         else:
             raise MissingStatisticsException()
-        tree_structure = self._find_tree(selectivityMatrix, arrivalRates, pattern.window.total_seconds())
-        return TreeBasedEvaluationMechanism(pattern, tree_structure)
-
-    def build_multi_pattern_eval_mechanism(self, patterns: List[Pattern]):
-        raise Exception("Unsupported")
+        return self._find_tree(selectivityMatrix, arrivalRates, pattern.window.total_seconds())
 
     @staticmethod
     def _find_tree(selectivity_matrix: List[List[float]], arrival_rates: List[int], window: int):
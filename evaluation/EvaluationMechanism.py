@@ -11,8 +11,51 @@ class EvaluationMechanism(ABC):
     def eval(self, events: Stream, matches: Stream):
         pass
 
+    def get_statistics(self):
+        """
+        Returns the statistics collected during the evaluation for each pattern, in the format of
+        StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES, or None if no statistics were collected.
+        """
+        return None
+
+    def get_dropped_partial_matches_count(self):
+        """
+        Returns the number of partial matches dropped by load shedding, or None if load shedding is not applied.
+        """
+        return None
+
+    def get_migrations_count(self):
+        """
+        Returns the number of times the evaluation migrated to a new tree, or None if the evaluation is not adaptive.
+        """
+        return None
+
 class NegationMode(Enum):
 
     POST_PROCESSING = 0,
     FIRST_CHANCE = 1
 
+
+class SelectionStrategies(Enum):
+    """
+    The strategies for selecting the events of the input stream that may form a match.
+    SKIP_TILL_ANY_MATCH - any combination of events satisfying the pattern is a match.
+    SKIP_TILL_NEXT_MATCH - (sequence patterns only) each event of a match, except for the first one, must be the first
+    event following the previous event of the match that may extend the events preceding it, i.e., a match never skips
+    an event it could have used.
+    STRICT_CONTIGUITY - the events of a match must be consecutive in the input stream.
+    """
+    SKIP_TILL_ANY_MATCH = 0,
+    SKIP_TILL_NEXT_MATCH = 1,
+    STRICT_CONTIGUITY = 2
+
+
+class ConsumptionPolicies(Enum):
+    """
+    The policies for reusing the events of a match in other matches of the same pattern.
+    REUSE - an event may participate in any number of matches.
+    SINGLE_MATCH - an event may participate in at most one match. The matches completed by the same event are
+    considered in the order of the arrival of their earliest events, and a match whose events were already consumed is dropped.
+    """
+    REUSE = 0,
+    SINGLE_MATCH = 1
@@ -12,5 +12,5 @@ class EvaluationMechanismBuilder(ABC):
     def build_single_pattern_eval_mechanism(self, pattern: Pattern, eval_mechanism_params):
         pass
 
-    def build_multi_pattern_eval_mechanism(self, patterns: List[Pattern]):
+    def build_multi_pattern_eval_mechanism(self, patterns: List[Pattern], eval_mechanism_params):
         pass
@@ -7,7 +7,11 @@ from evaluation.IterativeImprovement import IterativeImprovementType
 from evaluation.LeftDeepTreeBuilders import IterativeImprovementInitType, TrivialLeftDeepTreeBuilder, \
     AscendingFrequencyTreeBuilder, GreedyLeftDeepTreeBuilder, IterativeImprovementLeftDeepTreeBuilder, \
     DynamicProgrammingLeftDeepTreeBuilder
-from evaluation.EvaluationMechanism import NegationMode
+from evaluation.LazyEvaluationMechanism import LazyEvaluationMechanismBuilder
+from evaluation.AdaptiveEvaluationMechanism import AdaptationParameters
+from evaluation.LoadShedding import LoadSheddingParameters, LoadSheddingStrategies
+from misc.StatisticsCollector import StatisticsCollectionParameters
+from evaluation.EvaluationMechanism import NegationMode, SelectionStrategies, ConsumptionPolicies
 
 
 class EvaluationMechanismTypes(Enum):
@@ -21,18 +25,43 @@ class EvaluationMechanismTypes(Enum):
     DYNAMIC_PROGRAMMING_LEFT_DEEP_TREE = 4,
     DYNAMIC_PROGRAMMING_BUSHY_TREE = 5,
     ZSTREAM_BUSHY_TREE = 6,
-    ORDERED_ZSTREAM_BUSHY_TREE = 7
+    ORDERED_ZSTREAM_BUSHY_TREE = 7,
+    LAZY_EVALUATION = 8
 
 
 class EvaluationMechanismParameters:
     """
     Parameters for the evaluation mechanism builder.
-
+    The selection strategy and the consumption policy are only supported by the tree-based evaluation mechanisms, for
+    patterns without negative events.
+    If adaptation parameters are given, the evaluation tree of a single pattern is periodically re-optimized according
+    to the statistics measured during the evaluation (see AdaptiveEvaluationMechanism).
+    If statistics collection parameters are given, the tree-based evaluation mechanisms collect the arrival rates and
+    the selectivities of each pattern online (see StatisticsCollector). The adaptive mode then relies on them as well.
+    If load shedding parameters are given, the memory consumed by the partial matches of the tree-based evaluation
+    mechanism of a single pattern is bounded, at the cost of missing some of the matches (see LoadShedding).
+    If micro-batching is requested, the tree-based evaluation mechanism of a single pattern evaluates the events sharing
+    a timestamp as a batch, joined with the partial matches of each node at once through NumPy arrays (see
+    TreeBasedEvaluationMechanism). It is not supported for patterns with negative events, nor in combination with
+    selection strategies, consumption policies, adaptation or load shedding. Without NumPy, the events are evaluated one
+    by one as usual.
     """
     def __init__(self, eval_mechanism_type: EvaluationMechanismTypes = EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE,
-                 negation_mode: NegationMode = NegationMode.POST_PROCESSING):
+                 negation_mode: NegationMode = NegationMode.POST_PROCESSING,
+                 selection_strategy: SelectionStrategies = SelectionStrategies.SKIP_TILL_ANY_MATCH,
+                 consumption_policy: ConsumptionPolicies = ConsumptionPolicies.REUSE,
+                 adaptation_params: AdaptationParameters = None,
+                 statistics_collection_params: StatisticsCollectionParameters = None,
+                 load_shedding_params: LoadSheddingParameters = None,
+                 micro_batching: bool = False):
         self.type = eval_mechanism_type
         self.negation_mode = negation_mode
+        self.selection_strategy = selection_strategy
+        self.consumption_policy = consumption_policy
+        self.adaptation_params = adaptation_params
+        self.statistics_collection_params = statistics_collection_params
+        self.load_shedding_params = load_shedding_params
+        self.micro_batching = micro_batching
 
 
 class IterativeImprovementEvaluationMechanismParameters(EvaluationMechanismParameters):
@@ -67,7 +96,7 @@ class EvaluationMechanismFactory:
                                            patterns: List[Pattern]):
         return EvaluationMechanismFactory. \
             __create_eval_mechanism_builder(eval_mechanism_type, eval_mechanism_params). \
-            build_multi_pattern_eval_mechanism(patterns)
+            build_multi_pattern_eval_mechanism(patterns, eval_mechanism_params)
 
     @staticmethod
     def __create_eval_mechanism_builder(eval_mechanism_type: EvaluationMechanismTypes,
@@ -92,6 +121,8 @@ class EvaluationMechanismFactory:
             return ZStreamTreeBuilder()
         if eval_mechanism_params.type == EvaluationMechanismTypes.ORDERED_ZSTREAM_BUSHY_TREE:
             return ZStreamOrdTreeBuilder()
+        if eval_mechanism_params.type == EvaluationMechanismTypes.LAZY_EVALUATION:
+            return LazyEvaluationMechanismBuilder()
         return None
 
     @staticmethod
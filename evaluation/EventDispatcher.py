@@ -0,0 +1,182 @@
+"""
+This file contains the dispatcher routing the incoming events to the leaves of the evaluation trees.
+A single dispatcher serves all the trees of an evaluation mechanism. It maps each event type to the groups of leaves
+expecting events of this type, such that an event only reaches the leaves interested in it. The leaves verifying
+equivalent conditions on their events are grouped together, and the condition is only evaluated once for the whole
+group. The leaves comparing the same attribute against different constants (e.g., a.x < 5 and b.x < 7) are stored in a
+threshold index, where the leaves satisfied by an event are found by a binary search.
+"""
+from bisect import bisect_left, bisect_right
+from typing import List
+
+from base.Event import Event
+from base.EventSchema import EventSchema
+from base.Formula import Formula, AtomicTerm, IdentifierTerm, TrueFormula, SmallerThanFormula, \
+    SmallerThanEqFormula, GreaterThanFormula, GreaterThanEqFormula
+
+
+class LeafGroup:
+    """
+    An abstract class for a group of leaves expecting events of the same type.
+    """
+    def add_accepting_leaves(self, event: Event, accepting_leaves: list):
+        """
+        Appends the leaves of this group whose conditions are satisfied by the given event to the given list.
+        """
+        raise NotImplementedError()
+
+    def set_event_schema(self, schema: EventSchema):
+        """
+        Adapts this group to events whose payloads follow the given schema.
+        """
+        pass
+
+
+class ConditionLeafGroup(LeafGroup):
+    """
+    A group of leaves verifying equivalent conditions. The condition is evaluated by the first leaf on behalf of all.
+    """
+    def __init__(self, leaves: list):
+        self.__leaves = leaves
+        self.__is_unconditional = type(leaves[0].get_condition()) == TrueFormula
+
+    def add_accepting_leaves(self, event: Event, accepting_leaves: list):
+        if self.__is_unconditional or self.__leaves[0].verify_condition(event):
+            accepting_leaves.extend(self.__leaves)
+
+
+class ThresholdLeafGroup(LeafGroup):
+    """
+    A group of leaves whose conditions compare the same attribute against numeric constants using the same relation
+    (e.g., a.x < 5, b.x < 7 and c.x < 7). The leaves are sorted by their thresholds, such that the leaves satisfied by
+    an event form a prefix or a suffix of this order, located by a binary search over the thresholds.
+    """
+    def __init__(self, term: IdentifierTerm, relation_type: type, leaves_and_thresholds: List[tuple]):
+        self.__term = term
+        self.__compiled_term = term.compile({term.name: 0})
+        self.__relation_type = relation_type
+        leaves_and_thresholds = sorted(leaves_and_thresholds, key=lambda x: x[1])
+        self.__leaves = [leaf for leaf, _ in leaves_and_thresholds]
+        self.__thresholds = [threshold for _, threshold in leaves_and_thresholds]
+
+    def set_event_schema(self, schema: EventSchema):
+        self.__compiled_term = self.__term.compile({self.__term.name: 0}, schema)
+
+    def add_accepting_leaves(self, event: Event, accepting_leaves: list):
+        value = self.__compiled_term([event])
+        if type(value) != int and type(value) != float or value != value:
+            # the thresholds cannot be ordered with respect to this value
+            accepting_leaves.extend(leaf for leaf in self.__leaves if leaf.verify_condition(event))
+            return
+        # the conditions are of the form "value <relation> threshold"
+        if self.__relation_type == SmallerThanFormula:
+            accepting_leaves.extend(self.__leaves[bisect_right(self.__thresholds, value):])
+        elif self.__relation_type == SmallerThanEqFormula:
+            accepting_leaves.extend(self.__leaves[bisect_left(self.__thresholds, value):])
+        elif self.__relation_type == GreaterThanFormula:
+            accepting_leaves.extend(self.__leaves[:bisect_left(self.__thresholds, value)])
+        else:
+            accepting_leaves.extend(self.__leaves[:bisect_right(self.__thresholds, value)])
+
+
+class EventDispatcher:
+    """
+    Routes each incoming event to the leaves whose event type and condition it matches.
+    """
+    __RELATION_TYPES = (SmallerThanFormula, SmallerThanEqFormula, GreaterThanFormula, GreaterThanEqFormula)
+    __FLIPPED_RELATION_TYPES = {
+        SmallerThanFormula: GreaterThanFormula,
+        SmallerThanEqFormula: GreaterThanEqFormula,
+        GreaterThanFormula: SmallerThanFormula,
+        GreaterThanEqFormula: SmallerThanEqFormula,
+    }
+
+    def __init__(self, leaves: list):
+        # the position of each leaf in the given list, determining the order in which the leaves receive an event
+        self.__leaf_ranks = {}
+        leaves_by_event_type = {}
+        for leaf in leaves:
+            if leaf in self.__leaf_ranks:
+                continue
+            self.__leaf_ranks[leaf] = len(self.__leaf_ranks)
+            leaves_by_event_type.setdefault(leaf.get_event_type(), []).append(leaf)
+        self.__groups = {event_type: EventDispatcher.__create_groups(leaves_of_type)
+                         for event_type, leaves_of_type in leaves_by_event_type.items()}
+
+    @staticmethod
+    def __create_groups(leaves: list):
+        """
+        Partitions the given leaves, all expecting the same event type, into groups sharing their condition evaluation.
+        """
+        threshold_candidates = {}
+        for leaf in leaves:
+            threshold_condition = EventDispatcher.__get_threshold_condition(leaf.get_condition(), leaf.get_event_name())
+            if threshold_condition is None:
+                continue
+            key, term, relation_type, threshold = threshold_condition
+            threshold_candidates.setdefault(key, (term, relation_type, []))[2].append((leaf, threshold))
+
+        groups, grouped_leaves = [], set()
+        for term, relation_type, leaves_and_thresholds in threshold_candidates.values():
+            if len(leaves_and_thresholds) < 2:
+                continue
+            groups.append((leaves_and_thresholds[0][0], ThresholdLeafGroup(term, relation_type, leaves_and_thresholds)))
+            grouped_leaves.update(leaf for leaf, _ in leaves_and_thresholds)
+
+        leaves_by_condition = {}
+        for leaf in leaves:
+            if leaf in grouped_leaves:
+                continue
+            signature = leaf.get_condition().get_signature({leaf.get_event_name(): 0})
+            leaves_by_condition.setdefault(signature, []).append(leaf)
+        groups.extend((leaves_of_condition[0], ConditionLeafGroup(leaves_of_condition))
+                      for leaves_of_condition in leaves_by_condition.values())
+
+        # the groups are ordered by their first leaves
+        leaf_positions = {leaves[i]: i for i in range(len(leaves))}
+        groups.sort(key=lambda x: leaf_positions[x[0]])
+        return [group for _, group in groups]
+
+    @staticmethod
+    def __get_threshold_condition(condition: Formula, event_name: str):
+        """
+        If the given condition compares an attribute of the event against a numeric constant, returns a key identifying
+        the compared attribute and the relation, the attribute term, the relation normalized to the form
+        "attribute <relation> constant", and the constant. Otherwise, returns None.
+        """
+        relation_type = type(condition)
+        if relation_type not in EventDispatcher.__RELATION_TYPES:
+            return None
+        term, constant = condition.left_term, condition.right_term
+        if type(term) == AtomicTerm:
+            term, constant = constant, term
+            relation_type = EventDispatcher.__FLIPPED_RELATION_TYPES[relation_type]
+        if type(term) != IdentifierTerm or type(constant) != AtomicTerm:
+            return None
+        threshold = constant.value
+        if type(threshold) != int and type(threshold) != float or threshold != threshold:
+            return None
+        return (term.get_signature({event_name: 0}), relation_type), term, relation_type, threshold
+
+    def set_event_schema(self, schema: EventSchema):
+        """
+        Adapts the dispatcher to events whose payloads follow the given schema.
+        """
+        for groups in self.__groups.values():
+            for group in groups:
+                group.set_event_schema(schema)
+
+    def get_accepting_leaves(self, event: Event):
+        """
+        Returns the leaves that should receive the given event, i.e., expect its type and have their conditions
+        satisfied by it, in the order of their registration.
+        """
+        groups = self.__groups.get(event.event_type)
+        if groups is None:
+            return []
+        accepting_leaves = []
+        for group in groups:
+            group.add_accepting_leaves(event, accepting_leaves)
+        if len(groups) > 1 and len(accepting_leaves) > 1:
+            accepting_leaves.sort(key=self.__leaf_ranks.__getitem__)
+        return accepting_leaves
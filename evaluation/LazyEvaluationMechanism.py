@@ -0,0 +1,270 @@
+"""
+This file contains the lazy evaluation mechanism.
+Unlike the tree-based evaluation mechanism, which eagerly combines each incoming event with all the partial matches it
+may extend, the lazy evaluation mechanism does not store partial matches at all. The events are only buffered, and a
+match is constructed once its last event arrives. The events bound to the rest of the pattern are looked up in the
+buffers in the order of ascending arrival rates, such that the rarest event types are examined first and the
+construction is abandoned as soon as no buffered event can be bound to some item of the pattern.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from functools import reduce
+from typing import List
+
+from base.Event import Event
+from base.EventSchema import EventSchema, CompactPayload
+from base.Formula import Formula, AndFormula, TrueFormula
+from base.Pattern import Pattern
+from base.PatternMatch import PatternMatch
+from base.PatternStructure import SeqOperator, QItem
+from evaluation.EvaluationMechanism import EvaluationMechanism, SelectionStrategies, ConsumptionPolicies
+from evaluation.EvaluationMechanismBuilder import EvaluationMechanismBuilder
+from misc.IOUtils import Stream
+from misc.StatisticsTypes import StatisticsTypes
+
+
+class EventBuffer:
+    """
+    The events that may be bound to a single item of a pattern, sorted by their timestamps.
+    Expired events are discarded by advancing the start position of the buffer, which is compacted once the discarded
+    events make up most of it.
+    """
+    __MAX_EXPIRED_EVENTS = 1024
+
+    def __init__(self):
+        self.events = []
+        self.timestamps = []
+        self.start = 0
+
+    def add(self, event: Event, expiration_timestamp=None):
+        """
+        Appends the given event to the buffer, discarding the events preceding the given expiration timestamp.
+        """
+        if expiration_timestamp is not None:
+            self.start = bisect_left(self.timestamps, expiration_timestamp, self.start)
+            if self.start >= EventBuffer.__MAX_EXPIRED_EVENTS and 2 * self.start >= len(self.events):
+                del self.events[:self.start]
+                del self.timestamps[:self.start]
+                self.start = 0
+        self.events.append(event)
+        self.timestamps.append(event.timestamp)
+
+    def get_range(self, min_timestamp=None, max_timestamp=None):
+        """
+        Returns the range of positions of the buffered events whose timestamps are within the given bounds.
+        """
+        first = self.start if min_timestamp is None else bisect_left(self.timestamps, min_timestamp, self.start)
+        last = len(self.timestamps) if max_timestamp is None else bisect_right(self.timestamps, max_timestamp, first)
+        return first, last
+
+
+class LazyPatternMatcher:
+    """
+    Detects the matches of a single pattern using a buffer of events for each of its items.
+    Upon the arrival of an event, only the matches in which it is the last event to arrive are constructed. The event
+    is bound to some item (the trigger item), and the rest of the items are bound to buffered events in the order of
+    ascending arrival rates. Each part of the condition is verified as soon as all the events it refers to are bound,
+    and the parts referring to a single event are verified before the event is buffered.
+    """
+    def __init__(self, pattern: Pattern):
+        if len(pattern.negative_event.get_args()) > 0:
+            raise NotImplementedError("Negation is not supported by the lazy evaluation mechanism")
+        self.__qitems = pattern.structure.args
+        for qitem in self.__qitems:
+            if type(qitem) != QItem:
+                raise NotImplementedError("Nested operators are not supported by the lazy evaluation mechanism")
+        self.__window = None if pattern.window == timedelta.max else pattern.window
+        self.__is_seq = pattern.structure.get_top_operator() == SeqOperator
+        self.__name_to_index = {self.__qitems[i].name: i for i in range(len(self.__qitems))}
+        self.__buffers = [EventBuffer() for _ in self.__qitems]
+        self.__indices_by_event_type = {}
+        for i in range(len(self.__qitems)):
+            self.__indices_by_event_type.setdefault(self.__qitems[i].event_type, []).append(i)
+
+        conjuncts = [] if pattern.condition is None else pattern.condition.get_conjuncts()
+        self.__conjuncts = [conjunct for conjunct in conjuncts if type(conjunct) != TrueFormula]
+        # the indices of the items each part of the condition refers to
+        self.__conjunct_indices = [self.__get_referred_indices(conjunct) for conjunct in self.__conjuncts]
+        arrival_rates = LazyPatternMatcher.__get_arrival_rates(pattern)
+        # the order in which the items are bound when each of the items is the trigger item
+        self.__evaluation_orders = [
+            [trigger_index] + sorted([i for i in range(len(self.__qitems)) if i != trigger_index],
+                                     key=lambda i: arrival_rates[i])
+            for trigger_index in range(len(self.__qitems))]
+        self.__item_conditions = None
+        self.__step_conditions = None
+        self.set_event_schema(None)
+
+    def __get_referred_indices(self, conjunct: Formula):
+        """
+        Returns the set of the indices of the items the given part of the condition refers to. A condition whose
+        structure is unknown is considered to refer to all items.
+        """
+        names = set(self.__name_to_index.keys())
+        return {self.__name_to_index[name] for name in names if conjunct.get_formula_of(names - {name}) is None}
+
+    @staticmethod
+    def __get_arrival_rates(pattern: Pattern):
+        """
+        Returns the arrival rate of each item of the given pattern according to its statistics. Without statistics,
+        all rates are equal and the items are bound in the order of their appearance in the pattern.
+        """
+        qitems = pattern.structure.args
+        if pattern.statistics_type == StatisticsTypes.ARRIVAL_RATES:
+            return list(pattern.statistics)
+        if pattern.statistics_type == StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES:
+            return list(pattern.statistics[1])
+        if pattern.statistics_type == StatisticsTypes.FREQUENCY_DICT:
+            return [pattern.statistics[qitem.event_type] for qitem in qitems]
+        return [0] * len(qitems)
+
+    def set_event_schema(self, schema: EventSchema = None):
+        """
+        Compiles the conditions of the pattern for events whose payloads follow the given schema (or for dictionary
+        payloads if no schema is given).
+        """
+        # the condition of each item is applied to the event alone
+        self.__item_conditions = [self.__compile_conjuncts(lambda indices: indices <= {i},
+                                                           {self.__qitems[i].name: 0}, schema)
+                                  for i in range(len(self.__qitems))]
+        self.__step_conditions = []
+        for order in self.__evaluation_orders:
+            conditions = [None]
+            for step in range(1, len(order)):
+                bound_indices, previously_bound_indices = set(order[:step + 1]), set(order[:step])
+                conditions.append(self.__compile_conjuncts(
+                    lambda indices: len(indices) > 1 and indices <= bound_indices and
+                    not indices <= previously_bound_indices, self.__name_to_index, schema))
+            self.__step_conditions.append(conditions)
+
+    def __compile_conjuncts(self, should_include: callable, name_to_index: dict, schema: EventSchema):
+        """
+        Compiles the conjunction of the parts of the condition whose item indices are accepted by the given function,
+        or returns None if there are no such parts.
+        """
+        conjuncts = [self.__conjuncts[i] for i in range(len(self.__conjuncts))
+                     if should_include(self.__conjunct_indices[i])]
+        if len(conjuncts) == 0:
+            return None
+        return reduce(AndFormula, conjuncts).compile(name_to_index, schema)
+
+    def get_event_types(self):
+        """
+        Returns the types of the events referred to by the pattern.
+        """
+        return self.__indices_by_event_type.keys()
+
+    def handle_event(self, event: Event):
+        """
+        Buffers the given event and returns the matches completed by it, each given as a list of events ordered as
+        the items of the pattern.
+        """
+        expiration_timestamp = None if self.__window is None else event.timestamp - self.__window
+        trigger_indices = []
+        for i in self.__indices_by_event_type[event.event_type]:
+            if self.__item_conditions[i] is None or self.__item_conditions[i]([event]):
+                self.__buffers[i].add(event, expiration_timestamp)
+                trigger_indices.append(i)
+        matches = []
+        for trigger_index in trigger_indices:
+            binding = [None] * len(self.__qitems)
+            binding[trigger_index] = event
+            self.__extend_match(trigger_index, 1, binding, event.timestamp, event.timestamp, matches)
+        return matches
+
+    def __extend_match(self, trigger_index: int, step: int, binding: List[Event],
+                       min_timestamp, max_timestamp, matches: list):
+        """
+        Binds the item of the given step of the evaluation order to each of the fitting buffered events, and continues
+        to the next step. Each complete binding is added to the given list of matches.
+        """
+        order = self.__evaluation_orders[trigger_index]
+        if step == len(order):
+            matches.append(list(binding))
+            return
+        index = order[step]
+        lower_bound, upper_bound = None, None
+        if self.__window is not None:
+            lower_bound, upper_bound = max_timestamp - self.__window, min_timestamp + self.__window
+        if self.__is_seq:
+            # the events must appear in the order of the items
+            for i in range(index):
+                if binding[i] is not None and (lower_bound is None or binding[i].timestamp > lower_bound):
+                    lower_bound = binding[i].timestamp
+            for i in range(index + 1, len(binding)):
+                if binding[i] is not None and (upper_bound is None or binding[i].timestamp < upper_bound):
+                    upper_bound = binding[i].timestamp
+        buffer = self.__buffers[index]
+        first, last = buffer.get_range(lower_bound, upper_bound)
+        condition = self.__step_conditions[trigger_index][step]
+        trigger_event = binding[trigger_index]
+        for position in range(first, last):
+            candidate = buffer.events[position]
+            if candidate is trigger_event and index < trigger_index:
+                # this binding is constructed when the event is bound to the earlier item as the trigger
+                continue
+            binding[index] = candidate
+            if condition is None or condition(binding):
+                timestamp = candidate.timestamp
+                self.__extend_match(trigger_index, step + 1, binding, min(min_timestamp, timestamp),
+                                    max(max_timestamp, timestamp), matches)
+        binding[index] = None
+
+
+class LazyEvaluationMechanism(EvaluationMechanism):
+    """
+    An evaluation mechanism detecting the matches of each of the given patterns by a lazy pattern matcher.
+    """
+    def __init__(self, patterns: List[Pattern]):
+        self.__matchers = [LazyPatternMatcher(pattern) for pattern in patterns]
+        self.__is_multi_pattern = len(patterns) > 1
+
+    def eval(self, events: Stream, matches: Stream):
+        event_types_listeners = {}
+        for i in range(len(self.__matchers)):
+            for event_type in self.__matchers[i].get_event_types():
+                event_types_listeners.setdefault(event_type, []).append(i)
+
+        is_schema_checked = False
+        for event in events:
+            if not is_schema_checked:
+                is_schema_checked = True
+                if isinstance(event.payload, CompactPayload):
+                    for matcher in self.__matchers:
+                        matcher.set_event_schema(event.payload.schema)
+            listeners = event_types_listeners.get(event.event_type)
+            if listeners is None:
+                continue
+            for i in listeners:
+                for match in self.__matchers[i].handle_event(event):
+                    matches.add_item(PatternMatch(match, i if self.__is_multi_pattern else None))
+
+        matches.close()
+
+
+class LazyEvaluationMechanismBuilder(EvaluationMechanismBuilder):
+    """
+    Creates a lazy evaluation mechanism.
+    """
+    def build_single_pattern_eval_mechanism(self, pattern: Pattern, eval_mechanism_params):
+        LazyEvaluationMechanismBuilder.__verify_parameters(eval_mechanism_params)
+        return LazyEvaluationMechanism([pattern])
+
+    def build_multi_pattern_eval_mechanism(self, patterns: List[Pattern], eval_mechanism_params):
+        LazyEvaluationMechanismBuilder.__verify_parameters(eval_mechanism_params)
+        return LazyEvaluationMechanism(patterns)
+
+    @staticmethod
+    def __verify_parameters(eval_mechanism_params):
+        if eval_mechanism_params is None:
+            return
+        if eval_mechanism_params.selection_strategy != SelectionStrategies.SKIP_TILL_ANY_MATCH or \
+                eval_mechanism_params.consumption_policy != ConsumptionPolicies.REUSE:
+            raise NotImplementedError("Selection strategies and consumption policies are not supported by the lazy "
+                                      "evaluation mechanism")
+        if eval_mechanism_params.adaptation_params is not None:
+            raise NotImplementedError("The lazy evaluation mechanism is not adaptive")
+        if eval_mechanism_params.load_shedding_params is not None:
+            raise NotImplementedError("Load shedding is not supported by the lazy evaluation mechanism")
+        if eval_mechanism_params.micro_batching:
+            raise NotImplementedError("The micro-batch mode is not supported by the lazy evaluation mechanism")
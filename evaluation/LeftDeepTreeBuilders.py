@@ -6,8 +6,10 @@ import random
 from typing import List
 
 from evaluation.IterativeImprovement import IterativeImprovementType, IterativeImprovementAlgorithmBuilder
-from evaluation.TreeBasedEvaluationMechanism import TreeBasedEvaluationMechanism
+from evaluation.TreeBasedEvaluationMechanism import TreeBasedEvaluationMechanism, \
+    MultiPatternTreeBasedEvaluationMechanism
 from evaluation.EvaluationMechanismBuilder import EvaluationMechanismBuilder
+from evaluation.AdaptiveEvaluationMechanism import AdaptiveTreeBasedEvaluationMechanism
 from base.Pattern import Pattern
 from misc.Statistics import calculate_left_deep_tree_cost_function, MissingStatisticsException
 from misc.StatisticsTypes import StatisticsTypes
@@ -19,12 +21,22 @@ class LeftDeepTreeBuilder(EvaluationMechanismBuilder):
     An abstract class for left-deep tree builders.
     """
     def build_single_pattern_eval_mechanism(self, pattern: Pattern, eval_mechanism_params):
-        order = self._create_evaluation_order(pattern)
-        tree_structure = self.__build_tree_from_order(order)
+        tree_structure = self._create_tree_structure(pattern)
+        if eval_mechanism_params.adaptation_params is not None:
+            return AdaptiveTreeBasedEvaluationMechanism(pattern, tree_structure, self._create_tree_structure,
+                                                        eval_mechanism_params)
         return TreeBasedEvaluationMechanism(pattern, tree_structure, eval_mechanism_params)
 
-    def build_multi_pattern_eval_mechanism(self, patterns: List[Pattern]):
-        raise Exception("Unsupported")
+    def build_multi_pattern_eval_mechanism(self, patterns: List[Pattern], eval_mechanism_params):
+        tree_structures = [self._create_tree_structure(pattern) for pattern in patterns]
+        return MultiPatternTreeBasedEvaluationMechanism(patterns, tree_structures, eval_mechanism_params)
+
+    def _create_tree_structure(self, pattern: Pattern):
+        """
+        Creates a left-deep tree structure for the given pattern.
+        """
+        order = self._create_evaluation_order(pattern)
+        return self.__build_tree_from_order(order)
 
     @staticmethod
     def __build_tree_from_order(order: List[int]):
@@ -60,8 +72,12 @@ class AscendingFrequencyTreeBuilder(LeftDeepTreeBuilder):
         if pattern.statistics_type == StatisticsTypes.FREQUENCY_DICT:
             frequency_dict = pattern.statistics
             order = get_order_by_occurrences(pattern.structure.args, frequency_dict)
-        elif pattern.statistics_type == StatisticsTypes.ARRIVAL_RATES:
+        elif pattern.statistics_type == StatisticsTypes.ARRIVAL_RATES or \
+                pattern.statistics_type == StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES:
+            # the arrival rates are also available along with a selectivity matrix, e.g., measured by the adaptive mode
             arrival_rates = pattern.statistics
+            if pattern.statistics_type == StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES:
+                arrival_rates = pattern.statistics[1]
             # create an index-arrival rate binding and sort according to arrival rate.
             sorted_order = sorted([(i, arrival_rates[i]) for i in range(len(arrival_rates))], key=lambda x: x[1])
             order = [x for x, y in sorted_order]  # create order from sorted binding.
@@ -0,0 +1,137 @@
+"""
+This file contains the load shedding mechanism, bounding the memory consumed by the partial matches of an evaluation
+tree. Once the number of partial matches buffered by a node, or by the whole tree, exceeds its budget, some of them are
+dropped according to the chosen strategy. The partial matches of the leaves are the buffered input events, hence input
+events are shed as well.
+Shedding may only cause matches to be missed, never reported falsely. Therefore, it is not supported for patterns with
+negative events, nor under selection strategies whose constraints depend on the buffered events.
+"""
+import heapq
+import random
+from datetime import timedelta, datetime
+from enum import Enum
+
+from evaluation.PartialMatch import PartialMatch
+
+
+class LoadSheddingStrategies(Enum):
+    """
+    The strategies for choosing the partial matches to drop once a budget is exceeded.
+    OLDEST_FIRST - the partial matches with the earliest events are dropped, as they are the closest to expiration.
+    RANDOM - the partial matches are drawn uniformly at random.
+    LOWEST_UTILITY - the partial matches least likely to contribute to future matches are dropped (see
+    LoadShedder.get_utility).
+    """
+    OLDEST_FIRST = 0,
+    RANDOM = 1,
+    LOWEST_UTILITY = 2
+
+
+class LoadSheddingParameters:
+    """
+    Parameters of the load shedding mechanism:
+    - the maximal number of partial matches buffered by each node (None for no limit);
+    - the maximal total number of partial matches buffered by the tree (None for no limit);
+    - the strategy for choosing the partial matches to drop.
+    """
+    def __init__(self, max_partial_matches_per_node: int = None, max_partial_matches: int = None,
+                 strategy: LoadSheddingStrategies = LoadSheddingStrategies.OLDEST_FIRST):
+        if max_partial_matches_per_node is None and max_partial_matches is None:
+            raise Exception("No memory budget is provided for load shedding")
+        for budget in (max_partial_matches_per_node, max_partial_matches):
+            if budget is not None and budget < 1:
+                raise Exception("The memory budget for load shedding must be positive")
+        self.max_partial_matches_per_node = max_partial_matches_per_node
+        self.max_partial_matches = max_partial_matches
+        self.strategy = strategy
+
+
+class LoadShedder:
+    """
+    Enforces the memory budgets of an evaluation tree and counts the dropped partial matches.
+    Once a budget is exceeded, the partial matches are shed until the buffer is SHEDDING_MARGIN below the budget, such
+    that the cost of choosing them is amortized over the following insertions.
+    """
+    SHEDDING_MARGIN = 0.1
+
+    def __init__(self, params: LoadSheddingParameters, pattern_size: int, sliding_window: timedelta):
+        self.__params = params
+        self.__pattern_size = pattern_size
+        self.__sliding_window = sliding_window
+        self.__dropped_partial_matches_count = 0
+
+    def get_dropped_partial_matches_count(self):
+        """
+        Returns the number of partial matches dropped so far.
+        """
+        return self.__dropped_partial_matches_count
+
+    def has_total_budget(self):
+        """
+        Returns True if the total number of partial matches in the tree is limited and False otherwise.
+        """
+        return self.__params.max_partial_matches is not None
+
+    def handle_new_partial_match(self, node, partial_match: PartialMatch):
+        """
+        Enforces the budget of the given node after the given partial match was added to it. The new partial match is
+        never dropped, as it is yet to be joined with the partial matches of the other nodes.
+        """
+        max_partial_matches = self.__params.max_partial_matches_per_node
+        if max_partial_matches is not None and len(node.get_partial_matches()) > max_partial_matches:
+            self.__shed([node], max_partial_matches, partial_match.last_timestamp, partial_match)
+
+    def shed(self, nodes: list, current_timestamp: datetime):
+        """
+        Enforces the total budget of the given nodes.
+        """
+        max_partial_matches = self.__params.max_partial_matches
+        if max_partial_matches is not None and \
+                sum(len(node.get_partial_matches()) for node in nodes) > max_partial_matches:
+            self.__shed(nodes, max_partial_matches, current_timestamp)
+
+    def get_utility(self, partial_match: PartialMatch, current_timestamp: datetime):
+        """
+        Estimates the contribution of the given partial match to future matches. A partial match is more useful the
+        more events of the pattern it already contains, the longer it has until expiration, and the more partial matches
+        it was joined into so far (an indication that it tends to satisfy the conditions of the pattern).
+        """
+        utility = (1 + partial_match.joins_count) * len(partial_match.events) / self.__pattern_size
+        if self.__sliding_window == timedelta.max:
+            return utility
+        window = self.__sliding_window.total_seconds()
+        if window == 0:
+            return utility
+        remaining = (partial_match.first_timestamp + self.__sliding_window - current_timestamp).total_seconds()
+        return utility * max(remaining, 0) / window
+
+    def __shed(self, nodes: list, budget: int, current_timestamp: datetime,
+               protected_partial_match: PartialMatch = None):
+        """
+        Drops partial matches of the given nodes according to the strategy, until their total number is the given
+        budget minus the shedding margin (but at least one partial match is kept). The protected partial match, if
+        given, is not dropped.
+        """
+        partial_matches_count = sum(len(node.get_partial_matches()) for node in nodes)
+        excess = partial_matches_count - max(1, int(budget * (1 - LoadShedder.SHEDDING_MARGIN)))
+        if excess <= 0:
+            return
+        candidates = [(node, pm) for node in nodes for pm in node.get_partial_matches()
+                      if pm is not protected_partial_match]
+        strategy = self.__params.strategy
+        if strategy == LoadSheddingStrategies.OLDEST_FIRST:
+            victims = heapq.nsmallest(excess, candidates, key=lambda candidate: candidate[1].first_timestamp)
+        elif strategy == LoadSheddingStrategies.RANDOM:
+            victims = random.sample(candidates, excess)
+        elif strategy == LoadSheddingStrategies.LOWEST_UTILITY:
+            victims = heapq.nsmallest(excess, candidates,
+                                      key=lambda candidate: self.get_utility(candidate[1], current_timestamp))
+        else:
+            raise Exception("Unknown load shedding strategy: %s" % (strategy,))
+        victims_by_node = {}
+        for node, pm in victims:
+            victims_by_node.setdefault(node, []).append(pm)
+        for node, partial_matches in victims_by_node.items():
+            node.drop_partial_matches(partial_matches)
+        self.__dropped_partial_matches_count += len(victims)
+
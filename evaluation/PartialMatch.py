@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List
 
 from base.Event import Event
@@ -6,8 +7,17 @@ from base.Event import Event
 class PartialMatch:
     """
     A partial match created at some intermediate stage during evaluation.
+    A partial match joining two others may be given the bounds of its timestamps, derived from theirs, such that its
+    events are not scanned for them.
     """
-    def __init__(self, events: List[Event]):
+    __slots__ = ("events", "first_timestamp", "last_timestamp", "joins_count")
+
+    def __init__(self, events: List[Event], first_timestamp: datetime = None, last_timestamp: datetime = None):
         self.events = events
-        self.last_timestamp = max(events, key=lambda x: x.timestamp).timestamp
-        self.first_timestamp = min(events, key=lambda x: x.timestamp).timestamp
+        if first_timestamp is None or last_timestamp is None:
+            timestamps = [event.timestamp for event in events]
+            first_timestamp, last_timestamp = min(timestamps), max(timestamps)
+        self.first_timestamp = first_timestamp
+        self.last_timestamp = last_timestamp
+        # the number of partial matches this one was joined into, used for estimating its utility when shedding load
+        self.joins_count = 0
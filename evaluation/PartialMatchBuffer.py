@@ -0,0 +1,109 @@
+from datetime import datetime
+from itertools import islice
+from typing import List, Iterable
+
+from evaluation.PartialMatch import PartialMatch
+
+
+class PartialMatchBuffer:
+    """
+    A sequence of partial matches sorted by the timestamps of their earliest events, where partial matches sharing
+    this timestamp are kept in the order of their insertion.
+    The partial matches are stored in a list read from a head position. Removing the oldest partial matches, as done
+    upon expiration, merely advances the head, and the list is only compacted once the removed partial matches make up
+    at least half of it. Hence, each partial match is moved a constant number of times on average, rather than whenever
+    an older one expires. Inserting a partial match not older than the rest, which is the common case, is an append.
+    """
+    def __init__(self, partial_matches: List[PartialMatch] = None):
+        self.__items = [] if partial_matches is None else partial_matches
+        self.__head = 0
+
+    def __len__(self):
+        return len(self.__items) - self.__head
+
+    def __iter__(self):
+        if self.__head == 0:
+            return iter(self.__items)
+        return islice(self.__items, self.__head, None)
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("Partial match buffer index out of range")
+        return self.__items[self.__head + index]
+
+    def add(self, pm: PartialMatch):
+        """
+        Inserts the given partial match after the partial matches whose earliest events are not later than its own.
+        """
+        items = self.__items
+        if len(items) == self.__head or items[-1].first_timestamp <= pm.first_timestamp:
+            items.append(pm)
+            return
+        items.insert(self.__bisect(pm.first_timestamp, True), pm)
+
+    def count_earlier_than(self, timestamp: datetime):
+        """
+        Returns the number of partial matches whose earliest events precede the given timestamp, which is also the
+        position of the first partial match whose earliest event does not.
+        """
+        return self.__bisect(timestamp, False) - self.__head
+
+    def remove_earlier_than(self, timestamp: datetime):
+        """
+        Removes the partial matches whose earliest events precede the given timestamp, and returns them.
+        """
+        items, head = self.__items, self.__head
+        if len(items) == head or items[head].first_timestamp >= timestamp:
+            return []
+        end = self.__bisect(timestamp, False)
+        removed_partial_matches = items[head:end]
+        self.__head = end
+        self.__compact()
+        return removed_partial_matches
+
+    def pop_first(self):
+        """
+        Removes and returns the oldest partial match.
+        """
+        if len(self) == 0:
+            raise IndexError("Pop from an empty partial match buffer")
+        pm = self.__items[self.__head]
+        self.__head += 1
+        self.__compact()
+        return pm
+
+    def remove_all(self, partial_matches: Iterable[PartialMatch]):
+        """
+        Removes the given partial matches.
+        """
+        removed_set = set(partial_matches)
+        if len(removed_set) == 0:
+            return
+        self.__items = [pm for pm in self if pm not in removed_set]
+        self.__head = 0
+
+    def __bisect(self, timestamp: datetime, is_right: bool):
+        """
+        Returns the position in the list of the first partial match whose earliest event is later than the given
+        timestamp (if is_right is True) or not earlier than it (otherwise).
+        """
+        items = self.__items
+        start, end = self.__head, len(items)
+        while start < end:
+            middle = (start + end) // 2
+            middle_timestamp = items[middle].first_timestamp
+            if middle_timestamp < timestamp or (is_right and middle_timestamp == timestamp):
+                start = middle + 1
+            else:
+                end = middle
+        return start
+
+    def __compact(self):
+        """
+        Discards the removed partial matches from the list once they make up at least half of it.
+        """
+        if 2 * self.__head >= len(self.__items):
+            self.__items = self.__items[self.__head:]
+            self.__head = 0
@@ -0,0 +1,318 @@
+"""
+This file contains secondary indexes over the partial matches buffered at a tree node.
+An index is installed on a node by its parent according to the condition evaluated by the parent. It allows the parent
+to only examine the partial matches that can possibly satisfy this condition instead of scanning the entire buffer.
+"""
+import operator
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from typing import List, Tuple
+
+from base.EventSchema import EventSchema
+from base.Formula import Term, SmallerThanFormula, SmallerThanEqFormula, GreaterThanFormula, GreaterThanEqFormula, \
+    EqFormula, NotEqFormula
+from base.PatternStructure import QItem
+from evaluation.PartialMatch import PartialMatch
+from misc.Utils import find_partial_match_by_timestamp
+
+try:
+    import numpy
+except ImportError:  # the columnar index is only available if NumPy is installed
+    numpy = None
+
+
+class PartialMatchIndex:
+    """
+    An abstract class for an index over the partial matches of a single node.
+    The index has to be notified on every insertion and removal of a partial match to and from the node.
+    """
+    def __init__(self, key_terms: List[Term], event_defs: List[Tuple[int, QItem]], schema: EventSchema = None):
+        name_to_index = {event_defs[i][1].name: i for i in range(len(event_defs))}
+        self._compiled_key_terms = [term.compile(name_to_index, schema) for term in key_terms]
+
+    def get_key(self, pm: PartialMatch):
+        """
+        Calculates the key of the given partial match, i.e., the values of the key terms of this index.
+        """
+        return tuple(compiled_term(pm.events) for compiled_term in self._compiled_key_terms)
+
+    def add(self, pm: PartialMatch):
+        """
+        Registers a new partial match in the index.
+        """
+        raise NotImplementedError()
+
+    def remove(self, pms: List[PartialMatch]):
+        """
+        Removes the given partial matches from the index.
+        """
+        raise NotImplementedError()
+
+    def get_partial_matches(self, key: tuple):
+        """
+        Returns the indexed partial matches that may be combined with a partial match whose key is the given one.
+        """
+        raise NotImplementedError()
+
+
+class EqualityPartialMatchIndex(PartialMatchIndex):
+    """
+    A hash index for equality conditions (e.g., a.x == b.y) between two subtrees.
+    The partial matches sharing a key are stored in a bucket sorted by timestamp, exactly as in the node itself.
+    """
+    def __init__(self, key_terms: List[Term], event_defs: List[Tuple[int, QItem]], schema: EventSchema = None):
+        super().__init__(key_terms, event_defs, schema)
+        self.__buckets = {}
+
+    def add(self, pm: PartialMatch):
+        key = self.get_key(pm)
+        bucket = self.__buckets.get(key)
+        if bucket is None:
+            self.__buckets[key] = [pm]
+            return
+        index = find_partial_match_by_timestamp(bucket, pm.first_timestamp)
+        bucket.insert(index, pm)
+
+    def remove(self, pms: List[PartialMatch]):
+        pms_by_key = {}
+        for pm in pms:
+            pms_by_key.setdefault(self.get_key(pm), []).append(pm)
+        for key, pms_to_remove in pms_by_key.items():
+            bucket = self.__buckets.get(key)
+            if bucket is None:
+                continue
+            count = len(pms_to_remove)
+            if all(bucket[i] is pms_to_remove[i] for i in range(min(count, len(bucket)))):
+                # the common case of expired partial matches - they are always at the beginning of the bucket.
+                # a new list is created since the bucket might be iterated over at the moment
+                bucket = bucket[count:]
+            else:
+                ids_to_remove = {id(pm) for pm in pms_to_remove}
+                bucket = [pm for pm in bucket if id(pm) not in ids_to_remove]
+            if len(bucket) > 0:
+                self.__buckets[key] = bucket
+            else:
+                del self.__buckets[key]
+
+    def get_partial_matches(self, key: tuple):
+        return self.__buckets.get(key, [])
+
+
+class RangePartialMatchIndex(PartialMatchIndex):
+    """
+    A sorted index for inequality conditions (e.g., a.x < b.y) between two subtrees.
+    Next to the timestamp-sorted buffer of the node, the partial matches are kept sorted by the value of the key term.
+    The relation is a formula type (e.g., SmallerThanFormula) such that the value of an indexed partial match has to be
+    in this relation with the value of a probing partial match.
+    """
+    def __init__(self, key_term: Term, event_defs: List[Tuple[int, QItem]], relation: type,
+                 schema: EventSchema = None):
+        super().__init__([key_term], event_defs, schema)
+        if relation not in (SmallerThanFormula, SmallerThanEqFormula, GreaterThanFormula, GreaterThanEqFormula):
+            raise Exception("Unsupported relation for a range index: %s" % relation.__name__)
+        self.__relation = relation
+        self.__keys = []
+        self.__partial_matches = []
+
+    def add(self, pm: PartialMatch):
+        key = self.get_key(pm)[0]
+        index = bisect_right(self.__keys, key)
+        self.__keys.insert(index, key)
+        self.__partial_matches.insert(index, pm)
+
+    def remove(self, pms: List[PartialMatch]):
+        for pm in pms:
+            key = self.get_key(pm)[0]
+            for index in range(bisect_left(self.__keys, key), bisect_right(self.__keys, key)):
+                if self.__partial_matches[index] is pm:
+                    del self.__keys[index]
+                    del self.__partial_matches[index]
+                    break
+
+    def get_partial_matches(self, key: tuple):
+        value = key[0]
+        if self.__relation == SmallerThanFormula:
+            return self.__partial_matches[:bisect_left(self.__keys, value)]
+        if self.__relation == SmallerThanEqFormula:
+            return self.__partial_matches[:bisect_right(self.__keys, value)]
+        if self.__relation == GreaterThanFormula:
+            return self.__partial_matches[bisect_right(self.__keys, value):]
+        return self.__partial_matches[bisect_left(self.__keys, value):]
+
+    @staticmethod
+    def get_mirrored_relation(relation: type):
+        """
+        Returns the relation R' such that x R y if and only if y R' x.
+        """
+        if relation == SmallerThanFormula:
+            return GreaterThanFormula
+        if relation == SmallerThanEqFormula:
+            return GreaterThanEqFormula
+        if relation == GreaterThanFormula:
+            return SmallerThanFormula
+        if relation == GreaterThanEqFormula:
+            return SmallerThanEqFormula
+        raise Exception("Unsupported relation for a range index: %s" % relation.__name__)
+
+
+class ColumnarPartialMatchIndex(PartialMatchIndex):
+    """
+    A columnar index used in the micro-batch evaluation mode (see TreeBasedEvaluationMechanism), where a batch of new
+    partial matches sharing their latest timestamp is joined with the partial matches of the other subtree at once.
+    Next to the timestamp-sorted buffer of the node, the index keeps a column of the earliest timestamps of the partial
+    matches and a column of the values of each key term. A batch is probed by comparing these columns, as NumPy arrays,
+    to the values of all the partial matches of the batch, yielding a mask of the candidates of each of them.
+    The relations are formula types (e.g., SmallerThanFormula) such that the value of each key term of an indexed
+    partial match has to be in the respective relation with the value of a probing partial match. A relation is only
+    applied to numeric values, and the rest of the condition is left to the node, such that the mask never drops a
+    partial match satisfying the condition.
+    The key of a partial match consists of its latest timestamp followed by the values of its key terms.
+    """
+    __RELATION_OPERATORS = {
+        EqFormula: operator.eq,
+        NotEqFormula: operator.ne,
+        SmallerThanFormula: operator.lt,
+        SmallerThanEqFormula: operator.le,
+        GreaterThanFormula: operator.gt,
+        GreaterThanEqFormula: operator.ge,
+    }
+    __MICROSECOND = timedelta(microseconds=1)
+
+    def __init__(self, key_terms: List[Term], event_defs: List[Tuple[int, QItem]], relations: List[type],
+                 sliding_window: timedelta, schema: EventSchema = None):
+        super().__init__(key_terms, event_defs, schema)
+        if numpy is None:
+            raise Exception("A columnar index requires NumPy")
+        for relation in relations:
+            if relation not in ColumnarPartialMatchIndex.__RELATION_OPERATORS:
+                raise Exception("Unsupported relation for a columnar index: %s" % relation.__name__)
+        self.__operators = [ColumnarPartialMatchIndex.__RELATION_OPERATORS[relation] for relation in relations]
+        self.__sliding_window = sliding_window
+        self.__partial_matches = []
+        self.__first_timestamps = []
+        self.__columns = [[] for _ in key_terms]
+        # the columns as NumPy arrays, created upon a probe. As long as partial matches are only appended and removed
+        # from the beginning, the arrays are updated by dropping the removed prefix and converting the new suffix only.
+        # Otherwise, they are discarded and recreated upon the next probe
+        self.__arrays = None
+        self.__removed_prefix_length = 0
+        # the earliest timestamp ever indexed, from which the timestamps are measured in whole microseconds
+        self.__base_timestamp = None
+
+    @staticmethod
+    def is_available():
+        """
+        Returns True if NumPy is installed, such that columnar indexes can be created, and False otherwise.
+        """
+        return numpy is not None
+
+    def get_key(self, pm: PartialMatch):
+        return (pm.last_timestamp,) + super().get_key(pm)
+
+    def add(self, pm: PartialMatch):
+        values = super().get_key(pm)
+        first_timestamps = self.__first_timestamps
+        if len(first_timestamps) == 0 or first_timestamps[-1] <= pm.first_timestamp:
+            index = len(first_timestamps)
+        else:
+            index = bisect_right(first_timestamps, pm.first_timestamp)
+        if index < len(first_timestamps):
+            self.__arrays = None
+        self.__partial_matches.insert(index, pm)
+        first_timestamps.insert(index, pm.first_timestamp)
+        for column, value in zip(self.__columns, values):
+            column.insert(index, value)
+
+    def remove(self, pms: List[PartialMatch]):
+        count = len(pms)
+        partial_matches = self.__partial_matches
+        if all(partial_matches[i] is pms[i] for i in range(min(count, len(partial_matches)))):
+            # the common case of expired partial matches - they are always at the beginning of the index
+            count = min(count, len(partial_matches))
+            for column in [partial_matches, self.__first_timestamps] + self.__columns:
+                del column[:count]
+            self.__removed_prefix_length += count
+            return
+        ids_to_remove = {id(pm) for pm in pms}
+        positions = [i for i in range(len(partial_matches)) if id(partial_matches[i]) not in ids_to_remove]
+        self.__partial_matches = [partial_matches[i] for i in positions]
+        self.__first_timestamps = [self.__first_timestamps[i] for i in positions]
+        self.__columns = [[column[i] for i in positions] for column in self.__columns]
+        self.__arrays = None
+
+    def get_partial_matches(self, key: tuple):
+        return self.get_partial_matches_of_batch([key])[0]
+
+    def get_partial_matches_of_batch(self, keys: List[tuple]):
+        """
+        Returns, for each of the given keys of a batch of probing partial matches, the indexed partial matches that may
+        be combined with it.
+        """
+        partial_matches = self.__partial_matches
+        if len(partial_matches) == 0 or len(keys) == 0:
+            return [[] for _ in keys]
+        first_timestamps, columns = self.__get_arrays()
+        mask = numpy.ones((len(keys), len(partial_matches)), dtype=bool)
+        if self.__sliding_window != timedelta.max:
+            last_timestamps = numpy.array([self.__to_microseconds(key[0]) for key in keys], dtype=numpy.int64)
+            mask &= last_timestamps[:, None] - first_timestamps[None, :] <= \
+                self.__sliding_window // ColumnarPartialMatchIndex.__MICROSECOND
+        for i in range(len(columns)):
+            if columns[i] is None:
+                continue
+            values = ColumnarPartialMatchIndex.__to_numeric_array([key[i + 1] for key in keys])
+            if values is not None:
+                mask &= self.__operators[i](columns[i][None, :], values[:, None])
+        return [[partial_matches[j] for j in numpy.flatnonzero(row)] for row in mask]
+
+    def __get_arrays(self):
+        """
+        Returns the columns of the earliest timestamps (in microseconds since the base timestamp) and of the key terms
+        as NumPy arrays. A key term column containing non-numeric values is returned as None, as its relation is not
+        applied.
+        """
+        if self.__base_timestamp is None:
+            self.__base_timestamp = self.__first_timestamps[0]
+        if self.__arrays is None:
+            self.__arrays = self.__create_arrays(0)
+        else:
+            first_timestamps, columns = self.__arrays
+            start = self.__removed_prefix_length
+            first_timestamps = first_timestamps[start:]
+            columns = [column[start:] if column is not None else None for column in columns]
+            new_first_timestamps, new_columns = self.__create_arrays(len(first_timestamps))
+            if len(new_first_timestamps) > 0:
+                first_timestamps = numpy.concatenate((first_timestamps, new_first_timestamps))
+                columns = [numpy.concatenate((column, new_column))
+                           if column is not None and new_column is not None else None
+                           for column, new_column in zip(columns, new_columns)]
+            self.__arrays = first_timestamps, columns
+        self.__removed_prefix_length = 0
+        return self.__arrays
+
+    def __create_arrays(self, start: int):
+        """
+        Converts the columns from the given position on to NumPy arrays, as returned by __get_arrays.
+        """
+        first_timestamps = numpy.array(
+            [self.__to_microseconds(timestamp) for timestamp in self.__first_timestamps[start:]], dtype=numpy.int64)
+        columns = [ColumnarPartialMatchIndex.__to_numeric_array(column[start:]) for column in self.__columns]
+        return first_timestamps, columns
+
+    def __to_microseconds(self, timestamp):
+        """
+        Returns the number of whole microseconds between the base timestamp and the given one, such that the time
+        window is compared exactly.
+        """
+        return (timestamp - self.__base_timestamp) // ColumnarPartialMatchIndex.__MICROSECOND
+
+    @staticmethod
+    def __to_numeric_array(values: list):
+        """
+        Returns the given values as a NumPy array, or None if they are not all integers or floating-point numbers.
+        """
+        for value in values:
+            if type(value) not in (int, float):
+                return None
+        array = numpy.array(values)
+        return array if array.dtype.kind in "if" else None
@@ -0,0 +1,290 @@
+"""
+This file contains the evaluation mechanisms running several independent copies of another evaluation mechanism in
+parallel, each on a different partition of the input stream.
+The input is either partitioned according to a key extracted from each event, such as an identifier of the entity the
+event refers to, or sliced into consecutive time segments.
+"""
+import itertools
+import multiprocessing
+import os
+import queue
+from bisect import bisect_right
+from datetime import timedelta
+from typing import List
+
+from base.Pattern import Pattern
+from base.PatternMatch import PatternMatch
+from evaluation.EvaluationMechanism import EvaluationMechanism
+from misc.IOUtils import Stream
+
+
+class PartitionInputStream(Stream):
+    """
+    A stream of events received by a partition worker from the process distributing the events.
+    The events arrive in batches, and the end of the stream is marked by None.
+    """
+    def __init__(self, queue: multiprocessing.Queue):
+        super().__init__(is_thread_safe=False)
+        self.__queue = queue
+        self.__batch = []
+        self.__batch_index = 0
+        self.__is_over = False
+
+    def __next__(self):
+        if self.__batch_index == len(self.__batch):
+            if self.__is_over:
+                raise StopIteration()
+            batch = self.__queue.get()
+            if batch is None:
+                self.__is_over = True
+                raise StopIteration()
+            self.__batch, self.__batch_index = batch, 0
+        event = self.__batch[self.__batch_index]
+        self.__batch_index += 1
+        return event
+
+    def add_item(self, item: object):
+        raise Exception("Cannot add items to a partition input stream")
+
+
+class PartitionOutputStream(Stream):
+    """
+    A stream of the matches detected by a partition worker, sent in batches to the process collecting the matches.
+    Each batch is tagged by the index of the partition. Closing the stream sends the remaining matches followed by
+    None. If a match filter is given, only the matches it accepts are sent.
+    """
+    def __init__(self, queue: multiprocessing.Queue, partition_index: int, batch_size: int,
+                 match_filter: callable = None):
+        super().__init__(is_thread_safe=False)
+        self.__queue = queue
+        self.__partition_index = partition_index
+        self.__batch_size = batch_size
+        self.__match_filter = match_filter
+        self.__batch = []
+
+    def add_item(self, item: object):
+        if self.__match_filter is not None and not self.__match_filter(item):
+            return
+        self.__batch.append(item)
+        if len(self.__batch) == self.__batch_size:
+            self.__flush()
+
+    def __flush(self):
+        if len(self.__batch) > 0:
+            self.__queue.put((self.__partition_index, self.__batch))
+            self.__batch = []
+
+    def close(self):
+        self.__flush()
+        self.__queue.put((self.__partition_index, None))
+
+
+class ParallelEvaluationMechanism(EvaluationMechanism):
+    """
+    An abstract evaluation mechanism distributing the input stream among several partitions and evaluating each
+    partition by an independent copy of the given evaluation mechanism in a separate process. The matches of all
+    partitions are merged into a single output stream, ordered by the timestamps of their latest events.
+    The worker processes are forked, such that each inherits its own copy of the evaluation mechanism (including the
+    conditions, which usually cannot be pickled). The events and the matches are transferred between the processes in
+    batches. If forking is not supported by the platform, or only a single partition is requested, the evaluation is
+    performed sequentially.
+    """
+    BATCH_SIZE = 1000  # the number of events or matches transferred between the processes at once
+    POLLING_TIMEOUT = 1.0  # the number of seconds to wait for the matches before checking whether the workers are alive
+
+    def __init__(self, eval_mechanism: EvaluationMechanism, partitions_count: int = None):
+        if partitions_count is None:
+            partitions_count = os.cpu_count() or 1
+        if partitions_count < 1:
+            raise Exception("At least one partition is required")
+        self._eval_mechanism = eval_mechanism
+        self._partitions_count = partitions_count
+
+    def eval(self, events: Stream, matches: Stream):
+        if self._partitions_count == 1 or "fork" not in multiprocessing.get_all_start_methods() or \
+                not self._prepare_partitioning(events):
+            self._eval_mechanism.eval(events, matches)
+            return
+        context = multiprocessing.get_context("fork")
+        input_queues = [context.Queue() for _ in range(self._partitions_count)]
+        output_queue = context.Queue()
+        workers = [context.Process(target=self.__run_partition, args=(input_queues[i], output_queue, i), daemon=True)
+                   for i in range(self._partitions_count)]
+        for worker in workers:
+            worker.start()
+        try:
+            self._distribute_events(events, input_queues)
+            partition_matches = self.__collect_matches(output_queue, workers)
+        except Exception:
+            for worker in workers:
+                worker.terminate()
+            raise
+        for worker in workers:
+            worker.join()
+        # the matches of a partition are not necessarily sorted (e.g., when negation delays some of them), hence they are
+        # sorted rather than merged. The sort is stable, keeping the order of matches sharing the same latest timestamp
+        for match in sorted(itertools.chain(*partition_matches),
+                            key=lambda pattern_match: max(event.timestamp for event in pattern_match.events)):
+            matches.add_item(match)
+        matches.close()
+
+    def _prepare_partitioning(self, events: Stream):
+        """
+        Prepares the distribution of the given stream among the partitions. Returns False if the stream should be
+        evaluated sequentially instead.
+        """
+        return True
+
+    def _distribute_events(self, events: Stream, input_queues: List[multiprocessing.Queue]):
+        """
+        Sends the events of the given stream in batches to the workers of their partitions. The stream of each worker
+        is closed by sending None.
+        """
+        raise NotImplementedError()
+
+    def _is_match_reported(self, partition_index: int, match: PatternMatch):
+        """
+        Returns True if the given match detected in the given partition should be reported and False otherwise.
+        """
+        return True
+
+    def __run_partition(self, input_queue: multiprocessing.Queue, output_queue: multiprocessing.Queue,
+                        partition_index: int):
+        """
+        The main function of a partition worker, evaluating the events of a single partition.
+        """
+        try:
+            self._eval_mechanism.eval(PartitionInputStream(input_queue),
+                                      PartitionOutputStream(output_queue, partition_index,
+                                                            ParallelEvaluationMechanism.BATCH_SIZE,
+                                                            lambda match: self._is_match_reported(partition_index,
+                                                                                                  match)))
+        except Exception as e:
+            output_queue.put((partition_index, Exception("Partition %d failed: %s" % (partition_index, repr(e)))))
+
+    def __collect_matches(self, output_queue: multiprocessing.Queue, workers: List[multiprocessing.Process]):
+        """
+        Receives the matches of all partitions until every worker closes its output stream.
+        Returns the list of matches detected in each partition. Raises an exception if a worker terminated without
+        closing its output stream.
+        """
+        partition_matches = [[] for _ in range(self._partitions_count)]
+        is_partition_finished = [False] * self._partitions_count
+        finished_partitions_count = 0
+        while finished_partitions_count < self._partitions_count:
+            # a worker flushes its output before terminating, hence the output of the workers found terminated here
+            # is fully received unless the queue remains empty until the timeout
+            terminated_partitions = [i for i in range(self._partitions_count)
+                                     if not is_partition_finished[i] and workers[i].exitcode is not None]
+            try:
+                partition_index, batch = output_queue.get(timeout=ParallelEvaluationMechanism.POLLING_TIMEOUT)
+            except queue.Empty:
+                if len(terminated_partitions) > 0:
+                    partition_index = terminated_partitions[0]
+                    raise Exception("The worker of partition %d terminated unexpectedly with exit code %d" %
+                                    (partition_index, workers[partition_index].exitcode))
+                continue
+            if batch is None:
+                is_partition_finished[partition_index] = True
+                finished_partitions_count += 1
+            elif isinstance(batch, Exception):
+                raise batch
+            else:
+                partition_matches[partition_index].extend(batch)
+        return partition_matches
+
+
+class PartitionedEvaluationMechanism(ParallelEvaluationMechanism):
+    """
+    Hash-partitions the input stream according to a key extracted from the payload of each event.
+    This is only valid if all events of every match share their key, which is the case for patterns that are
+    evaluated per entity. As a partition holds the events of all keys hashed to it, selection strategies depending on
+    the events separating those of a match are not supported (see CEP).
+    """
+    def __init__(self, eval_mechanism: EvaluationMechanism, partition_key_func: callable,
+                 partitions_count: int = None):
+        super().__init__(eval_mechanism, partitions_count)
+        self.__partition_key_func = partition_key_func
+
+    def _distribute_events(self, events: Stream, input_queues: List[multiprocessing.Queue]):
+        partitions_count = self._partitions_count
+        partition_key_func = self.__partition_key_func
+        batches = [[] for _ in range(partitions_count)]
+        for event in events:
+            partition_index = hash(partition_key_func(event.payload)) % partitions_count
+            batch = batches[partition_index]
+            batch.append(event)
+            if len(batch) == ParallelEvaluationMechanism.BATCH_SIZE:
+                input_queues[partition_index].put(batch)
+                batches[partition_index] = []
+        for i in range(partitions_count):
+            if len(batches[i]) > 0:
+                input_queues[i].put(batches[i])
+            input_queues[i].put(None)
+
+
+class TimeSlicedEvaluationMechanism(ParallelEvaluationMechanism):
+    """
+    Slices the time range of a finite input stream into segments of equal durations.
+    Each segment owns the matches whose earliest events occurred within its time range. A segment receives the events
+    of its range followed by the events of the next time window, such that any match it owns can be completed. If the
+    patterns contain negative events, a segment also receives the events of the time window preceding its range, as
+    these may invalidate its matches. A match detected in a segment other than its owner is dropped.
+    As the first and the last events of the stream are required in advance, this mechanism is intended for offline
+    evaluation of recorded histories. Patterns without a time window are evaluated sequentially.
+    """
+    def __init__(self, eval_mechanism: EvaluationMechanism, patterns: List[Pattern], segments_count: int = None):
+        super().__init__(eval_mechanism, segments_count)
+        self.__window = max(pattern.window for pattern in patterns)
+        self.__has_negative_events = any(len(pattern.negative_event.get_args()) > 0 for pattern in patterns)
+        # the start time of the range owned by each segment
+        self.__segment_starts = None
+
+    def _prepare_partitioning(self, events: Stream):
+        if self.__window == timedelta.max:
+            return False
+        first_event = events.first()
+        if first_event is None:
+            return False
+        first_timestamp, last_timestamp = first_event.timestamp, events.last().timestamp
+        if first_timestamp == last_timestamp:
+            return False
+        segment_duration = (last_timestamp - first_timestamp) / self._partitions_count
+        self.__segment_starts = [first_timestamp + i * segment_duration for i in range(self._partitions_count)]
+        return True
+
+    def _distribute_events(self, events: Stream, input_queues: List[multiprocessing.Queue]):
+        segments_count, segment_starts, window = self._partitions_count, self.__segment_starts, self.__window
+        batches = [[] for _ in range(segments_count)]
+        for event in events:
+            timestamp = event.timestamp
+            owner_index = max(bisect_right(segment_starts, timestamp) - 1, 0)
+            target_indices = [owner_index]
+            # the preceding segments may own matches completed by this event
+            i = owner_index - 1
+            while i >= 0 and timestamp - window <= segment_starts[i + 1]:
+                target_indices.append(i)
+                i -= 1
+            if self.__has_negative_events:
+                # the following segments may own matches invalidated by this event
+                i = owner_index + 1
+                while i < segments_count and timestamp + window >= segment_starts[i]:
+                    target_indices.append(i)
+                    i += 1
+            for i in target_indices:
+                batch = batches[i]
+                batch.append(event)
+                if len(batch) == ParallelEvaluationMechanism.BATCH_SIZE:
+                    input_queues[i].put(batch)
+                    batches[i] = []
+        for i in range(segments_count):
+            if len(batches[i]) > 0:
+                input_queues[i].put(batches[i])
+            input_queues[i].put(None)
+
+    def _is_match_reported(self, partition_index: int, match: PatternMatch):
+        first_timestamp = min(event.timestamp for event in match.events)
+        if partition_index > 0 and first_timestamp < self.__segment_starts[partition_index]:
+            return False
+        return partition_index == self._partitions_count - 1 or \
+            first_timestamp < self.__segment_starts[partition_index + 1]
@@ -0,0 +1,127 @@
+"""
+This file contains the ingestion stage handling input streams whose events may arrive out of the order of their
+timestamps, e.g., when several sources with skewed clocks are interleaved.
+The evaluation mechanisms assume that the events arrive in the order of their timestamps: a partial match is expired
+according to the latest event, hence an earlier event arriving afterwards may miss matches or revive expired state.
+Instead of sorting the whole input in advance, the events are reordered through a bounded priority buffer. The
+watermark is the latest timestamp seen so far minus the allowed lateness, and an event is only released to the
+evaluation mechanism once the watermark reaches its timestamp. Hence, the evaluation mechanism receives the events in
+the order of their timestamps, and its notion of the current time (by which the partial matches expire) never passes
+the watermark. An event arriving after a later event was already released is too late to be reordered, and is dropped.
+"""
+import heapq
+from datetime import timedelta
+
+from evaluation.EvaluationMechanism import EvaluationMechanism
+from misc.IOUtils import Stream
+
+
+class ReorderingStream(Stream):
+    """
+    A stream releasing the events of a given stream in the order of their timestamps, as long as no event arrives more
+    than the allowed lateness after a later one. The events sharing a timestamp are released in the order of their
+    arrival. If more than max_buffer_size events are buffered, the earliest one is released regardless of the
+    watermark. Once the given stream is over, the buffered events are released.
+    """
+    def __init__(self, events: Stream, allowed_lateness: timedelta, max_buffer_size: int = None):
+        super().__init__(is_thread_safe=False)
+        self.__events = events
+        self.__allowed_lateness = allowed_lateness
+        self.__max_buffer_size = max_buffer_size
+        # the buffered events, ordered by their timestamps and then by their arrival
+        self.__buffer = []
+        self.__arrivals_count = 0
+        self.__latest_timestamp = None
+        self.__last_released_timestamp = None
+        self.__is_over = False
+        self.__late_events_count = 0
+
+    def __next__(self):
+        while not self.__is_over and not self.__can_release():
+            try:
+                event = next(self.__events)
+            except StopIteration:
+                self.__is_over = True
+                break
+            self.__add_event(event)
+        if len(self.__buffer) == 0:
+            raise StopIteration()
+        timestamp, _, event = heapq.heappop(self.__buffer)
+        self.__last_released_timestamp = timestamp
+        return event
+
+    def __can_release(self):
+        """
+        Returns True if the earliest buffered event may be released and False otherwise.
+        """
+        if len(self.__buffer) == 0:
+            return False
+        if self.__max_buffer_size is not None and len(self.__buffer) > self.__max_buffer_size:
+            return True
+        return self.__buffer[0][0] <= self.__latest_timestamp - self.__allowed_lateness
+
+    def __add_event(self, event):
+        """
+        Buffers the given event, or drops it if a later event was already released.
+        """
+        timestamp = event.timestamp
+        if self.__last_released_timestamp is not None and timestamp < self.__last_released_timestamp:
+            self.__late_events_count += 1
+            return
+        if self.__latest_timestamp is None or timestamp > self.__latest_timestamp:
+            self.__latest_timestamp = timestamp
+        heapq.heappush(self.__buffer, (timestamp, self.__arrivals_count, event))
+        self.__arrivals_count += 1
+
+    def get_watermark(self):
+        """
+        Returns the timestamp up to which the events were released, or None if no event arrived yet.
+        """
+        if self.__latest_timestamp is None:
+            return None
+        return self.__latest_timestamp - self.__allowed_lateness
+
+    def get_late_events_count(self):
+        """
+        Returns the number of events dropped for arriving too late.
+        """
+        return self.__late_events_count
+
+    def add_item(self, item: object):
+        raise Exception("Cannot add items to a reordering stream")
+
+
+class ReorderingEvaluationMechanism(EvaluationMechanism):
+    """
+    Applies the given evaluation mechanism on the input stream reordered by the timestamps of its events (see
+    ReorderingStream).
+    """
+    def __init__(self, eval_mechanism: EvaluationMechanism, allowed_lateness: timedelta, max_buffer_size: int = None):
+        if allowed_lateness < timedelta(0):
+            raise Exception("The allowed lateness must not be negative")
+        if max_buffer_size is not None and max_buffer_size < 1:
+            raise Exception("The reordering buffer must hold at least one event")
+        self.__eval_mechanism = eval_mechanism
+        self.__allowed_lateness = allowed_lateness
+        self.__max_buffer_size = max_buffer_size
+        self.__late_events_count = 0
+
+    def eval(self, events: Stream, matches: Stream):
+        reordered_events = ReorderingStream(events, self.__allowed_lateness, self.__max_buffer_size)
+        self.__eval_mechanism.eval(reordered_events, matches)
+        self.__late_events_count += reordered_events.get_late_events_count()
+
+    def get_late_events_count(self):
+        """
+        Returns the number of events dropped so far for arriving too late.
+        """
+        return self.__late_events_count
+
+    def get_statistics(self):
+        return self.__eval_mechanism.get_statistics()
+
+    def get_dropped_partial_matches_count(self):
+        return self.__eval_mechanism.get_dropped_partial_matches_count()
+
+    def get_migrations_count(self):
+        return self.__eval_mechanism.get_migrations_count()
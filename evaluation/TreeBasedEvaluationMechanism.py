@@ -1,16 +1,26 @@
+import heapq
 from abc import ABC
 from datetime import timedelta, datetime
 from base.Pattern import Pattern
 from base.PatternStructure import SeqOperator, QItem, NegationOperator, AndOperator, OrOperator
-from base.Formula import TrueFormula, Formula
+from base.Formula import TrueFormula, Formula, AtomicFormula, EqFormula, NotEqFormula, SmallerThanFormula, \
+    SmallerThanEqFormula, GreaterThanFormula, GreaterThanEqFormula
 from evaluation.PartialMatch import PartialMatch
+from evaluation.PartialMatchBuffer import PartialMatchBuffer
+from evaluation.PartialMatchIndex import PartialMatchIndex, EqualityPartialMatchIndex, RangePartialMatchIndex, \
+    ColumnarPartialMatchIndex
+from evaluation.EventDispatcher import EventDispatcher
+from evaluation.LoadShedding import LoadShedder
 from misc.IOUtils import Stream
+from misc.StatisticsCollector import StatisticsCollector
 from typing import List, Tuple
 from base.Event import Event
-from misc.Utils import merge, merge_according_to, is_sorted, find_partial_match_by_timestamp, get_index, \
+from base.EventSchema import EventSchema, CompactPayload
+from misc.Utils import merge, merge_according_to, is_sorted, get_index, \
     find_positive_events_before
 from base.PatternMatch import PatternMatch
-from evaluation.EvaluationMechanism import EvaluationMechanism, NegationMode
+from evaluation.EvaluationMechanism import EvaluationMechanism, NegationMode, SelectionStrategies, \
+    ConsumptionPolicies
 #from evaluation.EvaluationMechanismFactory import NegationMode
 from queue import Queue
 
@@ -23,18 +33,39 @@ class Node(ABC):
     def __init__(self, sliding_window: timedelta, parent):
         self._parent = parent
         self._sliding_window = sliding_window
-        self._partial_matches = []
+        self._partial_matches = PartialMatchBuffer()
+        # the latest timestamp the partial matches of this node were expired according to. Expiring them again according
+        # to the same or an earlier timestamp has no effect
+        self._last_expiration_timestamp = None
+        # optional secondary indexes over the partial matches, installed by the parents of this node
+        self._partial_matches_indexes = {}
+        # the parents of this node other than the primary one, in case this node is shared between several trees
+        self._extra_parents = []
         self._condition = TrueFormula()
+        # the condition compiled into a function receiving the list of events of a partial match
+        self._compiled_condition = lambda events: True
+        # the schema of the compact payloads of the events, or None if the payloads are dictionaries
+        self._event_schema = None
         # matches that were not yet pushed to the parent for further processing => waiting for a potential not yhat could invalidate our match
         self._unhandled_partial_matches = Queue()
+        # the load shedder limiting the number of partial matches buffered at this node, if any
+        self._load_shedder = None
+        # the root of the tree of this node and the first-chance negation nodes whose expired negative events are
+        # checked upon expiration, precomputed once the tree is constructed (see set_tree_references)
+        self._root = self
+        self._first_FC_nodes_to_check = []
+        # whether the new partial matches of this node are passed to its parent in batches sharing their latest
+        # timestamp, which are joined through columnar indexes (see set_micro_batching)
+        self._is_micro_batching = False
 
     def consume_first_partial_match(self):
         """
         Removes and returns a single partial match buffered at this node.
         Used in the root node to collect full pattern matches.
         """
-        ret = self._partial_matches[0]
-        del self._partial_matches[0]
+        ret = self._partial_matches.pop_first()
+        for index in self._partial_matches_indexes.values():
+            index.remove([ret])
         return ret
 
     def has_partial_matches(self):
@@ -55,6 +86,31 @@ class Node(ABC):
         """
         self._parent = parent
 
+    def set_tree_references(self, root):
+        """
+        Stores the given root of the tree of this node, along with the first-chance negation nodes to be checked upon
+        expiration, such that the tree is not traversed whenever the partial matches of this node expire.
+        Must be called again whenever the structure of the tree changes.
+        """
+        self._root = root
+        node = self._parent if self._parent is not None else self
+        self._first_FC_nodes_to_check = node.get_first_FCNodes()
+
+    def add_parent(self, parent):
+        """
+        Adds a parent to a node shared between several trees. The new partial matches of this node are passed to all
+        of its parents, starting from the primary one.
+        """
+        self._extra_parents.append(parent)
+
+    def _handle_new_partial_match_in_extra_parents(self, pm: PartialMatch):
+        """
+        Passes a new partial match, already handled by the primary parent, to the rest of the parents of this node.
+        """
+        for parent in self._extra_parents:
+            self._unhandled_partial_matches.put(pm)
+            parent.handle_new_partial_match(self)
+
     def get_root(self):
         """
         Get root of tree
@@ -68,10 +124,11 @@ class Node(ABC):
         """
         Removes partial matches whose earliest timestamp violates the time window constraint.
         """
-        if self._sliding_window == timedelta.max:
+        if self._sliding_window == timedelta.max or \
+                (self._last_expiration_timestamp is not None and last_timestamp <= self._last_expiration_timestamp):
             return
-        count = find_partial_match_by_timestamp(self._partial_matches, last_timestamp - self._sliding_window)
-        self._partial_matches = self._partial_matches[count:]
+        self._last_expiration_timestamp = last_timestamp
+        self._remove_expired_partial_matches(last_timestamp - self._sliding_window)
 
         """
         "waiting for timeout" contains matches that may be invalidated by a future negative event
@@ -83,12 +140,8 @@ class Node(ABC):
 
         if (type(self) == PostProcessingNode or type(self) == FirstChanceNode) \
                 and self.is_last:
-            self.waiting_for_time_out = sorted(self.waiting_for_time_out, key=lambda x: x.first_timestamp)
-            count = find_partial_match_by_timestamp(self.waiting_for_time_out, last_timestamp - self._sliding_window)
-            node = self.get_root()
-
-            node.matches_to_handle_at_EOF.extend(self.waiting_for_time_out[:count])
-            self.waiting_for_time_out = self.waiting_for_time_out[count:]
+            self._root.matches_to_handle_at_EOF.extend(
+                self.waiting_for_time_out.remove_earlier_than(last_timestamp - self._sliding_window))
 
         """
         the end of the function is here to handle a special case: a pattern that starts by a negative event, and we got
@@ -104,20 +157,12 @@ class Node(ABC):
         by a negative event that has expired.
         """
 
-        if self._parent is not None:
-            list_of_nodes = self._parent.get_first_FCNodes()
-        else:
-            list_of_nodes = self.get_first_FCNodes()
-
-        for node in list_of_nodes:
+        for node in self._first_FC_nodes_to_check:
             if node._sliding_window == timedelta.max:
                     return
-            count = find_partial_match_by_timestamp(node._right_subtree._partial_matches,
-                                                    last_timestamp - node._right_subtree._sliding_window)
-            node._right_subtree._partial_matches = node._right_subtree._partial_matches[count:]
+            node._right_subtree._remove_expired_partial_matches(last_timestamp - node._right_subtree._sliding_window)
 
-            partial_matches = [pm for timestamp, pm in node.check_expired_timestamp if timestamp < last_timestamp]
-            for pm in partial_matches:
+            for pm in node.pop_expired_negative_events_blocks(last_timestamp):
 
                 """
                 "unblocking" previous pms that were blocked by an expired neg event may lead to accept as a match
@@ -130,16 +175,13 @@ class Node(ABC):
                 it may cause errors, and therefore we go down the tree from the root until we find a node that meets the criteria
                 """
 
-                node_to_hold_threshold = self.get_root()
+                node_to_hold_threshold = self._root
 
                 while type(node_to_hold_threshold) == FirstChanceNode and node_to_hold_threshold.is_last:
                     node_to_hold_threshold = node_to_hold_threshold._left_subtree
 
                 node_to_hold_threshold.threshold = last_timestamp
 
-                # we want to remove the pm from the check_expired_timestamp list
-                node.check_expired_timestamp = [x for x in node.check_expired_timestamp if x[1] != pm]
-
                 node._left_subtree._unhandled_partial_matches.put(pm)
                 node.handle_new_partial_match(node._left_subtree)
 
@@ -149,13 +191,42 @@ class Node(ABC):
     def add_partial_match(self, pm: PartialMatch):
         """
         Registers a new partial match at this node.
-        As of now, the insertion is always by the timestamp, and the partial matches are stored in a list sorted by
-        timestamp. Therefore, the insertion operation is performed in O(log n).
+        As of now, the insertion is always by the timestamp, and the partial matches are stored in a buffer sorted by
+        timestamp. As the partial matches mostly arrive in the order of their timestamps, the insertion is usually an
+        append.
         """
-        index = find_partial_match_by_timestamp(self._partial_matches, pm.first_timestamp)
-        self._partial_matches.insert(index, pm)
+        self._partial_matches.add(pm)
+        for index in self._partial_matches_indexes.values():
+            index.add(pm)
         if self._parent is not None:
             self._unhandled_partial_matches.put(pm)
+        if self._load_shedder is not None:
+            self._load_shedder.handle_new_partial_match(self, pm)
+
+    def _add_partial_matches_batch(self, pms: List[PartialMatch]):
+        """
+        Registers a batch of new partial matches at this node, to be passed to the parent at once rather than through
+        the queue of unhandled partial matches.
+        """
+        for pm in pms:
+            self._partial_matches.add(pm)
+            for index in self._partial_matches_indexes.values():
+                index.add(pm)
+
+    def set_micro_batching(self):
+        """
+        Switches this node to the micro-batch evaluation mode.
+        """
+        self._is_micro_batching = True
+
+    def _remove_expired_partial_matches(self, expiration_timestamp: datetime):
+        """
+        Removes the partial matches whose earliest events precede the given timestamp, i.e., the oldest ones.
+        """
+        expired_partial_matches = self._partial_matches.remove_earlier_than(expiration_timestamp)
+        if len(expired_partial_matches) > 0:
+            for index in self._partial_matches_indexes.values():
+                index.remove(expired_partial_matches)
 
     def get_partial_matches(self):
         """
@@ -163,6 +234,79 @@ class Node(ABC):
         """
         return self._partial_matches
 
+    def remove_partial_matches_of_events(self, events: set):
+        """
+        Removes the partial matches containing any of the given events from this subtree, and returns the partial
+        matches removed from this node.
+        """
+        removed_partial_matches = [pm for pm in self._partial_matches if not events.isdisjoint(pm.events)]
+        if len(removed_partial_matches) > 0:
+            self._partial_matches.remove_all(removed_partial_matches)
+            for index in self._partial_matches_indexes.values():
+                index.remove(removed_partial_matches)
+        return removed_partial_matches
+
+    def drop_partial_matches(self, partial_matches: List[PartialMatch]):
+        """
+        Removes the given partial matches from this node in order to reduce the load.
+        """
+        self._partial_matches.remove_all(partial_matches)
+        for index in self._partial_matches_indexes.values():
+            index.remove(partial_matches)
+
+    def set_load_shedder(self, load_shedder: LoadShedder):
+        """
+        Sets the load shedder enforcing the memory budget of this node.
+        """
+        self._load_shedder = load_shedder
+
+    def set_partial_matches_index(self, parent, index: PartialMatchIndex):
+        """
+        Installs a secondary index over the partial matches of this node to be used by the given parent, or removes the
+        existing one if None is given.
+        """
+        if index is None:
+            self._partial_matches_indexes.pop(parent, None)
+            return
+        self._partial_matches_indexes[parent] = index
+        for pm in self._partial_matches:
+            index.add(pm)
+
+    def get_partial_matches_index(self, parent):
+        """
+        Returns the secondary index over the partial matches of this node used by the given parent, or None if no
+        index is installed.
+        """
+        return self._partial_matches_indexes.get(parent)
+
+    def set_condition(self, condition: Formula):
+        """
+        Sets the condition to be verified by this node.
+        """
+        self._condition = condition
+        self._compile_condition()
+
+    def _compile_condition(self):
+        """
+        Compiles the condition of this node according to the order of the events in its partial matches - to be
+        implemented by subclasses.
+        """
+        raise NotImplementedError()
+
+    def set_event_schema(self, schema: EventSchema):
+        """
+        Recompiles the conditions in this tree for events whose payloads follow the given schema.
+        """
+        self._event_schema = schema
+        self._compile_condition()
+
+    def get_structure_signature(self):
+        """
+        Returns a hashable object such that nodes with equal signatures produce the same partial matches, i.e., may be
+        replaced by one another. By default, a node is only equivalent to itself.
+        """
+        return self
+
     def get_first_FCNodes(self):
         """
         Returns all FirstChance nodes with flag is_first on in the subtree of self - to be implemented by subclasses.
@@ -206,6 +350,9 @@ class LeafNode(Node):
         # We added an index for every QItem according to its place in the pattern to get the right order in
         # field "event_def"
         self.qitem_index = leaf_qitem.get_event_index()
+        # the partial matches of the events consumed by matches, which may no longer participate in new partial
+        # matches but are still considered by the skip-till-next-match selection strategy
+        self.__consumed_partial_matches = PartialMatchBuffer()
 
     def get_leaves(self):
         return [self]
@@ -222,7 +369,13 @@ class LeafNode(Node):
     def apply_formula(self, formula: Formula):
         condition = formula.get_formula_of(self.__event_name)
         if condition is not None:
-            self._condition = condition
+            self.set_condition(condition)
+
+    def _compile_condition(self):
+        self._compiled_condition = self._condition.compile({self.__event_name: 0}, self._event_schema)
+
+    def get_structure_signature(self):
+        return LeafNode, self.__event_type, self._sliding_window, self._condition.get_signature({self.__event_name: 0})
 
     def get_event_definitions(self):
         return [(self.__leaf_index, QItem(self.__event_type, self.__event_name, self.qitem_index))]
@@ -233,21 +386,82 @@ class LeafNode(Node):
         """
         return self.__event_type
 
+    def get_condition(self):
+        """
+        Returns the condition verified by this leaf on each incoming event.
+        """
+        return self._condition
+
+    def verify_condition(self, event: Event):
+        """
+        Returns True if the given event satisfies the condition of this leaf and False otherwise.
+        """
+        return self._compiled_condition([event])
+
+    def _remove_expired_partial_matches(self, expiration_timestamp: datetime):
+        super()._remove_expired_partial_matches(expiration_timestamp)
+        self.__consumed_partial_matches.remove_earlier_than(expiration_timestamp)
+
+    def remove_partial_matches_of_events(self, events: set):
+        removed_partial_matches = super().remove_partial_matches_of_events(events)
+        for pm in removed_partial_matches:
+            self.__consumed_partial_matches.add(pm)
+        return removed_partial_matches
+
+    def get_events_between(self, first_event: Event, last_event: Event):
+        """
+        Returns the events received by this leaf, including the consumed ones, that arrived after the first given
+        event and before the last given event.
+        """
+        events = []
+        for partial_matches in (self._partial_matches, self.__consumed_partial_matches):
+            for i in range(partial_matches.count_earlier_than(first_event.timestamp), len(partial_matches)):
+                event = partial_matches[i].events[0]
+                if event.timestamp > last_event.timestamp:
+                    break
+                if first_event.sequence_number < event.sequence_number < last_event.sequence_number:
+                    events.append(event)
+        return events
+
     def handle_event(self, event: Event):
         """
         Inserts the given event to this leaf.
         """
         self.clean_expired_partial_matches(event.timestamp)
 
-        # get event's qitem and make a binding to evaluate formula for the new event.
-        binding = {self.__event_name: event.payload}
-
-        if not self._condition.eval(binding):
+        if not self._compiled_condition([event]):
             return
 
-        self.add_partial_match(PartialMatch([event]))
+        self.__add_event(event)
+
+    def handle_verified_event(self, event: Event):
+        """
+        Inserts the given event, which is already known to satisfy the condition of this leaf, to this leaf.
+        """
+        self.clean_expired_partial_matches(event.timestamp)
+        self.__add_event(event)
+
+    def handle_verified_events(self, events: List[Event]):
+        """
+        Inserts the given events sharing their timestamp, which are already known to satisfy the condition of this leaf,
+        to this leaf, and passes their partial matches to the parent as a single batch.
+        """
+        self.clean_expired_partial_matches(events[0].timestamp)
+        pms = [PartialMatch([event], event.timestamp, event.timestamp) for event in events]
+        self._add_partial_matches_batch(pms)
+        if self._parent is not None:
+            self._parent.handle_new_partial_matches(self, pms)
+
+    def __add_event(self, event: Event):
+        """
+        Creates a partial match out of the given event and passes it to the parents of this leaf.
+        """
+        pm = PartialMatch([event], event.timestamp, event.timestamp)
+        self.add_partial_match(pm)
         if self._parent is not None:
             self._parent.handle_new_partial_match(self)
+        if len(self._extra_parents) > 0:
+            self._handle_new_partial_match_in_extra_parents(pm)
 
     def get_event_name(self):
         """
@@ -267,6 +481,10 @@ class InternalNode(Node):
         self._event_defs = event_defs
         self._left_subtree = left
         self._right_subtree = right
+        # the event definitions of the subtrees as seen by this node. A subtree shared with another tree may define its
+        # events differently (e.g., under other names), as long as its partial matches are structured the same way
+        self._left_event_defs = left.get_event_definitions() if left is not None else None
+        self._right_event_defs = right.get_event_definitions() if right is not None else None
         """
         Special field to be used in only one node (root or first node which is not a FC node) if the pattern contains
         a negative operator, in mode "first chance negation".
@@ -274,6 +492,26 @@ class InternalNode(Node):
         Otherwise is 0
         """
         self.threshold = 0
+        """
+        The constraints of the selection strategy verified by this node in addition to its condition (installed by
+        the Tree), referring to the events by their indices in the pattern:
+        contiguity constraints - pairs of events that must be adjacent in the stream, the first preceding the second.
+        maximal sequence span - the maximal difference between the sequence numbers of the events, which must also be
+        distinct, or None if not limited.
+        next match constraints - tuples of an event, the following event, the leaf receiving the events of the latter
+        and the condition the skipped events must not satisfy in its place.
+        """
+        self._contiguity_constraints = []
+        self._max_sequence_span = None
+        self._next_match_constraints = []
+        self._has_selection_constraints = False
+        # the above constraints, referring to the events by their positions in the partial matches of this node
+        self._compiled_contiguity_constraints = []
+        self._compiled_next_match_constraints = []
+        # the numbers of the pairs of partial matches of the subtrees compared by this node and of the partial matches
+        # created out of them, from which the selectivity of the condition of this node is estimated
+        self._compared_pairs_count = 0
+        self._created_partial_matches_count = 0
 
     def get_leaves(self):
         result = []
@@ -298,13 +536,90 @@ class InternalNode(Node):
     def apply_formula(self, formula: Formula):
         names = {item[1].name for item in self._event_defs}
         condition = formula.get_formula_of(names)
-        self._condition = condition if condition else TrueFormula()
+        self.set_condition(condition if condition else TrueFormula())
+        self._update_subtree_indexes()
         self._left_subtree.apply_formula(self._condition)
         self._right_subtree.apply_formula(self._condition)
 
     def get_event_definitions(self):
         return self._event_defs
 
+    def _compile_condition(self):
+        self._compiled_condition = self._condition.compile(
+            {self._event_defs[i][1].name: i for i in range(len(self._event_defs))}, self._event_schema)
+        if self._has_selection_constraints:
+            self.__compile_selection_constraints()
+
+    def __compile_selection_constraints(self):
+        """
+        Translates the selection strategy constraints of this node to the positions of the events in its partial
+        matches.
+        """
+        positions = {self._event_defs[i][0]: i for i in range(len(self._event_defs))}
+        name_to_index = {self._event_defs[i][1].name: i for i in range(len(self._event_defs))}
+        self._compiled_contiguity_constraints = [(positions[first_index], positions[second_index])
+                                                 for first_index, second_index in self._contiguity_constraints]
+        self._compiled_next_match_constraints = [
+            (positions[first_index], positions[second_index], leaf, condition.compile(name_to_index, self._event_schema))
+            for first_index, second_index, leaf, condition in self._next_match_constraints]
+
+    def add_contiguity_constraint(self, first_index: int, second_index: int):
+        """
+        Requires the events of the given indices in the pattern to be adjacent in the stream.
+        """
+        self._contiguity_constraints.append((first_index, second_index))
+        self._has_selection_constraints = True
+        self._compile_condition()
+
+    def set_max_sequence_span(self, max_sequence_span: int):
+        """
+        Requires the events of the partial matches of this node to be distinct and to have sequence numbers differing
+        by at most the given span.
+        """
+        self._max_sequence_span = max_sequence_span
+        self._has_selection_constraints = True
+
+    def add_next_match_constraint(self, first_index: int, second_index: int, leaf: LeafNode, condition: Formula):
+        """
+        Requires no event received by the given leaf between the events of the given indices in the pattern to satisfy
+        the given condition in place of the event of the second index.
+        """
+        self._next_match_constraints.append((first_index, second_index, leaf, condition))
+        self._has_selection_constraints = True
+        self._compile_condition()
+
+    def __verify_selection_constraints(self, events: List[Event]):
+        """
+        Returns True if the given events of a new partial match satisfy the selection strategy constraints of this
+        node and False otherwise.
+        """
+        for first_position, second_position in self._compiled_contiguity_constraints:
+            if events[second_position].sequence_number != events[first_position].sequence_number + 1:
+                return False
+        if self._max_sequence_span is not None:
+            sequence_numbers = {event.sequence_number for event in events}
+            if len(sequence_numbers) < len(events) or \
+                    max(sequence_numbers) - min(sequence_numbers) > self._max_sequence_span:
+                return False
+        for first_position, second_position, leaf, condition in self._compiled_next_match_constraints:
+            first_event, second_event = events[first_position], events[second_position]
+            if second_event.sequence_number - first_event.sequence_number < 2:
+                continue
+            alternative_events = list(events)
+            for skipped_event in leaf.get_events_between(first_event, second_event):
+                alternative_events[second_position] = skipped_event
+                if condition(alternative_events):
+                    return False
+        return True
+
+    def set_event_schema(self, schema: EventSchema):
+        super().set_event_schema(schema)
+        if self._left_subtree is not None:
+            self._left_subtree.set_event_schema(schema)
+        if self._right_subtree is not None:
+            self._right_subtree.set_event_schema(schema)
+        self._update_subtree_indexes()
+
     def _set_event_definitions(self,
                                left_event_defs: List[Tuple[int, QItem]], right_event_defs: List[Tuple[int, QItem]]):
         """
@@ -318,55 +633,269 @@ class InternalNode(Node):
         """
         self._left_subtree = left
         self._right_subtree = right
-        self._set_event_definitions(self._left_subtree.get_event_definitions(),
-                                    self._right_subtree.get_event_definitions())
+        self._left_event_defs = left.get_event_definitions()
+        self._right_event_defs = right.get_event_definitions()
+        self._set_event_definitions(self._left_event_defs, self._right_event_defs)
+        self._compile_condition()
+        self._update_subtree_indexes()
+
+    def get_subtrees(self):
+        """
+        Returns the left and the right subtrees of this node.
+        """
+        return self._left_subtree, self._right_subtree
+
+    def set_micro_batching(self):
+        super().set_micro_batching()
+        self._left_subtree.set_micro_batching()
+        self._right_subtree.set_micro_batching()
+        self._update_subtree_indexes()
+
+    def get_join_statistics(self):
+        """
+        Returns the number of pairs of partial matches of the subtrees compared by this node and the number of partial
+        matches created out of them since the last reset.
+        """
+        return self._compared_pairs_count, self._created_partial_matches_count
+
+    def reset_join_statistics(self):
+        """
+        Resets the counters returned by get_join_statistics.
+        """
+        self._compared_pairs_count = 0
+        self._created_partial_matches_count = 0
+
+    def remove_partial_matches_of_events(self, events: set):
+        removed_partial_matches = super().remove_partial_matches_of_events(events)
+        self._left_subtree.remove_partial_matches_of_events(events)
+        self._right_subtree.remove_partial_matches_of_events(events)
+        return removed_partial_matches
+
+    def get_structure_signature(self):
+        """
+        Two internal nodes are equivalent if their subtrees are equivalent, they combine the partial matches of their
+        subtrees the same way and they verify the same condition, up to the names of the events.
+        """
+        left_names = {item[1].name for item in self._left_event_defs}
+        name_to_index = {self._event_defs[i][1].name: i for i in range(len(self._event_defs))}
+        return type(self), self._sliding_window, \
+            self._left_subtree.get_structure_signature(), self._right_subtree.get_structure_signature(), \
+            tuple(item[1].name in left_names for item in self._event_defs), \
+            self._condition.get_signature(name_to_index)
+
+    def replace_subtree(self, subtree: Node, new_subtree: Node):
+        """
+        Replaces a subtree of this node with an equivalent one (see get_structure_signature) shared with other trees.
+        The event definitions of the replaced subtree are kept, as the partial matches of the new subtree are structured
+        the same way.
+        """
+        if subtree is self._left_subtree:
+            self._left_subtree = new_subtree
+        elif subtree is self._right_subtree:
+            self._right_subtree = new_subtree
+        else:
+            raise Exception("The given node is not a subtree of this node")
+        new_subtree.add_parent(self)
+        self._update_subtree_indexes()
+
+    def _update_subtree_indexes(self):
+        """
+        Installs the secondary indexes over the partial matches of the subtrees according to the condition of this node.
+        """
+        left_index, right_index = self._create_subtree_indexes()
+        self._left_subtree.set_partial_matches_index(self, left_index)
+        self._right_subtree.set_partial_matches_index(self, right_index)
+
+    def _create_subtree_indexes(self):
+        """
+        Creates the indexes for the partial matches of the left and the right subtrees.
+        If the condition of this node contains equalities between a term of the left subtree and a term of the right
+        subtree (e.g., a.x == b.y), each subtree is hash-indexed by its side of the equalities. This way, a new partial
+        match is only compared to the partial matches of the other subtree sharing its key.
+        Otherwise, if the condition contains an inequality between the subtrees (e.g., a.x < b.y), each subtree is
+        sorted by its side of the inequality, and a new partial match is only compared to the range of partial matches
+        of the other subtree satisfying the inequality.
+        In the micro-batch mode, a columnar index over all the comparisons between the subtrees is created instead of a
+        range index.
+        """
+        if self._left_subtree is None or self._right_subtree is None:
+            return None, None
+        left_event_defs = self._left_event_defs
+        right_event_defs = self._right_event_defs
+        left_names = {item[1].name for item in left_event_defs}
+        right_names = {item[1].name for item in right_event_defs}
+        left_terms, right_terms = [], []
+        range_indexes = None, None
+        # the terms of each subtree compared to the other subtree, along with the relations of the left ones to the
+        # right ones, for the columnar indexes of the micro-batch mode
+        left_compared_terms, right_compared_terms, left_relations = [], [], []
+        for conjunct in self._condition.get_conjuncts():
+            if not isinstance(conjunct, AtomicFormula):
+                continue
+            first_term, second_term = conjunct.left_term, conjunct.right_term
+            if InternalNode.__is_term_of(first_term, left_names, right_names) and \
+                    InternalNode.__is_term_of(second_term, right_names, left_names):
+                left_term, right_term, left_relation = first_term, second_term, type(conjunct)
+            elif InternalNode.__is_term_of(first_term, right_names, left_names) and \
+                    InternalNode.__is_term_of(second_term, left_names, right_names):
+                left_term, right_term = second_term, first_term
+                left_relation = RangePartialMatchIndex.get_mirrored_relation(type(conjunct)) \
+                    if type(conjunct) in InternalNode.__RANGE_RELATIONS else type(conjunct)
+            else:
+                continue
+            if left_relation in InternalNode.__COMPARISON_RELATIONS:
+                left_compared_terms.append(left_term)
+                right_compared_terms.append(right_term)
+                left_relations.append(left_relation)
+            if left_relation == EqFormula:
+                left_terms.append(left_term)
+                right_terms.append(right_term)
+            elif left_relation in InternalNode.__RANGE_RELATIONS and range_indexes[0] is None:
+                right_relation = RangePartialMatchIndex.get_mirrored_relation(left_relation)
+                range_indexes = \
+                    RangePartialMatchIndex(left_term, left_event_defs, left_relation, self._event_schema), \
+                    RangePartialMatchIndex(right_term, right_event_defs, right_relation, self._event_schema)
+        if len(left_terms) > 0:
+            # equality is the most selective lookup, hence preferred over a range one
+            return EqualityPartialMatchIndex(left_terms, left_event_defs, self._event_schema), \
+                EqualityPartialMatchIndex(right_terms, right_event_defs, self._event_schema)
+        if self._is_micro_batching:
+            right_relations = [relation if relation in (EqFormula, NotEqFormula) else
+                               RangePartialMatchIndex.get_mirrored_relation(relation) for relation in left_relations]
+            return \
+                ColumnarPartialMatchIndex(left_compared_terms, left_event_defs, left_relations,
+                                          self._sliding_window, self._event_schema), \
+                ColumnarPartialMatchIndex(right_compared_terms, right_event_defs, right_relations,
+                                          self._sliding_window, self._event_schema)
+        return range_indexes
+
+    __RANGE_RELATIONS = (SmallerThanFormula, SmallerThanEqFormula, GreaterThanFormula, GreaterThanEqFormula)
+    __COMPARISON_RELATIONS = __RANGE_RELATIONS + (EqFormula, NotEqFormula)
+
+    @staticmethod
+    def __is_term_of(term, names: set, other_names: set):
+        """
+        Returns True if the given term only refers to the given names and refers to at least one of them.
+        """
+        return term.get_term_of(names) is not None and term.get_term_of(other_names) is None
+
+    def _get_partial_matches_to_compare(self, new_partial_match: PartialMatch,
+                                        partial_match_source: Node, other_subtree: Node):
+        """
+        Returns the partial matches of the other subtree that the given new partial match should be compared to.
+        If the subtrees are indexed, only the candidates that may satisfy the indexed condition are returned.
+        """
+        other_index = other_subtree.get_partial_matches_index(self)
+        if other_index is None:
+            return other_subtree.get_partial_matches()
+        key = partial_match_source.get_partial_matches_index(self).get_key(new_partial_match)
+        return other_index.get_partial_matches(key)
+
+    def _get_join_sides(self, partial_match_source: Node):
+        """
+        Returns the subtree a new partial match of the given subtree is joined with, followed by the event definitions
+        of the given subtree and of the other one.
+        """
+        if partial_match_source == self._left_subtree:
+            return self._right_subtree, self._left_event_defs, self._right_event_defs
+        if partial_match_source == self._right_subtree:
+            return self._left_subtree, self._right_event_defs, self._left_event_defs
+        raise Exception()  # should never happen
 
     def handle_new_partial_match(self, partial_match_source: Node):
         """
         Internal node's update for a new partial match in one of the subtrees.
         """
-        if partial_match_source == self._left_subtree:
-            other_subtree = self._right_subtree
-        elif partial_match_source == self._right_subtree:
-            other_subtree = self._left_subtree
-        else:
-            raise Exception()  # should never happen
+        other_subtree, first_event_defs, second_event_defs = self._get_join_sides(partial_match_source)
 
         new_partial_match = partial_match_source.get_last_unhandled_partial_match()
-        first_event_defs = partial_match_source.get_event_definitions()
         other_subtree.clean_expired_partial_matches(new_partial_match.last_timestamp)
-        partial_matches_to_compare = other_subtree.get_partial_matches()
-        second_event_defs = other_subtree.get_event_definitions()
+        partial_matches_to_compare = self._get_partial_matches_to_compare(new_partial_match, partial_match_source,
+                                                                          other_subtree)
 
         self.clean_expired_partial_matches(new_partial_match.last_timestamp)
+        # the partial matches skipped by the index are counted as well, as they were compared to the new one implicitly
+        self._compared_pairs_count += len(other_subtree.get_partial_matches())
 
         # given a partial match from one subtree, for each partial match
         # in the other subtree we check for new partial matches in this node.
         for partialMatch in partial_matches_to_compare:
             self._try_create_new_match(new_partial_match, partialMatch, first_event_defs, second_event_defs)
 
-    def _try_create_new_match(self,
-                              first_partial_match: PartialMatch, second_partial_match: PartialMatch,
-                              first_event_defs: List[Tuple[int, QItem]], second_event_defs: List[Tuple[int, QItem]]):
+    def handle_new_partial_matches(self, partial_match_source: Node, new_partial_matches: List[PartialMatch]):
         """
-        Verifies all the conditions for creating a new partial match and creates it if all constraints are satisfied.
+        Internal node's update for a batch of new partial matches in one of the subtrees in the micro-batch mode. The
+        partial matches of a batch share their latest timestamp, and the whole batch is joined with the other subtree
+        through its columnar index at once. The new partial matches of this node are passed to the parent as a batch.
+        """
+        other_subtree, first_event_defs, second_event_defs = self._get_join_sides(partial_match_source)
+        last_timestamp = new_partial_matches[0].last_timestamp
+        other_subtree.clean_expired_partial_matches(last_timestamp)
+        self.clean_expired_partial_matches(last_timestamp)
+        self._compared_pairs_count += len(new_partial_matches) * len(other_subtree.get_partial_matches())
+
+        source_index = partial_match_source.get_partial_matches_index(self)
+        other_index = other_subtree.get_partial_matches_index(self)
+        keys = [source_index.get_key(pm) for pm in new_partial_matches]
+        if isinstance(other_index, ColumnarPartialMatchIndex):
+            partial_matches_to_compare = other_index.get_partial_matches_of_batch(keys)
+        else:
+            partial_matches_to_compare = [other_index.get_partial_matches(key) for key in keys]
+
+        created_partial_matches = []
+        for new_partial_match, candidates in zip(new_partial_matches, partial_matches_to_compare):
+            for partialMatch in candidates:
+                pm = self._create_new_match(new_partial_match, partialMatch, first_event_defs, second_event_defs)
+                if pm is not None:
+                    created_partial_matches.append(pm)
+        if len(created_partial_matches) == 0:
+            return
+        self._add_partial_matches_batch(created_partial_matches)
+        if self._parent is not None:
+            self._parent.handle_new_partial_matches(self, created_partial_matches)
+
+    def _create_new_match(self,
+                          first_partial_match: PartialMatch, second_partial_match: PartialMatch,
+                          first_event_defs: List[Tuple[int, QItem]], second_event_defs: List[Tuple[int, QItem]]):
+        """
+        Verifies all the conditions for creating a new partial match, and returns it if all constraints are satisfied
+        or None otherwise.
         """
         if self._sliding_window != timedelta.max and \
                 abs(first_partial_match.last_timestamp - second_partial_match.first_timestamp) > self._sliding_window:
-            return
+            return None
         events_for_new_match = self._merge_events_for_new_match(first_event_defs, second_event_defs,
                                                                 first_partial_match.events, second_partial_match.events)
 
         if not self._validate_new_match(events_for_new_match):
-            return
+            return None
 
         # If the threshold is not 0, we accept the pm as a match only if its last timestamp exceeds the threshold
         if self.threshold != 0 and first_partial_match.last_timestamp < self.threshold:
-            return
+            return None
 
-        self.add_partial_match(PartialMatch(events_for_new_match))
+        pm = PartialMatch(events_for_new_match,
+                          min(first_partial_match.first_timestamp, second_partial_match.first_timestamp),
+                          max(first_partial_match.last_timestamp, second_partial_match.last_timestamp))
+        self._created_partial_matches_count += 1
+        first_partial_match.joins_count += 1
+        second_partial_match.joins_count += 1
+        return pm
+
+    def _try_create_new_match(self,
+                              first_partial_match: PartialMatch, second_partial_match: PartialMatch,
+                              first_event_defs: List[Tuple[int, QItem]], second_event_defs: List[Tuple[int, QItem]]):
+        """
+        Verifies all the conditions for creating a new partial match and creates it if all constraints are satisfied.
+        """
+        pm = self._create_new_match(first_partial_match, second_partial_match, first_event_defs, second_event_defs)
+        if pm is None:
+            return
+        self.add_partial_match(pm)
         if self._parent is not None:
             self._parent.handle_new_partial_match(self)
+        if len(self._extra_parents) > 0:
+            self._handle_new_partial_match_in_extra_parents(pm)
 
     def _merge_events_for_new_match(self,
                                     first_event_defs: List[Tuple[int, QItem]],
@@ -386,10 +915,9 @@ class InternalNode(Node):
         """
         Validates the condition stored in this node on the given set of events.
         """
-        binding = {
-            self._event_defs[i][1].name: events_for_new_match[i].payload for i in range(len(self._event_defs))
-        }
-        return self._condition.eval(binding)
+        if not self._compiled_condition(events_for_new_match):
+            return False
+        return not self._has_selection_constraints or self.__verify_selection_constraints(events_for_new_match)
 
 
 class AndNode(InternalNode):
@@ -406,17 +934,37 @@ class SeqNode(InternalNode):
     of arrival of the events in the partial matches it constructs.
     """
 
+    def __init__(self, sliding_window: timedelta, parent: Node = None, event_defs: List[Tuple[int, QItem]] = None,
+                 left: Node = None, right: Node = None):
+        super().__init__(sliding_window, parent, event_defs, left, right)
+        # the positions of the events of a new partial match in the concatenated events of the joined partial matches,
+        # the one of the left subtree followed by the one of the right subtree
+        self.__merge_positions = None
+
     def _set_event_definitions(self,
                                left_event_defs: List[Tuple[int, QItem]], right_event_defs: List[Tuple[int, QItem]]):
         self._event_defs = merge(left_event_defs, right_event_defs, key=lambda x: x[0])
+        left_positions = list(range(len(left_event_defs)))
+        right_positions = list(range(len(left_event_defs), len(left_event_defs) + len(right_event_defs)))
+        self.__merge_positions = merge_according_to(left_event_defs, right_event_defs,
+                                                    left_positions, right_positions, key=lambda x: x[0])
 
     def _merge_events_for_new_match(self,
                                     first_event_defs: List[Tuple[int, QItem]],
                                     second_event_defs: List[Tuple[int, QItem]],
                                     first_event_list: List[Event],
                                     second_event_list: List[Event]):
-        return merge_according_to(first_event_defs, second_event_defs,
-                                  first_event_list, second_event_list, key=lambda x: x[0])
+        """
+        The order in which the events of the subtrees are merged is only calculated once, hence the new list is
+        directly picked from the events of the joined partial matches.
+        """
+        if first_event_defs is self._left_event_defs:
+            events = first_event_list + second_event_list
+        elif first_event_defs is self._right_event_defs:
+            events = second_event_list + first_event_list
+        else:
+            raise Exception()  # should never happen
+        return list(map(events.__getitem__, self.__merge_positions))
 
     def _validate_new_match(self, events_for_new_match: List[Event]):
         if not is_sorted(events_for_new_match, key=lambda x: x.timestamp):
@@ -446,7 +994,7 @@ class InternalNegationNode(InternalNode):
         with a not operator)
         We wait for them to exceed the time window and therefore can't be invalidated anymore
         """
-        self.waiting_for_time_out = []
+        self.waiting_for_time_out = PartialMatchBuffer()
 
         """
         Contains PMs that match the whole pattern and were in waiting_for_timeout, and now can't be invalidated anymore
@@ -461,6 +1009,14 @@ class InternalNegationNode(InternalNode):
     def get_event_definitions(self):  # to support multiple neg
         return self._left_subtree.get_event_definitions()  # à verifier
 
+    def _create_subtree_indexes(self):
+        # negation nodes do not look up their subtrees by key
+        return None, None
+
+    def get_structure_signature(self):
+        # negation nodes are never shared
+        return self
+
     def _try_create_new_match(self,
                               first_partial_match: PartialMatch, second_partial_match: PartialMatch,
                               first_event_defs: List[Tuple[int, QItem]], second_event_defs: List[Tuple[int, QItem]]):
@@ -508,12 +1064,12 @@ class InternalNegationNode(InternalNode):
         second_event_defs = other_subtree.get_event_definitions()
         self.clean_expired_partial_matches(new_partial_match.last_timestamp)
 
-        matches_to_keep = []
+        invalidated_matches = []
         for partialMatch in partial_matches_to_compare:
-            if not self._try_create_new_match(new_partial_match, partialMatch, first_event_defs, second_event_defs):
-                matches_to_keep.append(partialMatch)
+            if self._try_create_new_match(new_partial_match, partialMatch, first_event_defs, second_event_defs):
+                invalidated_matches.append(partialMatch)
 
-        other_subtree.waiting_for_time_out = matches_to_keep
+        other_subtree.waiting_for_time_out.remove_all(invalidated_matches)
 
     def get_first_last_negative_node(self):
         """
@@ -531,8 +1087,13 @@ class InternalNegationNode(InternalNode):
         """
         Remove list of partial match from a node
         """
-        matches_to_keep = [match for match in self._partial_matches if match not in matches_to_remove]
-        self._partial_matches = matches_to_keep
+        removed_set = set(matches_to_remove)
+        removed_matches = [match for match in self._partial_matches if match in removed_set]
+        if len(removed_matches) == 0:
+            return
+        self._partial_matches.remove_all(removed_matches)
+        for index in self._partial_matches_indexes.values():
+            index.remove(removed_matches)
 
 
 class FirstChanceNode(InternalNegationNode):
@@ -547,9 +1108,22 @@ class FirstChanceNode(InternalNegationNode):
 
         """
         contains PMs invalidated by a negative event at the beginning of the pattern
-        but may be part of a longer pm that exceeds the time window of the neg event later - see clean_expired
+        but may be part of a longer pm that exceeds the time window of the neg event later - see clean_expired.
+        Kept as a heap of (expiration timestamp of the negative event, insertion number, pm)
         """
         self.check_expired_timestamp = []
+        self.__blocks_count = 0
+
+    def pop_expired_negative_events_blocks(self, last_timestamp: datetime):
+        """
+        Removes and returns the PMs blocked by negative events that expired before the given timestamp, in the order
+        in which they were blocked.
+        """
+        blocks = []
+        while len(self.check_expired_timestamp) > 0 and self.check_expired_timestamp[0][0] < last_timestamp:
+            blocks.append(heapq.heappop(self.check_expired_timestamp))
+        blocks.sort(key=lambda block: block[1])
+        return [pm for _, _, pm in blocks]
 
     def handle_new_partial_match(self, partial_match_source: Node):
 
@@ -564,7 +1138,7 @@ class FirstChanceNode(InternalNegationNode):
                 # if self.is_last, the only events left in the pattern are negative ones.
                 # if we get no future negative events, we have a match -> special handling,
                 # see function handle_PM_with_negation_at_the_end
-                self.waiting_for_time_out.append(new_partial_match)
+                self.waiting_for_time_out.add(new_partial_match)
                 return
 
             first_event_defs = partial_match_source.get_event_definitions()
@@ -591,8 +1165,9 @@ class FirstChanceNode(InternalNegationNode):
             if invalidate and self.is_first:
                 # if the new partial match is invalidated we want to check later if the negative event has expired,
                 # so we keep the timestamp until which this negative event will expire
-                self.check_expired_timestamp.append((partialMatch.last_timestamp + self._sliding_window,
-                                                     new_partial_match))
+                heapq.heappush(self.check_expired_timestamp, (partialMatch.last_timestamp + self._sliding_window,
+                                                              self.__blocks_count, new_partial_match))
+                self.__blocks_count += 1
             return
 
         elif partial_match_source == self._right_subtree:
@@ -648,7 +1223,7 @@ class PostProcessingNode(InternalNegationNode):
             other_subtree = self._right_subtree
             if self.is_last:
                 new_partial_match = partial_match_source.get_last_unhandled_partial_match()
-                self.waiting_for_time_out.append(new_partial_match)
+                self.waiting_for_time_out.add(new_partial_match)
                 return
 
         elif partial_match_source == self._right_subtree:
@@ -694,6 +1269,15 @@ class Tree:
 
         self.__root = temp_root
 
+        selection_strategy = eval_mechanisms_params.selection_strategy
+        self.__consumption_policy = eval_mechanisms_params.consumption_policy
+        if selection_strategy != SelectionStrategies.SKIP_TILL_ANY_MATCH or \
+                self.__consumption_policy != ConsumptionPolicies.REUSE:
+            if len(pattern.negative_event.get_args()) > 0:
+                raise Exception("Selection strategies and consumption policies are not supported for patterns with "
+                                "negative events")
+            Tree.__apply_selection_strategy(temp_root, pattern, selection_strategy)
+
         # According to the Negation Mode, we add the negative events in a different way
         negation_mode = eval_mechanisms_params.negation_mode
         if negation_mode == NegationMode.POST_PROCESSING:
@@ -703,6 +1287,54 @@ class Tree:
         else:
             raise Exception()  # should never happen
 
+        self.__load_shedder = None
+        self.__load_shedding_nodes = []
+        load_shedding_params = eval_mechanisms_params.load_shedding_params
+        if load_shedding_params is not None:
+            if len(pattern.negative_event.get_args()) > 0:
+                raise Exception("Load shedding is not supported for patterns with negative events")
+            if selection_strategy != SelectionStrategies.SKIP_TILL_ANY_MATCH:
+                raise Exception("Load shedding is not supported under selection strategies")
+            self.__install_load_shedder(LoadShedder(load_shedding_params, len(pattern.structure.args), pattern.window))
+
+        # the expiration of the partial matches in trees containing negative events also releases the matches and the
+        # partial matches held back by the negation nodes, hence it is left to the nodes along the path of each event
+        self.__has_negative_events = len(pattern.negative_event.get_args()) > 0
+        self.__nodes_bottom_up = []
+        self.update_node_references()
+
+        # the micro-batch mode relies on NumPy, without which the events are evaluated one by one
+        self.__is_micro_batching = eval_mechanisms_params.micro_batching and ColumnarPartialMatchIndex.is_available()
+        if self.__is_micro_batching:
+            self.__root.set_micro_batching()
+
+    def update_node_references(self):
+        """
+        Precomputes the references of the nodes of this tree to its root and to the negation nodes they check, along
+        with the order in which the nodes expire their partial matches. Must be called whenever the structure of the
+        tree changes.
+        """
+        nodes_top_down = []
+        nodes_to_visit = [self.__root]
+        while len(nodes_to_visit) > 0:
+            node = nodes_to_visit.pop()
+            node.set_tree_references(self.__root)
+            nodes_top_down.append(node)
+            if isinstance(node, InternalNode):
+                nodes_to_visit.extend(node.get_subtrees())
+        self.__nodes_bottom_up = nodes_top_down[::-1]
+
+    def clean_expired_partial_matches(self, last_timestamp: datetime):
+        """
+        Removes the partial matches violating the time window constraint in all nodes of this tree in a single
+        bottom-up pass, such that each node checks its partial matches once per timestamp rather than whenever one of
+        its neighbours is updated. Does nothing for trees containing negative events.
+        """
+        if self.__has_negative_events:
+            return
+        for node in self.__nodes_bottom_up:
+            node.clean_expired_partial_matches(last_timestamp)
+
     def create_FirstChanceNegation_Tree(self, pattern: Pattern):
 
         top_operator = pattern.origin_structure.get_top_operator()
@@ -762,7 +1394,7 @@ class Tree:
                     # apply_formula manually for negation node
                     names = {item[1].name for item in temporal_root._event_defs}
                     condition = pattern.condition.get_formula_of(names)
-                    temporal_root._condition = condition if condition else TrueFormula()
+                    temporal_root.set_condition(condition if condition else TrueFormula())
 
                     keep_looking = False
                 else:
@@ -804,32 +1436,153 @@ class Tree:
             # apply_formula manually for negation nodes
             names = {item[1].name for item in temp_root._event_defs}
             condition = pattern.condition.get_formula_of(names)
-            temp_root._condition = condition if condition else TrueFormula()
+            temp_root.set_condition(condition if condition else TrueFormula())
 
         self.__root = temp_root
         return self.__root
 
+    @staticmethod
+    def __apply_selection_strategy(root: Node, pattern: Pattern, selection_strategy: SelectionStrategies):
+        """
+        Installs the constraints enforcing the given selection strategy in the nodes of the given tree. Each constraint
+        is verified by the lowest node containing all the events it refers to, such that the partial matches violating
+        it are dropped as early as possible.
+        """
+        if selection_strategy == SelectionStrategies.SKIP_TILL_ANY_MATCH or not isinstance(root, InternalNode):
+            return
+        args = pattern.structure.args
+        is_sequence = pattern.structure.get_top_operator() == SeqOperator
+        if not is_sequence:
+            if selection_strategy != SelectionStrategies.STRICT_CONTIGUITY:
+                raise Exception("The skip-till-next-match selection strategy is only supported for sequence patterns")
+            # the events of a conjunction must form a contiguous block of the stream, in any order
+            nodes_to_visit = [root]
+            while len(nodes_to_visit) > 0:
+                node = nodes_to_visit.pop()
+                if isinstance(node, InternalNode):
+                    node.set_max_sequence_span(len(args) - 1)
+                    nodes_to_visit.extend(node.get_subtrees())
+            return
+        leaves = {leaf.get_event_definitions()[0][0]: leaf for leaf in root.get_leaves()}
+        for i in range(1, len(args)):
+            if selection_strategy == SelectionStrategies.STRICT_CONTIGUITY:
+                Tree.__find_lowest_node_of(root, {i - 1, i}).add_contiguity_constraint(i - 1, i)
+                continue
+            # whether a skipped event could extend the previous events depends on the conditions among them
+            names = {args[j].name for j in range(i + 1)}
+            condition = pattern.condition.get_formula_of(names)
+            Tree.__find_lowest_node_of(root, set(range(i + 1))).add_next_match_constraint(
+                i - 1, i, leaves[i], condition if condition is not None else TrueFormula())
+
+    @staticmethod
+    def __find_lowest_node_of(root: InternalNode, indices: set):
+        """
+        Returns the lowest internal node in the given tree containing the events of all the given indices.
+        """
+        node = root
+        while True:
+            for subtree in node.get_subtrees():
+                if isinstance(subtree, InternalNode) and \
+                        indices <= {item[0] for item in subtree.get_event_definitions()}:
+                    node = subtree
+                    break
+            else:
+                return node
+
+    def __install_load_shedder(self, load_shedder: LoadShedder):
+        """
+        Installs the given load shedder in all nodes of this tree but the root, whose partial matches are the matches
+        themselves.
+        """
+        self.__load_shedder = load_shedder
+        nodes_to_visit = list(self.__root.get_subtrees()) if isinstance(self.__root, InternalNode) else []
+        while len(nodes_to_visit) > 0:
+            node = nodes_to_visit.pop()
+            node.set_load_shedder(load_shedder)
+            self.__load_shedding_nodes.append(node)
+            if isinstance(node, InternalNode):
+                nodes_to_visit.extend(node.get_subtrees())
+
+    def has_total_load_budget(self):
+        """
+        Returns True if the total number of partial matches in this tree is limited and False otherwise.
+        """
+        return self.__load_shedder is not None and self.__load_shedder.has_total_budget()
+
+    def shed_load(self, current_timestamp: datetime):
+        """
+        Drops partial matches if their total number in this tree exceeds its budget.
+        """
+        self.__load_shedder.shed(self.__load_shedding_nodes, current_timestamp)
+
+    def get_dropped_partial_matches_count(self):
+        """
+        Returns the number of partial matches dropped by load shedding, or None if load shedding is not applied.
+        """
+        if self.__load_shedder is None:
+            return None
+        return self.__load_shedder.get_dropped_partial_matches_count()
+
     def get_root(self):
         return self.__root
 
-    def handle_EOF(self, matches: Stream):
+    def is_micro_batching(self):
+        """
+        Returns True if the events of this tree are evaluated in batches sharing their timestamps and False otherwise.
+        """
+        return self.__is_micro_batching
+
+    def handle_EOF(self, matches: Stream, pattern_id: int = None):
         """
         We add as matches all the PMs for which there was a risk to be invalidated later.
         Now we finished the input stream so there is no more risk !
         """
         for match in self.__root.matches_to_handle_at_EOF:
-            matches.add_item(PatternMatch(match.events))
+            matches.add_item(PatternMatch(match.events, pattern_id))
         node = self.__root.get_first_last_negative_node()
         for match in node.waiting_for_time_out:
-            matches.add_item(PatternMatch(match.events))
+            matches.add_item(PatternMatch(match.events, pattern_id))
 
     def get_leaves(self):
         return self.__root.get_leaves()
 
+    def set_event_schema(self, schema: EventSchema):
+        """
+        Adapts the tree to events whose payloads follow the given schema.
+        """
+        self.__root.set_event_schema(schema)
+
     def get_matches(self):
+        """
+        Returns the new matches found at the root, according to the consumption policy of the pattern.
+        """
+        if self.__consumption_policy == ConsumptionPolicies.SINGLE_MATCH:
+            return self.__consume_matches()
+        return self.__get_all_matches()
+
+    def __get_all_matches(self):
         while self.__root.has_partial_matches():
             yield self.__root.consume_first_partial_match().events
 
+    def __consume_matches(self):
+        """
+        Selects the new matches found at the root such that no event participates in more than one match, and removes
+        the partial matches containing the selected events from the tree. The new matches are considered in the order
+        of the arrival of their earliest events.
+        """
+        new_matches = list(self.__get_all_matches())
+        if len(new_matches) == 0:
+            return new_matches
+        new_matches.sort(key=lambda events: sorted(event.sequence_number for event in events))
+        selected_matches, consumed_events = [], set()
+        for events in new_matches:
+            if not consumed_events.isdisjoint(events):
+                continue
+            selected_matches.append(events)
+            consumed_events.update(events)
+        self.__root.remove_partial_matches_of_events(consumed_events)
+        return selected_matches
+
     @staticmethod
     def __construct_tree(is_sequence: bool, tree_structure: tuple or int, args: List[QItem],
                          sliding_window: timedelta, parent: Node = None):
@@ -846,28 +1599,93 @@ class Tree:
 class TreeBasedEvaluationMechanism(EvaluationMechanism):
     """
     An implementation of the tree-based evaluation mechanism.
+    In the micro-batch mode, the events accepted by each leaf are accumulated until an event of a later timestamp
+    arrives. The leaf then passes all of their partial matches to its parent at once, and each internal node joins such
+    a batch with the partial matches of its other subtree through a columnar index (see ColumnarPartialMatchIndex),
+    passing the resulting partial matches on as a batch. The same matches are found as when evaluating the events one
+    by one, since the events sharing a timestamp are not ordered by the pattern, but the matches of each timestamp are
+    only reported once all of its events are evaluated. The micro-batch mode requires NumPy, and falls back to the
+    evaluation of single events if it is not installed.
     """
 
     def __init__(self, pattern: Pattern, tree_structure: tuple, eval_mechanism_params):
+        if eval_mechanism_params.micro_batching:
+            TreeBasedEvaluationMechanism.__verify_micro_batching_parameters(pattern, eval_mechanism_params)
         self.__tree = Tree(tree_structure, pattern, eval_mechanism_params)
+        self.__is_consuming = eval_mechanism_params.consumption_policy != ConsumptionPolicies.REUSE
+        self.__statistics_collector = None
+        if eval_mechanism_params.statistics_collection_params is not None:
+            self.__statistics_collector = StatisticsCollector(pattern,
+                                                              eval_mechanism_params.statistics_collection_params)
+
+    @staticmethod
+    def __verify_micro_batching_parameters(pattern: Pattern, eval_mechanism_params):
+        if len(pattern.negative_event.get_args()) > 0:
+            raise NotImplementedError("Negation is not supported in the micro-batch mode")
+        if eval_mechanism_params.selection_strategy != SelectionStrategies.SKIP_TILL_ANY_MATCH or \
+                eval_mechanism_params.consumption_policy != ConsumptionPolicies.REUSE:
+            raise NotImplementedError("Selection strategies and consumption policies are not supported in the "
+                                      "micro-batch mode")
+        if eval_mechanism_params.load_shedding_params is not None:
+            raise NotImplementedError("Load shedding is not supported in the micro-batch mode")
+
+    def get_statistics(self):
+        if self.__statistics_collector is None:
+            return None
+        return [self.__statistics_collector.get_statistics()]
+
+    def get_dropped_partial_matches_count(self):
+        return self.__tree.get_dropped_partial_matches_count()
 
     def eval(self, events: Stream, matches: Stream):
-        event_types_listeners = {}
-        # register leaf listeners for event types.
-        for leaf in self.__tree.get_leaves():
-            event_type = leaf.get_event_type()
-            if event_type in event_types_listeners.keys():
-                event_types_listeners[event_type].append(leaf)
-            else:
-                event_types_listeners[event_type] = [leaf]
+        event_dispatcher = EventDispatcher(self.__tree.get_leaves())
+        statistics_collector = self.__statistics_collector
+        has_total_load_budget = self.__tree.has_total_load_budget()
+        is_micro_batching = self.__tree.is_micro_batching()
+        # in the micro-batch mode, the events of the current timestamp accepted by each leaf
+        leaf_batches = {}
 
         # Send events to listening leaves.
+        is_schema_checked = False
+        sequence_number = 0
+        last_timestamp = None
         for event in events:
-            if event.event_type in event_types_listeners.keys():
-                for leaf in event_types_listeners[event.event_type]:
-                    leaf.handle_event(event)
+            event.sequence_number = sequence_number
+            sequence_number += 1
+            if event.timestamp != last_timestamp:
+                if len(leaf_batches) > 0:
+                    self.__handle_leaf_batches(leaf_batches, matches)
+                    leaf_batches = {}
+                # the partial matches are expired once per timestamp, before the first event carrying it is handled
+                last_timestamp = event.timestamp
+                self.__tree.clean_expired_partial_matches(last_timestamp)
+            if not is_schema_checked:
+                # compact payloads allow the conditions to directly access the attribute values by their positions
+                is_schema_checked = True
+                if isinstance(event.payload, CompactPayload):
+                    self.__tree.set_event_schema(event.payload.schema)
+                    event_dispatcher.set_event_schema(event.payload.schema)
+                    if statistics_collector is not None:
+                        statistics_collector.set_event_schema(event.payload.schema)
+            if statistics_collector is not None:
+                statistics_collector.handle_event(event)
+            if is_micro_batching:
+                for leaf in event_dispatcher.get_accepting_leaves(event):
+                    leaf_batches.setdefault(leaf, []).append(event)
+                continue
+            for leaf in event_dispatcher.get_accepting_leaves(event):
+                leaf.handle_verified_event(event)
+                if not self.__is_consuming:
                     for match in self.__tree.get_matches():
                         matches.add_item(PatternMatch(match))
+            if self.__is_consuming:
+                # the matches completed by the event compete for their events only once it reached all of its leaves
+                for match in self.__tree.get_matches():
+                    matches.add_item(PatternMatch(match))
+            if has_total_load_budget:
+                self.__tree.shed_load(event.timestamp)
+        if len(leaf_batches) > 0:
+            self.__handle_leaf_batches(leaf_batches, matches)
 
         # Now that we finished the input stream, if there were some PMs risking to be invalidated by a negative event
         # at the end of the pattern, we handle them now
@@ -876,3 +1694,160 @@ class TreeBasedEvaluationMechanism(EvaluationMechanism):
             self.__tree.handle_EOF(matches)
 
         matches.close()
+
+    def __handle_leaf_batches(self, leaf_batches: dict, matches: Stream):
+        """
+        Passes the events of a single timestamp accumulated by each leaf to the leaf as a batch, and reports the matches
+        completed by them.
+        """
+        for leaf, batch in leaf_batches.items():
+            leaf.handle_verified_events(batch)
+        for match in self.__tree.get_matches():
+            matches.add_item(PatternMatch(match))
+
+
+class MultiPatternTreeBasedEvaluationMechanism(EvaluationMechanism):
+    """
+    A tree-based evaluation mechanism for multiple patterns.
+    A separate tree is constructed for each pattern, after which the trees are merged into a directed acyclic graph:
+    each subtree equivalent to a subtree of a previously processed tree is replaced with the latter, such that the
+    partial matches of equivalent subtrees are only calculated and stored once.
+    The roots of the trees and the trees of patterns containing negative events are never shared. Neither are the trees
+    under a selection strategy or a consumption policy other than the default ones, as the partial matches of their
+    nodes depend on the rest of the tree.
+    """
+
+    def __init__(self, patterns: List[Pattern], tree_structures: List[tuple], eval_mechanism_params):
+        if eval_mechanism_params.adaptation_params is not None:
+            raise NotImplementedError("Adaptive evaluation is only supported for a single pattern")
+        if eval_mechanism_params.load_shedding_params is not None:
+            raise NotImplementedError("Load shedding is only supported for a single pattern")
+        if eval_mechanism_params.micro_batching:
+            raise NotImplementedError("The micro-batch mode is only supported for a single pattern")
+        self.__trees = [Tree(tree_structures[i], patterns[i], eval_mechanism_params) for i in range(len(patterns))]
+        self.__is_consuming = eval_mechanism_params.consumption_policy != ConsumptionPolicies.REUSE
+        self.__statistics_collectors = None
+        if eval_mechanism_params.statistics_collection_params is not None:
+            self.__statistics_collectors = [
+                StatisticsCollector(pattern, eval_mechanism_params.statistics_collection_params) for pattern in patterns]
+        if self.__is_consuming or \
+                eval_mechanism_params.selection_strategy != SelectionStrategies.SKIP_TILL_ANY_MATCH:
+            return
+        shared_nodes = {}
+        for i in range(len(patterns)):
+            root = self.__trees[i].get_root()
+            if len(patterns[i].negative_event.get_args()) > 0 or not isinstance(root, InternalNode):
+                continue
+            new_nodes = {}
+            MultiPatternTreeBasedEvaluationMechanism.__share_subtrees(root, shared_nodes, new_nodes, set())
+            for signature, node in new_nodes.items():
+                shared_nodes.setdefault(signature, node)
+        for tree in self.__trees:
+            tree.update_node_references()
+
+    @staticmethod
+    def __share_subtrees(node: InternalNode, shared_nodes: dict, new_nodes: dict, used_nodes: set):
+        """
+        Replaces each subtree of the given node with an equivalent subtree of a previously processed tree found in
+        shared_nodes if there is one, and registers it in new_nodes otherwise. In the latter case, the same is
+        recursively done for its subtrees.
+        A node is never used twice in the same tree, as a node playing two roles in a tree would receive each event
+        before all of its parents are notified, possibly creating duplicate matches. used_nodes holds the nodes already
+        taken from shared_nodes into the current tree along with their descendants.
+        """
+        for subtree in node.get_subtrees():
+            signature = subtree.get_structure_signature()
+            shared_subtree = shared_nodes.get(signature)
+            if shared_subtree is not None and shared_subtree not in used_nodes:
+                node.replace_subtree(subtree, shared_subtree)
+                used_nodes.update(MultiPatternTreeBasedEvaluationMechanism.__get_subtree_nodes(shared_subtree))
+                continue
+            new_nodes.setdefault(signature, subtree)
+            if isinstance(subtree, InternalNode):
+                MultiPatternTreeBasedEvaluationMechanism.__share_subtrees(subtree, shared_nodes, new_nodes, used_nodes)
+
+    @staticmethod
+    def __get_subtree_nodes(root: Node):
+        """
+        Returns the nodes of the subtree rooted at the given node.
+        """
+        nodes = set()
+        nodes_to_visit = [root]
+        while len(nodes_to_visit) > 0:
+            node = nodes_to_visit.pop()
+            if node in nodes:
+                continue
+            nodes.add(node)
+            if isinstance(node, InternalNode):
+                nodes_to_visit.extend(node.get_subtrees())
+        return nodes
+
+    def get_statistics(self):
+        if self.__statistics_collectors is None:
+            return None
+        return [statistics_collector.get_statistics() for statistics_collector in self.__statistics_collectors]
+
+    def get_nodes_count(self):
+        """
+        Returns the number of distinct nodes in the merged trees.
+        """
+        nodes = set()
+        for tree in self.__trees:
+            nodes.update(MultiPatternTreeBasedEvaluationMechanism.__get_subtree_nodes(tree.get_root()))
+        return len(nodes)
+
+    def eval(self, events: Stream, matches: Stream):
+        # the indices of the trees containing each leaf, i.e., possibly producing matches upon a new event in the leaf
+        leaf_trees = {}
+        for i in range(len(self.__trees)):
+            for leaf in self.__trees[i].get_leaves():
+                trees_of_leaf = leaf_trees.setdefault(leaf, [])
+                if i not in trees_of_leaf:
+                    trees_of_leaf.append(i)
+        # a single dispatcher routes the events to the leaves of all trees. A shared leaf is only registered once.
+        event_dispatcher = EventDispatcher(list(leaf_trees.keys()))
+        statistics_collectors = self.__statistics_collectors
+
+        # Send events to listening leaves.
+        is_schema_checked = False
+        sequence_number = 0
+        last_timestamp = None
+        for event in events:
+            event.sequence_number = sequence_number
+            sequence_number += 1
+            if event.timestamp != last_timestamp:
+                # the nodes shared between several trees skip the repeated expiration by the same timestamp
+                last_timestamp = event.timestamp
+                for tree in self.__trees:
+                    tree.clean_expired_partial_matches(last_timestamp)
+            if not is_schema_checked:
+                is_schema_checked = True
+                if isinstance(event.payload, CompactPayload):
+                    for tree in self.__trees:
+                        tree.set_event_schema(event.payload.schema)
+                    event_dispatcher.set_event_schema(event.payload.schema)
+                    if statistics_collectors is not None:
+                        for statistics_collector in statistics_collectors:
+                            statistics_collector.set_event_schema(event.payload.schema)
+            if statistics_collectors is not None:
+                for statistics_collector in statistics_collectors:
+                    statistics_collector.handle_event(event)
+            accepting_leaves = event_dispatcher.get_accepting_leaves(event)
+            for leaf in accepting_leaves:
+                leaf.handle_verified_event(event)
+                if not self.__is_consuming:
+                    for i in leaf_trees[leaf]:
+                        for match in self.__trees[i].get_matches():
+                            matches.add_item(PatternMatch(match, i))
+            if self.__is_consuming:
+                # the matches completed by the event compete for their events only once it reached all of its leaves
+                for i in sorted({i for leaf in accepting_leaves for i in leaf_trees[leaf]}):
+                    for match in self.__trees[i].get_matches():
+                        matches.add_item(PatternMatch(match, i))
+
+        for i in range(len(self.__trees)):
+            root = self.__trees[i].get_root()
+            if (type(root) == PostProcessingNode or type(root) == FirstChanceNode) and root.is_last:
+                self.__trees[i].handle_EOF(matches, i)
+
+        matches.close()
@@ -0,0 +1,378 @@
+"""
+This file contains the utilities for storing event streams in a binary columnar format.
+A file formatted according to some data formatter can be converted once into a binary event file, which can then be
+replayed any number of times without parsing its text. The binary file is memory-mapped, and the events are created
+directly out of its columns only when requested, hence opening a file takes constant time regardless of its size.
+
+The binary file consists of the following sections:
+* A header specifying the number of events, the number of attributes and the number of strings.
+* The descriptors of the attributes - the index of the attribute name in the string table and the type of its column.
+* The string table, containing the attribute names, the event types and the values of the string attributes.
+* A column of fixed-width values for each attribute, followed by a column of event types (given as indices in the
+  string table) and a column of event timestamps (given in microseconds since the epoch).
+The header, the descriptors and the string table are little-endian, while the columns are stored in the native byte
+order, so that they can be accessed in place.
+"""
+import mmap
+import struct
+from array import array
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from base.DataFormatter import DataFormatter
+from base.Event import Event
+from base.EventSchema import EventSchema, CompactPayload
+from misc.IOUtils import Stream, FileStream
+
+BINARY_FILE_MAGIC = b"CEPB"
+BINARY_FILE_VERSION = 1
+
+# magic, version, number of events, number of attributes, number of strings
+BINARY_FILE_HEADER = struct.Struct("<4sHIII")
+# index of the name in the string table, column type
+BINARY_FILE_ATTRIBUTE = struct.Struct("<Ic")
+BINARY_FILE_STRING_LENGTH = struct.Struct("<I")
+
+# column types
+INT_COLUMN = b"q"  # 64-bit integers
+FLOAT_COLUMN = b"d"  # doubles
+MIXED_COLUMN = b"m"  # doubles followed by a byte per value, specifying whether the value is an integer
+STRING_COLUMN = b"s"  # 32-bit indices in the string table
+
+# the alignment of the columns in the file
+COLUMN_ALIGNMENT = 8
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class BinaryEventPayload(CompactPayload):
+    """
+    A compact payload of an event stored in a binary event file, remembering the position of the event in the file.
+    """
+    __slots__ = ("row",)
+
+    def __init__(self, schema: EventSchema, fields: tuple, row: int):
+        super().__init__(schema, fields)
+        self.row = row
+
+
+class BinaryEventFile:
+    """
+    A memory-mapped binary event file created by convert_to_binary_event_file.
+    The file is unmapped by close(), either called directly, upon exiting the file as a context manager, or once all the
+    streams reading the file were closed (see BinaryFileStream).
+    """
+    def __init__(self, file_path: str):
+        with open(file_path, "rb") as f:
+            self.__buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # the views of the buffer, which must be released before it is unmapped
+        self.__views = []
+        self.__streams_count = 0
+        magic, version, self.__events_count, attributes_count, strings_count = \
+            BINARY_FILE_HEADER.unpack_from(self.__buffer, 0)
+        if magic != BINARY_FILE_MAGIC or version != BINARY_FILE_VERSION:
+            raise Exception("%s is not a binary event file of version %d" % (file_path, BINARY_FILE_VERSION))
+        offset = BINARY_FILE_HEADER.size
+        attributes = []
+        for _ in range(attributes_count):
+            attributes.append(BINARY_FILE_ATTRIBUTE.unpack_from(self.__buffer, offset))
+            offset += BINARY_FILE_ATTRIBUTE.size
+        self.__strings = []
+        for _ in range(strings_count):
+            length, = BINARY_FILE_STRING_LENGTH.unpack_from(self.__buffer, offset)
+            offset += BINARY_FILE_STRING_LENGTH.size
+            self.__strings.append(self.__buffer[offset:offset + length].decode("utf-8"))
+            offset += length
+        self.schema = EventSchema([self.__strings[name_index] for name_index, _ in attributes])
+        view = memoryview(self.__buffer)
+        self.__views.append(view)
+        self.__value_getters = []
+        for _, column_type in attributes:
+            if column_type == INT_COLUMN or column_type == FLOAT_COLUMN:
+                column, offset = self.__read_column(view, offset, column_type.decode())
+                self.__value_getters.append(column.__getitem__)
+            elif column_type == STRING_COLUMN:
+                column, offset = self.__read_column(view, offset, "I")
+                self.__value_getters.append(self.__create_string_getter(column))
+            elif column_type == MIXED_COLUMN:
+                values, offset = self.__read_column(view, offset, "d")
+                is_int_flags, offset = self.__read_column(view, offset, "B")
+                self.__value_getters.append(BinaryEventFile.__create_mixed_getter(values, is_int_flags))
+            else:
+                raise Exception("Unknown column type: %s" % column_type)
+        self.__event_types, offset = self.__read_column(view, offset, "I")
+        self.__timestamps, offset = self.__read_column(view, offset, "q")
+
+    def __read_column(self, view: memoryview, offset: int, typecode: str):
+        """
+        Returns a typed view of the column starting at the given offset and the offset of the next column.
+        """
+        offset = get_aligned_offset(offset)
+        end = offset + self.__events_count * struct.calcsize(typecode)
+        column_bytes = view[offset:end]
+        column = column_bytes.cast(typecode)
+        self.__views.extend((column_bytes, column))
+        return column, end
+
+    def __create_string_getter(self, column: memoryview):
+        strings = self.__strings
+        return lambda row: strings[column[row]]
+
+    @staticmethod
+    def __create_mixed_getter(values: memoryview, is_int_flags: memoryview):
+        return lambda row: int(values[row]) if is_int_flags[row] else values[row]
+
+    def __len__(self):
+        return self.__events_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps the file. The events already created remain valid, but no new events can be read.
+        """
+        if self.__buffer.closed:
+            return
+        # the views derived from others are released first
+        for view in reversed(self.__views):
+            view.release()
+        self.__views = []
+        self.__buffer.close()
+
+    def is_closed(self):
+        """
+        Returns True if the file was closed and False otherwise.
+        """
+        return self.__buffer.closed
+
+    def add_stream(self):
+        """
+        Registers a stream reading this file.
+        """
+        self.__streams_count += 1
+
+    def remove_stream(self):
+        """
+        Unregisters a stream reading this file, and closes the file if no other stream reads it.
+        """
+        self.__streams_count -= 1
+        if self.__streams_count == 0:
+            self.close()
+
+    def get_payload(self, row: int):
+        """
+        Returns the payload of the event at the given position.
+        """
+        return BinaryEventPayload(self.schema, tuple([get_value(row) for get_value in self.__value_getters]), row)
+
+    def get_event_type(self, row: int):
+        """
+        Returns the type of the event at the given position.
+        """
+        return self.__strings[self.__event_types[row]]
+
+    def get_timestamp_value(self, row: int):
+        """
+        Returns the timestamp of the event at the given position in microseconds since the epoch.
+        """
+        return self.__timestamps[row]
+
+
+class BinaryEventFormatter(DataFormatter):
+    """
+    A data formatter for the events of a binary event file. The raw data of an event is its position in the file.
+    """
+    def __init__(self, binary_file: BinaryEventFile):
+        self.__binary_file = binary_file
+        # consecutive events often share a timestamp, which is only created once
+        self.__last_timestamp_value = None
+        self.__last_timestamp = None
+
+    def parse_event(self, raw_data: int):
+        return self.__binary_file.get_payload(raw_data)
+
+    def get_event_schema(self):
+        return self.__binary_file.schema
+
+    def get_event_type(self, event_payload: BinaryEventPayload):
+        return self.__binary_file.get_event_type(event_payload.row)
+
+    def get_event_timestamp(self, event_payload: BinaryEventPayload):
+        timestamp_value = self.__binary_file.get_timestamp_value(event_payload.row)
+        if timestamp_value != self.__last_timestamp_value:
+            self.__last_timestamp_value = timestamp_value
+            self.__last_timestamp = EPOCH + timestamp_value * MICROSECOND
+        return self.__last_timestamp
+
+
+class BinaryFileStream(Stream):
+    """
+    A read-only stream of the events of a binary event file, created when requested.
+    Duplicating the stream takes constant time, as the duplicate shares the memory-mapped file. The file is closed once
+    all the streams sharing it were closed, where a stream is closed as soon as its end is reached. A stream that is
+    not read to its end should be closed, e.g., by using it as a context manager.
+    """
+    def __init__(self, binary_file: BinaryEventFile, position: int = 0):
+        super().__init__(is_thread_safe=False)
+        self.__binary_file = binary_file
+        self.__data_formatter = BinaryEventFormatter(binary_file)
+        self.__position = position
+        self.__is_closed = False
+        binary_file.add_stream()
+        if position == len(binary_file):
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __next__(self):
+        if self.__is_closed:
+            raise StopIteration()
+        event = Event(self.__position, self.__data_formatter)
+        self.__position += 1
+        if self.__position == len(self.__binary_file):
+            self.close()
+        return event
+
+    def add_item(self, item: object):
+        raise Exception("Cannot add items to a file-based stream")
+
+    def add_items(self, items: Iterable):
+        raise Exception("Cannot add items to a file-based stream")
+
+    def get_batch(self, max_size: int):
+        """
+        Removes and returns a list of up to max_size events from the beginning of the stream. An empty list is returned
+        if the stream is over.
+        """
+        if self.__is_closed:
+            return []
+        end = min(self.__position + max_size, len(self.__binary_file))
+        batch = [Event(row, self.__data_formatter) for row in range(self.__position, end)]
+        self.__position = end
+        if self.__position == len(self.__binary_file):
+            self.close()
+        return batch
+
+    def close(self):
+        """
+        Stops reading the file, and closes it if no other stream reads it. The events already created remain valid.
+        """
+        if self.__is_closed:
+            return
+        self.__is_closed = True
+        self.__position = len(self.__binary_file)
+        self.__binary_file.remove_stream()
+
+    def duplicate(self):
+        if self.__is_closed:
+            exhausted_stream = Stream(is_thread_safe=False)
+            exhausted_stream.close()
+            return exhausted_stream
+        return BinaryFileStream(self.__binary_file, self.__position)
+
+    def count(self):
+        return len(self.__binary_file) - self.__position
+
+    def first(self):
+        if self.__is_closed:
+            return None
+        return Event(self.__position, self.__data_formatter)
+
+    def last(self):
+        if self.__is_closed:
+            return None
+        return Event(len(self.__binary_file) - 1, self.__data_formatter)
+
+
+def get_aligned_offset(offset: int):
+    """
+    Returns the first offset not preceding the given one at which a column may start.
+    """
+    return (offset + COLUMN_ALIGNMENT - 1) // COLUMN_ALIGNMENT * COLUMN_ALIGNMENT
+
+
+def convert_to_binary_event_file(input_file_path: str, data_formatter: DataFormatter, output_file_path: str):
+    """
+    Parses the given file using the given data formatter and stores its events in a binary event file.
+    All events are expected to have the same attributes. The values of each attribute must either be all strings or
+    all numbers.
+    """
+    strings, string_indices = [], {}
+
+    def get_string_index(string: str):
+        if string not in string_indices:
+            string_indices[string] = len(strings)
+            strings.append(string)
+        return string_indices[string]
+
+    attribute_names, attribute_values = None, None
+    event_types, timestamps = array("I"), array("q")
+    for event in FileStream(input_file_path, data_formatter):
+        if attribute_names is None:
+            attribute_names = list(event.payload.keys())
+            attribute_values = [[] for _ in attribute_names]
+        elif list(event.payload.keys()) != attribute_names:
+            raise Exception("All events are expected to have the attributes %s" % attribute_names)
+        for i in range(len(attribute_names)):
+            attribute_values[i].append(event.payload[attribute_names[i]])
+        if type(event.event_type) != str:
+            raise Exception("Event types are expected to be strings")
+        event_types.append(get_string_index(event.event_type))
+        timestamps.append((event.timestamp - EPOCH) // MICROSECOND)
+    if attribute_names is None:
+        attribute_names, attribute_values = [], []
+
+    columns = []
+    for i in range(len(attribute_names)):
+        column_type, column_arrays = _create_column(attribute_names[i], attribute_values[i], get_string_index)
+        columns.append((get_string_index(attribute_names[i]), column_type, column_arrays))
+    columns.append((None, None, [event_types]))
+    columns.append((None, None, [timestamps]))
+
+    with open(output_file_path, "wb") as f:
+        f.write(BINARY_FILE_HEADER.pack(BINARY_FILE_MAGIC, BINARY_FILE_VERSION, len(event_types),
+                                        len(attribute_names), len(strings)))
+        for name_index, column_type, _ in columns[:-2]:
+            f.write(BINARY_FILE_ATTRIBUTE.pack(name_index, column_type))
+        for string in strings:
+            encoded_string = string.encode("utf-8")
+            f.write(BINARY_FILE_STRING_LENGTH.pack(len(encoded_string)))
+            f.write(encoded_string)
+        for _, _, column_arrays in columns:
+            for column_array in column_arrays:
+                f.write(bytes(get_aligned_offset(f.tell()) - f.tell()))
+                f.write(column_array.tobytes())
+
+
+def _create_column(attribute_name: str, values: list, get_string_index: callable):
+    """
+    Selects the column type for the given values of an attribute and returns it along with the arrays to be stored.
+    """
+    if all(type(value) == int for value in values):
+        return INT_COLUMN, [array("q", values)]
+    if all(type(value) == float for value in values):
+        return FLOAT_COLUMN, [array("d", values)]
+    if all(type(value) == str for value in values):
+        return STRING_COLUMN, [array("I", [get_string_index(value) for value in values])]
+    if all(type(value) in (int, float) for value in values):
+        for value in values:
+            if type(value) == int and int(float(value)) != value:
+                raise Exception("The value %d of attribute %s cannot be stored precisely" % (value, attribute_name))
+        return MIXED_COLUMN, [array("d", values), array("B", [type(value) == int for value in values])]
+    raise Exception("The values of attribute %s are neither all strings nor all numbers" % attribute_name)
+
+
+def binary_file_input(file_path: str) -> Stream:
+    """
+    Returns a stream of the events stored in the given binary event file (see convert_to_binary_event_file).
+    """
+    return BinaryFileStream(BinaryEventFile(file_path))
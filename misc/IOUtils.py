@@ -1,17 +1,42 @@
+import os
 from base.DataFormatter import DataFormatter
 from base.Event import Event
-from queue import Queue
+from queue import Queue, Empty
+from typing import Iterable
 
 
 class Stream:
     """
     Represents a generic stream of objects.
+    A thread-safe stream may be shared by a producer thread and a consumer thread, such that reading from an empty
+    stream blocks until a new item arrives. An unsynchronized stream avoids the locking overhead and is meant for the
+    case where the items are added and consumed by the same thread. Reading from an empty unsynchronized stream
+    terminates the iteration, since no new item can arrive in the meantime.
+    An unsynchronized stream keeps its items in a list read from a cursor position. Duplicating such a stream creates
+    a new cursor over the same list, which is only copied once one of the streams sharing it adds new items.
     """
-    def __init__(self):
-        self.__stream = Queue()
+    # the number of consumed items kept in the list of an unsynchronized stream before it is compacted
+    __MAX_CONSUMED_ITEMS = 1024
+
+    def __init__(self, is_thread_safe: bool = True):
+        # the queue guarding the items in the thread-safe mode, or None in the unsynchronized mode
+        self.__queue = Queue() if is_thread_safe else None
+        # the items of an unsynchronized stream, or None in the thread-safe mode
+        self.__items = None if is_thread_safe else []
+        # the position of the next item to read, only advanced in the unsynchronized mode
+        self.__position = 0
+        # whether the list of items is shared with a duplicate of this stream
+        self.__is_shared = False
 
     def __next__(self):
-        next_item = self.__stream.get(block=True)  # Blocking get
+        if self.__queue is not None:
+            next_item = self.__queue.get(block=True)  # Blocking get
+        else:
+            position = self.__position
+            if position == len(self.__items):
+                raise StopIteration()
+            next_item = self.__items[position]
+            self.__position = position + 1
         if next_item is None:
             raise StopIteration()
         return next_item
@@ -19,34 +44,296 @@ class Stream:
     def __iter__(self):
         return self
 
+    def is_thread_safe(self):
+        return self.__queue is not None
+
     def add_item(self, item: object):
-        self.__stream.put(item)
+        if self.__queue is not None:
+            self.__queue.put(item)
+            return
+        if self.__is_shared or self.__position >= Stream.__MAX_CONSUMED_ITEMS:
+            self.__prepare_items_for_modification()
+        self.__items.append(item)
+
+    def add_items(self, items: Iterable):
+        """
+        Adds the given items to the stream at once.
+        """
+        if self.__queue is not None:
+            for item in items:
+                self.__queue.put(item)
+            return
+        if self.__is_shared or self.__position >= Stream.__MAX_CONSUMED_ITEMS:
+            self.__prepare_items_for_modification()
+        self.__items.extend(items)
+
+    def __prepare_items_for_modification(self):
+        """
+        Prepares the list of items of an unsynchronized stream for modification: a shared list is copied, and the
+        consumed items are discarded once they make up at least half of the list.
+        """
+        if self.__is_shared or 2 * self.__position >= len(self.__items):
+            self.__items = self.__items[self.__position:]
+            self.__position = 0
+            self.__is_shared = False
+
+    def get_batch(self, max_size: int):
+        """
+        Removes and returns a list of up to max_size items from the beginning of the stream.
+        In the thread-safe mode, blocks until at least one item is available. An empty list is returned if the stream
+        is over. Unlike the iteration, the end of the stream is not consumed in the unsynchronized mode, so that it
+        remains observable. In the thread-safe mode, the end of the stream is put back once it is reached.
+        """
+        if self.__queue is None:
+            end = min(self.__position + max_size, len(self.__items))
+            if end > self.__position and self.__items[end - 1] is None:
+                end -= 1
+            batch = self.__items[self.__position:end]
+            self.__position = end
+            return batch
+        batch = []
+        item = self.__queue.get(block=True)
+        while item is not None:
+            batch.append(item)
+            if len(batch) == max_size:
+                return batch
+            try:
+                item = self.__queue.get_nowait()
+            except Empty:
+                return batch
+        # the end of the stream is put back so that the following reads observe it as well
+        self.__queue.put(None)
+        return batch
 
     def close(self):
-        self.__stream.put(None)
+        self.add_item(None)
 
     def duplicate(self):
-        ret = Stream()
-        ret.__stream.queue = self.__stream.queue.copy()
+        """
+        Returns a new stream containing the remaining items of this stream.
+        An unsynchronized stream is duplicated in constant time by sharing its items with the new stream.
+        """
+        ret = Stream(self.is_thread_safe())
+        if ret.__queue is None:
+            ret.__items = self.__items
+            ret.__position = self.__position
+            ret.__is_shared = self.__is_shared = True
+            return ret
+        ret.add_items(self.__queue.queue.copy())
         return ret
 
     def get_item(self):
         return self.__next__()
 
     def count(self):
-        return self.__stream.qsize()
+        if self.__queue is not None:
+            return self.__queue.qsize()
+        return len(self.__items) - self.__position
 
     def first(self):
-        return self.__stream.queue[0]
+        """
+        Returns the next item without consuming it, or None if the stream is over or no item is available yet.
+        """
+        items, position = self.__get_remaining_items()
+        if position == len(items):
+            return None
+        return items[position]
 
     def last(self):
-        x = self.__stream.queue[-1]
+        if self.first() is None:
+            return None
+        items, _ = self.__get_remaining_items()
+        x = items[-1]
         if x is None:  # if stream is closed last is None. We need the one before None.
-            x = self.__stream.queue[-2]
+            x = items[-2]
         return x
 
+    def __get_remaining_items(self):
+        """
+        Returns a sequence containing the remaining items of the stream, and the position of the first of them.
+        """
+        if self.__queue is not None:
+            return self.__queue.queue, 0
+        return self.__items, self.__position
+
+
+class FileStream(Stream):
+    """
+    A read-only stream of events lazily read from a file.
+    The file is read in chunks of lines, and each line is only parsed into an event when the event is requested. This
+    way, the memory consumption does not depend on the size of the file, and the evaluation may start before the file
+    is fully parsed.
+    The file is only opened once the first event is requested, and is closed as soon as its end is reached. A stream
+    that is not read to its end should be closed, e.g., by using it as a context manager.
+    """
+    CHUNK_SIZE_HINT = 1 << 20  # the approximate number of characters read at once
+    BACKWARD_BLOCK_SIZE = 1 << 12  # the number of bytes read at once when looking for the last line of the file
+
+    def __init__(self, file_path: str, data_formatter: DataFormatter, offset: int = 0, lines_to_skip: int = 0):
+        super().__init__(is_thread_safe=False)
+        self.__file_path = file_path
+        self.__data_formatter = data_formatter
+        self.__file = None
+        # whether the end of the file was reached or the stream was closed, in which case the file is not reopened
+        self.__is_file_over = False
+        self.__chunk = []
+        self.__chunk_index = 0
+        self.__chunk_offset = offset
+        self.__next_chunk_offset = offset
+        # the number of lines at the beginning of the first chunk that were already consumed by another stream
+        self.__lines_to_skip = lines_to_skip
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __read_chunk(self):
+        """
+        Reads the next chunk of lines from the file, opening the file if necessary. The file is closed once it is
+        exhausted.
+        """
+        self.__chunk = []
+        self.__chunk_index = 0
+        if self.__is_file_over:
+            return
+        if self.__file is None:
+            self.__file = open(self.__file_path, "r")
+            self.__file.seek(self.__next_chunk_offset)
+        self.__chunk_offset = self.__next_chunk_offset
+        size = 0
+        while size < FileStream.CHUNK_SIZE_HINT:
+            line = self.__file.readline()
+            if not line:
+                self.close()
+                break
+            self.__chunk.append(line)
+            size += len(line)
+        if self.__file is not None:
+            self.__next_chunk_offset = self.__file.tell()
+        self.__chunk_index = min(self.__lines_to_skip, len(self.__chunk))
+        self.__lines_to_skip -= self.__chunk_index
+
+    def __has_next_line(self):
+        """
+        Returns True if an unread line remains, reading the next chunks as necessary, and False otherwise.
+        """
+        while self.__chunk_index == len(self.__chunk):
+            if self.__is_file_over:
+                return False
+            self.__read_chunk()
+        return True
+
+    def __next__(self):
+        if not self.__has_next_line():
+            raise StopIteration()
+        line = self.__chunk[self.__chunk_index]
+        self.__chunk_index += 1
+        return Event(line, self.__data_formatter)
+
+    def add_item(self, item: object):
+        raise Exception("Cannot add items to a file-based stream")
+
+    def add_items(self, items: Iterable):
+        raise Exception("Cannot add items to a file-based stream")
+
+    def get_batch(self, max_size: int):
+        """
+        Removes and returns a list of up to max_size events from the beginning of the stream. An empty list is returned
+        if the file is over.
+        """
+        batch = []
+        while len(batch) < max_size and self.__has_next_line():
+            end = min(len(self.__chunk), self.__chunk_index + max_size - len(batch))
+            batch.extend(Event(line, self.__data_formatter) for line in self.__chunk[self.__chunk_index:end])
+            self.__chunk_index = end
+        return batch
+
+    def close(self):
+        """
+        Stops reading the file. The events that were already read are still available.
+        """
+        self.__is_file_over = True
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def duplicate(self):
+        """
+        Returns a new stream reading the remaining events from the same file. The file is only opened by the new stream
+        once an event is requested from it.
+        """
+        if self.__chunk_index == len(self.__chunk) and self.__is_file_over:
+            exhausted_stream = Stream(is_thread_safe=False)
+            exhausted_stream.close()
+            return exhausted_stream
+        return FileStream(self.__file_path, self.__data_formatter, self.__chunk_offset,
+                          self.__chunk_index + self.__lines_to_skip)
+
+    def __get_remaining_lines(self):
+        """
+        Returns an iterator over the lines of the file that were not read into a chunk yet and are not skipped.
+        Requires opening the file separately.
+        """
+        if self.__is_file_over:
+            return
+        with open(self.__file_path, "r") as f:
+            f.seek(self.__next_chunk_offset)
+            lines_to_skip = self.__lines_to_skip
+            for line in f:
+                if lines_to_skip > 0:
+                    lines_to_skip -= 1
+                    continue
+                yield line
+
+    def count(self):
+        """
+        Returns the number of the remaining events. Requires a pass over the rest of the file.
+        """
+        return len(self.__chunk) - self.__chunk_index + sum(1 for _ in self.__get_remaining_lines())
+
+    def first(self):
+        if not self.__has_next_line():
+            return None
+        return Event(self.__chunk[self.__chunk_index], self.__data_formatter)
+
+    def last(self):
+        """
+        Returns the last event in the file, or None if no events remain. The last line is found by reading the file
+        backwards from its end, hence the rest of the file is not read.
+        """
+        if not self.__has_next_line():
+            return None
+        # once a line is available, no more lines are skipped, and the remaining lines are the rest of the current
+        # chunk followed by the rest of the file
+        if not self.__is_file_over:
+            last_line_offset = self.__find_last_line_offset()
+            if last_line_offset >= self.__next_chunk_offset:
+                with open(self.__file_path, "r") as f:
+                    f.seek(last_line_offset)
+                    return Event(f.readline(), self.__data_formatter)
+        return Event(self.__chunk[-1], self.__data_formatter)
+
+    def __find_last_line_offset(self):
+        """
+        Returns the offset at which the last line of the file starts.
+        """
+        with open(self.__file_path, "rb") as f:
+            position = f.seek(0, os.SEEK_END)
+            # the newline terminating the last line does not precede it
+            search_end = position - 1
+            while position > 0:
+                position = max(position - FileStream.BACKWARD_BLOCK_SIZE, 0)
+                f.seek(position)
+                newline_index = f.read(search_end - position).rfind(b"\n")
+                if newline_index >= 0:
+                    return position + newline_index + 1
+                search_end = position
+            return 0
+
 
-def file_input(file_path: str, data_formatter: DataFormatter) -> Stream:
+def file_input(file_path: str, data_formatter: DataFormatter, lazy: bool = False) -> Stream:
     """
     Receives a file and returns a stream of events.
     "filepath": the path to the file that is to be read.
@@ -54,12 +341,15 @@ def file_input(file_path: str, data_formatter: DataFormatter) -> Stream:
     * Each line will be a different event
     * Each line will be split on "," and the resulting array will be stored in an "Event",
       and the keys are determined from the given list "KeyMap".
+    If "lazy" is set, the file is read and parsed gradually during the iteration over the stream (see FileStream)
+    instead of being loaded into the memory in advance.
     """
+    if lazy:
+        return FileStream(file_path, data_formatter)
     with open(file_path, "r") as f:
         content = f.readlines()
-    events = Stream()
-    for line in content:
-        events.add_item(Event(line, data_formatter))
+    events = Stream(is_thread_safe=False)
+    events.add_items(Event(line, data_formatter) for line in content)
     events.close()
     return events
 
@@ -1,42 +1,139 @@
+import random
+from bisect import bisect_right
+from itertools import accumulate
+from statistics import NormalDist
 from typing import List
 
+from base.EventSchema import CompactPayload
 from base.Formula import Formula
 from base.Pattern import Pattern
 from base.PatternStructure import SeqOperator, QItem
 from misc.IOUtils import Stream
 
+# the maximal number of events (or pairs of events) a condition is evaluated on when estimating its selectivity
+DEFAULT_SELECTIVITY_SAMPLE_SIZE = 10000
+DEFAULT_SELECTIVITY_CONFIDENCE = 0.95
+# the number of evaluations after which a sampled estimation is first checked against the required error bound
+INITIAL_SELECTIVITY_SAMPLE_SIZE = 256
 
-def get_condition_selectivity(arg1: QItem, arg2: QItem, formula: Formula, stream: Stream, is_sequence: bool):
+
+def get_selectivity_error_bound(selectivity: float, sample_size: int, confidence: float):
     """
-    Calculates the selectivity of a given condition between two event types by evaluating it on a given stream.
+    Returns the half-width of the Wilson score interval of a selectivity estimated on a uniform random sample of the
+    given size, such that the actual selectivity lies within this distance of the estimate with the given confidence.
+    Unlike the normal approximation, the bound does not vanish for estimates of 0 or 1.
     """
-    if formula is None:
+    if sample_size == 0:
         return 1.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return z / (1 + z * z / sample_size) * \
+        (selectivity * (1 - selectivity) / sample_size + z * z / (4 * sample_size * sample_size)) ** 0.5
 
-    count = 0
-    match_count = 0
+
+def get_condition_selectivity(arg1: QItem, arg2: QItem, formula: Formula, stream: Stream, is_sequence: bool,
+                              sample_size: int = DEFAULT_SELECTIVITY_SAMPLE_SIZE):
+    """
+    Calculates the selectivity of a given condition between two event types by evaluating it on a given stream.
+    If sample_size is not None, the condition is only evaluated on a uniform random sample of at most this number of
+    the events (or pairs of events) it applies to.
+    """
+    selectivity, _ = estimate_condition_selectivity(arg1, arg2, formula, stream, is_sequence, sample_size)
+    return selectivity
+
+
+def estimate_condition_selectivity(arg1: QItem, arg2: QItem, formula: Formula, stream: Stream, is_sequence: bool,
+                                   sample_size: int = DEFAULT_SELECTIVITY_SAMPLE_SIZE,
+                                   confidence: float = DEFAULT_SELECTIVITY_CONFIDENCE, max_error: float = None):
+    """
+    Estimates the selectivity of a given condition between two event types on a given stream, and returns the estimate
+    along with its error bound at the given confidence (0.0 if the condition was evaluated on all of its events).
+    If a maximal error is given, the sampling stops as soon as the error bound does not exceed it.
+    In a sequence, the condition only applies to the pairs in which the event of arg1 precedes the event of arg2.
+    """
+    events_by_type = _get_events_by_type(stream, {arg1.event_type, arg2.event_type})
+    return _estimate_selectivity(arg1, arg2, formula, events_by_type, is_sequence, sample_size, confidence, max_error)
+
+
+def _get_events_by_type(stream: Stream, event_types: set):
+    """
+    Returns a dictionary mapping each of the given event types to the list of its events in the given stream, in the
+    order of their arrival.
+    """
+    events_by_type = {event_type: [] for event_type in event_types}
+    for event in stream:
+        events = events_by_type.get(event.event_type)
+        if events is not None:
+            events.append(event)
+    return events_by_type
+
+
+def _estimate_selectivity(arg1: QItem, arg2: QItem, formula: Formula, events_by_type: dict, is_sequence: bool,
+                           sample_size: int, confidence: float, max_error: float):
+    """
+    Estimates the selectivity of the given condition on the given events of each type. The events (or pairs of events)
+    are drawn uniformly at random, and the condition is evaluated in batches by a single compiled expression.
+    """
+    if formula is None:
+        return 1.0, 0.0
+    events1 = events_by_type[arg1.event_type]
+    events2 = events_by_type[arg2.event_type]
+    schema = None
+    if len(events1) > 0 and isinstance(events1[0].payload, CompactPayload):
+        schema = events1[0].payload.schema
 
     if arg1 == arg2:
-        for event in stream:
-            if event.eventType == arg1.event_type:
-                count += 1
-                if formula.eval({arg1.name: event.event}):
-                    match_count += 1
+        count_satisfying = formula.compile_counter({arg1.name: 0}, schema)
+        population_size = len(events1)
+        draw = lambda size: [(event,) for event in random.sample(events1, size)]
+        enumerate_all = lambda: ((event,) for event in events1)
     else:
-        events1 = []
-        events2 = []
-        for event in stream:
-            if event.eventType == arg1.event_type:
-                events1.append(event)
-            elif event.eventType == arg2.event_type:
-                events2.append(event)
-        for event1 in events1:
-            for event2 in events2:
-                if (not is_sequence) or event1.date < event2.date:
-                    count += 1
-                    if formula.eval({arg1.name: event1.event, arg2.name: event2.event}):
-                        match_count += 1
-    return match_count / count
+        count_satisfying = formula.compile_counter({arg1.name: 0, arg2.name: 1}, schema)
+        if is_sequence:
+            # the partners of each event of arg1 are the events of arg2 following it
+            timestamps2 = [event.timestamp for event in events2]
+            first_partners = [bisect_right(timestamps2, event.timestamp) for event in events1]
+            partners_counts = [len(events2) - first_partner for first_partner in first_partners]
+        else:
+            first_partners = [0] * len(events1)
+            partners_counts = [len(events2) - (1 if events1 is events2 else 0)] * len(events1)
+        # an event is never paired with itself
+        skips_self = events1 is events2 and not is_sequence
+        population_size = sum(partners_counts)
+
+        def draw(size: int):
+            # an event of arg1 is drawn with a probability proportional to its number of partners, hence every pair is
+            # equally likely
+            indices = random.choices(range(len(events1)), cum_weights=list(accumulate(partners_counts)), k=size)
+            pairs = []
+            for i in indices:
+                j = random.randrange(first_partners[i], first_partners[i] + partners_counts[i])
+                if skips_self and j >= i:
+                    j += 1
+                pairs.append((events1[i], events2[j]))
+            return pairs
+
+        def enumerate_all():
+            for i in range(len(events1)):
+                for j in range(first_partners[i], len(events2)):
+                    if not skips_self or i != j:
+                        yield events1[i], events2[j]
+
+    if population_size == 0:
+        return 1.0, 0.0
+    if sample_size is None or population_size <= sample_size:
+        return count_satisfying(enumerate_all()) / population_size, 0.0
+
+    evaluations_count = satisfied_count = 0
+    batch_size = sample_size if max_error is None else min(INITIAL_SELECTIVITY_SAMPLE_SIZE, sample_size)
+    while True:
+        satisfied_count += count_satisfying(draw(batch_size))
+        evaluations_count += batch_size
+        selectivity = satisfied_count / evaluations_count
+        error_bound = get_selectivity_error_bound(selectivity, evaluations_count, confidence)
+        if evaluations_count >= sample_size or (max_error is not None and error_bound <= max_error):
+            return selectivity, error_bound
+        # the sample is doubled until it suffices
+        batch_size = min(evaluations_count, sample_size - evaluations_count)
 
 
 def get_occurrences_dict(pattern: Pattern, stream: Stream):
@@ -45,29 +142,38 @@ def get_occurrences_dict(pattern: Pattern, stream: Stream):
     given event stream.
     """
     ret = {}
-    types = {qitem.eventType for qitem in pattern.structure.args}
+    types = {qitem.event_type for qitem in pattern.structure.args}
     for event in stream:
-        if event.eventType in types:
-            if event.eventType in ret.keys():
-                ret[event.eventType] += 1
+        if event.event_type in types:
+            if event.event_type in ret.keys():
+                ret[event.event_type] += 1
             else:
-                ret[event.eventType] = 1
+                ret[event.event_type] = 1
     return ret
 
 
-def calculate_selectivity_matrix(pattern: Pattern, stream: Stream):
+def calculate_selectivity_matrix(pattern: Pattern, stream: Stream,
+                                 sample_size: int = DEFAULT_SELECTIVITY_SAMPLE_SIZE,
+                                 confidence: float = DEFAULT_SELECTIVITY_CONFIDENCE, max_error: float = None):
     """
     Returns a matrix containing the selectivity between each pair of events from the given pattern in the
     given event stream.
+    The stream is traversed once, and each selectivity is estimated on a sample of at most sample_size events or pairs
+    of events (see estimate_condition_selectivity), or on all of them if sample_size is None.
     """
     args = pattern.structure.args
     args_num = len(args)
-    selectivity_matrix = [[0.0 for _ in range(args_num)] for _ in range(args_num)]
+    is_sequence = pattern.structure.get_top_operator() == SeqOperator
+    events_by_type = _get_events_by_type(stream.duplicate(), {arg.event_type for arg in args})
+    selectivity_matrix = [[1.0 for _ in range(args_num)] for _ in range(args_num)]
+    if pattern.condition is None:
+        return selectivity_matrix
     for i in range(args_num):
         for j in range(i + 1):
-            new_sel = get_condition_selectivity(args[i], args[j],
+            # in a sequence, the event of the earlier item must precede the event of the later one
+            new_sel, _ = _estimate_selectivity(args[j], args[i],
                                                 pattern.condition.get_formula_of({args[i].name, args[j].name}),
-                                                stream.duplicate(), pattern.structure.get_top_operator() == SeqOperator)
+                                                events_by_type, is_sequence, sample_size, confidence, max_error)
             selectivity_matrix[i][j] = selectivity_matrix[j][i] = new_sel
 
     return selectivity_matrix
@@ -78,9 +184,9 @@ def get_arrival_rates(pattern: Pattern, stream: Stream):
     Returns a list containing the arrival rates of the event types defined by the given pattern, measured according to
     their appearances in given event stream.
     """
-    time_interval = (stream.last().date - stream.first().date).total_seconds()
+    time_interval = (stream.last().timestamp - stream.first().timestamp).total_seconds()
     counters = get_occurrences_dict(pattern, stream.duplicate())
-    return [counters[i.eventType] / time_interval for i in pattern.structure.args]
+    return [counters.get(i.event_type, 0) / time_interval for i in pattern.structure.args]
 
 
 def calculate_left_deep_tree_cost_function(order: List[int], selectivity_matrix: List[List[float]],
@@ -0,0 +1,208 @@
+"""
+This file contains the online statistics collector, measuring the statistics required by the tree builders during the
+evaluation itself rather than in a separate offline pass over the input (see Statistics.py).
+The statistics refer to a sliding time window over the stream, divided into a fixed number of buckets. Each bucket
+counts the arrivals of each event type, the events accepted by the condition of each item of the pattern, and the
+evaluations and the successes of the conditions between pairs of items. The condition between two items is only
+evaluated on a bounded sample: each new event is compared to a few events randomly chosen among the latest events
+accepted by the other item. Hence, the memory consumed by the collector does not depend on the rate of the stream.
+"""
+import random
+from collections import deque
+from datetime import timedelta, datetime
+from functools import reduce
+
+from base.Event import Event
+from base.EventSchema import EventSchema
+from base.Formula import AndFormula
+from base.Pattern import Pattern
+from base.PatternStructure import SeqOperator
+
+
+class StatisticsCollectionParameters:
+    """
+    Parameters of the online statistics collection:
+    - the time window (according to the timestamps of the events) the statistics refer to;
+    - the number of the latest events accepted by each item kept as a sample;
+    - the number of sampled events of the other item each new event is compared to when estimating the selectivity of
+      a condition between two items.
+    """
+    def __init__(self, time_window: timedelta = timedelta(minutes=30), sample_size: int = 100,
+                 comparisons_count: int = 10):
+        if time_window <= timedelta(0):
+            raise Exception("The time window of the statistics must be positive")
+        self.time_window = time_window
+        self.sample_size = sample_size
+        self.comparisons_count = comparisons_count
+
+
+class StatisticsBucket:
+    """
+    The measurements of a single time slice of the sliding window.
+    """
+    def __init__(self, number: int, start: datetime, items_count: int):
+        self.number = number
+        self.start = start
+        self.arrivals_counts = {}
+        self.acceptances_counts = [0] * items_count
+        # the number of evaluations and successes of the condition of each pair of items (i, j), where i < j
+        self.trials_counts = {}
+        self.successes_counts = {}
+
+
+class StatisticsCollector:
+    """
+    Incrementally collects the arrival rates of the event types of a pattern and the selectivities of its conditions,
+    and provides them in the format of StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES.
+    As in the offline calculation, the selectivity of the condition of a single item is the fraction of the events of
+    its type satisfying it, and a condition between the items of a sequence is only evaluated on pairs of events
+    following the order of the items. The selectivity of a condition between two items is measured on the events
+    accepted by their own conditions, as the latter are already accounted for by the diagonal of the matrix.
+    """
+    BUCKETS_COUNT = 16
+
+    def __init__(self, pattern: Pattern, params: StatisticsCollectionParameters = None):
+        if params is None:
+            params = StatisticsCollectionParameters()
+        self.__params = params
+        self.__bucket_duration = params.time_window / StatisticsCollector.BUCKETS_COUNT
+        args = pattern.structure.args
+        self.__names = [qitem.name for qitem in args]
+        self.__event_types = [qitem.event_type for qitem in args]
+        self.__items_by_event_type = {}
+        for i in range(len(args)):
+            self.__items_by_event_type.setdefault(args[i].event_type, []).append(i)
+
+        self.__item_conditions = [None] * len(args)
+        # the items each item is compared to upon a new event, along with the conditions between them
+        self.__pair_conditions = [[] for _ in args]
+        is_sequence = pattern.structure.get_top_operator() == SeqOperator
+        condition = pattern.condition
+        for i in range(len(args)):
+            if condition is None:
+                break
+            self.__item_conditions[i] = condition.get_formula_of({args[i].name})
+            for j in range(i if is_sequence else len(args)):
+                if j == i:
+                    continue
+                pair_condition = StatisticsCollector.__get_pair_condition(condition, args[i].name, args[j].name)
+                if pair_condition is not None:
+                    self.__pair_conditions[i].append((j, pair_condition))
+        self.__compiled_item_conditions = None
+        self.__compiled_pair_conditions = None
+        self.set_event_schema(None)
+
+        self.__samples = [deque(maxlen=params.sample_size) for _ in args]
+        self.__buckets = deque()
+        self.__first_timestamp = None
+        self.__last_timestamp = None
+
+    @staticmethod
+    def __get_pair_condition(condition, first_name: str, second_name: str):
+        """
+        Returns the part of the given condition referring to both given names, or None if there is no such part.
+        """
+        pair_condition = condition.get_formula_of({first_name, second_name})
+        if pair_condition is None:
+            return None
+        conjuncts = [conjunct for conjunct in pair_condition.get_conjuncts()
+                     if conjunct.get_formula_of({first_name}) is None and conjunct.get_formula_of({second_name}) is None]
+        if len(conjuncts) == 0:
+            return None
+        return reduce(AndFormula, conjuncts)
+
+    def set_event_schema(self, schema: EventSchema = None):
+        """
+        Compiles the conditions for events whose payloads follow the given schema (or for dictionary payloads if no
+        schema is given).
+        """
+        names = self.__names
+        self.__compiled_item_conditions = [None if condition is None else condition.compile({name: 0}, schema)
+                                           for condition, name in zip(self.__item_conditions, names)]
+        self.__compiled_pair_conditions = [
+            [(j, condition.compile({names[i]: 0, names[j]: 1}, schema)) for j, condition in self.__pair_conditions[i]]
+            for i in range(len(self.__pair_conditions))]
+
+    def handle_event(self, event: Event):
+        """
+        Updates the statistics according to the given event.
+        """
+        items = self.__items_by_event_type.get(event.event_type)
+        if items is None:
+            return
+        bucket = self.__get_bucket(event.timestamp)
+        bucket.arrivals_counts[event.event_type] = bucket.arrivals_counts.get(event.event_type, 0) + 1
+        accepting_items = []
+        for i in items:
+            condition = self.__compiled_item_conditions[i]
+            if condition is None or condition([event]):
+                bucket.acceptances_counts[i] += 1
+                accepting_items.append(i)
+        comparisons_count = self.__params.comparisons_count
+        for i in accepting_items:
+            for j, condition in self.__compiled_pair_conditions[i]:
+                sample = self.__samples[j]
+                if len(sample) == 0:
+                    continue
+                other_events = sample if len(sample) <= comparisons_count else random.sample(sample, comparisons_count)
+                pair = (i, j) if i < j else (j, i)
+                successes_count = 0
+                for other_event in other_events:
+                    if condition([event, other_event]):
+                        successes_count += 1
+                bucket.trials_counts[pair] = bucket.trials_counts.get(pair, 0) + len(other_events)
+                bucket.successes_counts[pair] = bucket.successes_counts.get(pair, 0) + successes_count
+        # the event is only sampled after the comparisons, so that it is not compared to itself
+        for i in accepting_items:
+            self.__samples[i].append(event)
+
+    def __get_bucket(self, timestamp: datetime):
+        """
+        Returns the bucket of the given timestamp, discarding the buckets that left the time window. An event preceding
+        the latest one is counted in the latest bucket.
+        """
+        if self.__first_timestamp is None:
+            self.__first_timestamp = timestamp
+        if self.__last_timestamp is None or timestamp > self.__last_timestamp:
+            self.__last_timestamp = timestamp
+        number = (timestamp - self.__first_timestamp) // self.__bucket_duration
+        if len(self.__buckets) > 0 and self.__buckets[-1].number >= number:
+            return self.__buckets[-1]
+        bucket = StatisticsBucket(number, self.__first_timestamp + number * self.__bucket_duration,
+                                  len(self.__event_types))
+        self.__buckets.append(bucket)
+        while self.__buckets[0].number <= number - StatisticsCollector.BUCKETS_COUNT:
+            self.__buckets.popleft()
+        return bucket
+
+    def get_statistics(self):
+        """
+        Returns the selectivity matrix and the arrival rates measured during the time window preceding the latest event.
+        Selectivities that could not be measured are 1.0.
+        """
+        items_count = len(self.__event_types)
+        arrivals_counts, acceptances_counts = {}, [0] * items_count
+        trials_counts, successes_counts = {}, {}
+        for bucket in self.__buckets:
+            for event_type, count in bucket.arrivals_counts.items():
+                arrivals_counts[event_type] = arrivals_counts.get(event_type, 0) + count
+            for i in range(items_count):
+                acceptances_counts[i] += bucket.acceptances_counts[i]
+            for pair, count in bucket.trials_counts.items():
+                trials_counts[pair] = trials_counts.get(pair, 0) + count
+                successes_counts[pair] = successes_counts.get(pair, 0) + bucket.successes_counts[pair]
+
+        seconds = 0.0
+        if len(self.__buckets) > 0:
+            seconds = (self.__last_timestamp - self.__buckets[0].start).total_seconds()
+        arrival_rates = [0.0 if seconds == 0 else arrivals_counts.get(event_type, 0) / seconds
+                         for event_type in self.__event_types]
+        selectivity_matrix = [[1.0 for _ in range(items_count)] for _ in range(items_count)]
+        for i in range(items_count):
+            arrivals_count = arrivals_counts.get(self.__event_types[i], 0)
+            if arrivals_count > 0:
+                selectivity_matrix[i][i] = acceptances_counts[i] / arrivals_count
+        for (i, j), trials_count in trials_counts.items():
+            if trials_count > 0:
+                selectivity_matrix[i][j] = selectivity_matrix[j][i] = successes_counts[(i, j)] / trials_count
+        return selectivity_matrix, arrival_rates
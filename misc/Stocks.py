@@ -1,6 +1,8 @@
 from datetime import datetime
+from sys import intern
 
 from base.DataFormatter import DataFormatter
+from base.EventSchema import EventSchema, CompactPayload
 from misc.Utils import str_to_number
 
 METASTOCK_7_COLUMN_KEYS = [
@@ -15,21 +17,38 @@ METASTOCK_7_COLUMN_KEYS = [
 METASTOCK_EVENT_TYPE_KEY = "Stock Ticker"
 METASTOCK_EVENT_TIMESTAMP_KEY = "Date"
 
+METASTOCK_7_SCHEMA = EventSchema(METASTOCK_7_COLUMN_KEYS)
+
 
 class MetastockDataFormatter(DataFormatter):
     """
     A data formatter implementation for a stock event stream, where each event is given as a string in metastock 7
     format.
+    If compact_payload is set, the events are created with compact payloads following METASTOCK_7_SCHEMA.
     """
+    def __init__(self, compact_payload: bool = False):
+        self.__compact_payload = compact_payload
+        # consecutive events usually share a timestamp, which is only created once
+        self.__last_date = None
+        self.__last_timestamp = None
+
     def parse_event(self, raw_data: str):
         """
         Parses a metastock 7 formatted string into an event.
         """
         event_attributes = raw_data.replace("\n", "").split(",")
-        for j in range(len(event_attributes)):
+        # the stock ticker is the only non-numeric attribute
+        for j in range(1, len(event_attributes)):
             event_attributes[j] = str_to_number(event_attributes[j])
+        if self.__compact_payload:
+            # the stock tickers are shared among all events of the same type instead of being stored per event
+            event_attributes[0] = intern(event_attributes[0])
+            return CompactPayload(METASTOCK_7_SCHEMA, tuple(event_attributes))
         return dict(zip(METASTOCK_7_COLUMN_KEYS, event_attributes))
 
+    def get_event_schema(self):
+        return METASTOCK_7_SCHEMA if self.__compact_payload else None
+
     def get_event_type(self, event_payload: dict):
         """
         The type of a stock event is equal to the stock ticker (company name).
@@ -40,6 +59,17 @@ class MetastockDataFormatter(DataFormatter):
         """
         The event timestamp is represented in metastock 7 using a YYYYMMDDhhmm format.
         """
-        timestamp_str = str(event_payload[METASTOCK_EVENT_TIMESTAMP_KEY])
-        return datetime(year=int(timestamp_str[0:4]), month=int(timestamp_str[4:6]), day=int(timestamp_str[6:8]),
-                        hour=int(timestamp_str[8:10]), minute=int(timestamp_str[10:12]))
+        date = event_payload[METASTOCK_EVENT_TIMESTAMP_KEY]
+        if date == self.__last_date:
+            return self.__last_timestamp
+        if type(date) == int and 10 ** 11 <= date < 10 ** 12:
+            timestamp = datetime(year=date // 100000000, month=date // 1000000 % 100, day=date // 10000 % 100,
+                                 hour=date // 100 % 100, minute=date % 100)
+        else:
+            timestamp_str = str(date)
+            timestamp = datetime(year=int(timestamp_str[0:4]), month=int(timestamp_str[4:6]),
+                                 day=int(timestamp_str[6:8]), hour=int(timestamp_str[8:10]),
+                                 minute=int(timestamp_str[10:12]))
+        self.__last_date = date
+        self.__last_timestamp = timestamp
+        return timestamp
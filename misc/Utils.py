@@ -13,6 +13,7 @@ from base.PatternMatch import PatternMatch
 from copy import deepcopy
 
 from evaluation.PartialMatch import PartialMatch
+from evaluation.EvaluationMechanism import SelectionStrategies, ConsumptionPolicies
 from misc.IOUtils import Stream
 
 
@@ -67,11 +68,19 @@ def is_int(x: str):
 
 
 def str_to_number(x: str):
-    if is_int(x):
-        return int(x)
-    elif is_float(x):
+    """
+    Converts the given string into an int if possible, otherwise into a float if possible, and returns it as is
+    otherwise. Each conversion is attempted at most once, and a string containing a decimal point is never
+    attempted to be converted into an int.
+    """
+    if "." not in x:
+        try:
+            return int(x)
+        except ValueError:
+            pass
+    try:
         return float(x)
-    else:
+    except ValueError:
         return x
 
 
@@ -178,7 +187,9 @@ def generate_matches_with_negation(pattern, stream):
     matches = generate_matches(pattern, stream)
     
 
-def generate_matches(pattern: Pattern, stream: Stream):
+def generate_matches(pattern: Pattern, stream: Stream,
+                     selection_strategy: SelectionStrategies = SelectionStrategies.SKIP_TILL_ANY_MATCH,
+                     consumption_policy: ConsumptionPolicies = ConsumptionPolicies.REUSE):
     """
     A recursive, very inefficient pattern match finder.
     It is used as our test creator.
@@ -188,14 +199,69 @@ def generate_matches(pattern: Pattern, stream: Stream):
     is_seq = (pattern.structure.get_top_operator() == SeqOperator)
     events = {}
     matches = []
+    sequence_number = 0
     for event in stream:
+        event.sequence_number = sequence_number
+        sequence_number += 1
         if event.event_type in types:
             if event.event_type in events.keys():
                 events[event.event_type].append(event)
             else:
                 events[event.event_type] = [event]
     generate_matches_recursive(pattern, events, is_seq, [], datetime.max, datetime.min, matches, {})
-    return matches
+    if selection_strategy == SelectionStrategies.SKIP_TILL_ANY_MATCH and consumption_policy == ConsumptionPolicies.REUSE:
+        return matches
+    return filter_matches_by_policies(pattern, matches, events, selection_strategy, consumption_policy)
+
+
+def filter_matches_by_policies(pattern: Pattern, matches: List[PatternMatch], events: dict,
+                               selection_strategy: SelectionStrategies, consumption_policy: ConsumptionPolicies):
+    """
+    Returns the matches satisfying the given selection strategy and consumption policy out of the given matches of the
+    given pattern. The matches are considered in the order of their completion, i.e., the arrival of their last events.
+    """
+    is_seq = (pattern.structure.get_top_operator() == SeqOperator)
+    matches = sorted(matches, key=lambda match: (max(event.sequence_number for event in match.events),
+                                                 sorted(event.sequence_number for event in match.events)))
+    filtered_matches = []
+    # the sequence numbers of the consumed events
+    consumed_events = set()
+    for match in matches:
+        match_positions = [event.sequence_number for event in match.events]
+        if selection_strategy == SelectionStrategies.STRICT_CONTIGUITY:
+            if is_seq:
+                if any(match_positions[i] != match_positions[i - 1] + 1 for i in range(1, len(match_positions))):
+                    continue
+            elif len(set(match_positions)) < len(match_positions) or \
+                    max(match_positions) - min(match_positions) != len(match_positions) - 1:
+                continue
+        elif selection_strategy == SelectionStrategies.SKIP_TILL_NEXT_MATCH and \
+                does_match_skip_event(pattern, match, events):
+            continue
+        if consumption_policy == ConsumptionPolicies.SINGLE_MATCH:
+            if not consumed_events.isdisjoint(match_positions):
+                continue
+            consumed_events.update(match_positions)
+        filtered_matches.append(match)
+    return filtered_matches
+
+
+def does_match_skip_event(pattern: Pattern, match: PatternMatch, events: dict):
+    """
+    Returns True if some event between two consecutive events of the given match of a sequence pattern could have
+    extended the events preceding it in place of the latter, and False otherwise.
+    """
+    args = pattern.structure.args
+    for i in range(1, len(args)):
+        binding = {args[j].name: match.events[j].payload for j in range(i + 1)}
+        condition = pattern.condition.get_formula_of(set(binding.keys()))
+        first_position, last_position = match.events[i - 1].sequence_number, match.events[i].sequence_number
+        for event in events[args[i].event_type]:
+            if first_position < event.sequence_number < last_position:
+                binding[args[i].name] = event.payload
+                if condition is None or condition.eval(binding):
+                    return True
+    return False
 
 
 def generate_matches_recursive(pattern: Pattern, events: dict, is_seq: bool, match: list, min_event_timestamp: datetime,
@@ -1,16 +1,20 @@
 import os
+import tempfile
 from CEP import CEP
-from evaluation.EvaluationMechanism import NegationMode
+from evaluation.EvaluationMechanism import NegationMode, SelectionStrategies, ConsumptionPolicies
 from evaluation.EvaluationMechanismFactory import EvaluationMechanismTypes, \
-    IterativeImprovementEvaluationMechanismParameters, EvaluationMechanismParameters
-from misc.IOUtils import file_input, file_output
+    IterativeImprovementEvaluationMechanismParameters, EvaluationMechanismParameters, AdaptationParameters, \
+    StatisticsCollectionParameters, LoadSheddingParameters, LoadSheddingStrategies
+from misc.IOUtils import file_input, file_output, Stream, FileStream
+from misc.BinaryIOUtils import convert_to_binary_event_file, binary_file_input
 from misc.Stocks import MetastockDataFormatter
 from misc.Utils import generate_matches
+from misc.Statistics import calculate_selectivity_matrix, get_arrival_rates
 from evaluation.LeftDeepTreeBuilders import *
 from evaluation.BushyTreeBuilders import *
 from datetime import timedelta
 from base.Formula import GreaterThanFormula, SmallerThanFormula, SmallerThanEqFormula, GreaterThanEqFormula, MulTerm, \
-    EqFormula, IdentifierTerm, AtomicTerm, AndFormula, TrueFormula
+    EqFormula, IdentifierTerm, AtomicTerm, AndFormula, TrueFormula, AdaptiveConjunction
 from base.PatternStructure import AndOperator, SeqOperator, QItem, NegationOperator
 from base.Pattern import Pattern
 
@@ -20,6 +24,10 @@ nasdaqEventStreamMedium = file_input("test/EventFiles/NASDAQ_MEDIUM.txt", Metast
 nasdaqEventStreamFrequencyTailored = file_input("test/EventFiles/NASDAQ_FREQUENCY_TAILORED.txt",
                                                 MetastockDataFormatter())
 nasdaqEventStream_AAPL_AMZN_GOOG = file_input("test/EventFiles/NASDAQ_AAPL_AMZN_GOOG.txt", MetastockDataFormatter())
+nasdaqEventStream_AAPL_AMZN_GOOG_Compact = file_input("test/EventFiles/NASDAQ_AAPL_AMZN_GOOG.txt",
+                                                      MetastockDataFormatter(compact_payload=True))
+nasdaqEventStream_AAPL_AMZN_GOOG_Lazy = file_input("test/EventFiles/NASDAQ_AAPL_AMZN_GOOG.txt",
+                                                   MetastockDataFormatter(), lazy=True)
 nasdaqEventStream = file_input("test/EventFiles/NASDAQ_LONG.txt", MetastockDataFormatter())
 
 custom = file_input("test/EventFiles/custom.txt", MetastockDataFormatter())
@@ -74,6 +82,49 @@ def compareFiles(path1: str, path2: str):
     return set1 == set2
 
 
+def countMatchesInFile(path: str):
+    """
+    Counts the matches in an output file
+    :param path: path to the file
+    :return: int, the number of matches in the file
+    """
+    with open(path) as file:
+        return file.read().count("\n\n")
+
+
+def isSubsetOfFile(path1: str, path2: str):
+    """
+    Checks that every match in the first output appears in the second one
+    :param path1: path to first file
+    :param path2: path to second file
+    :return: bool, True if the matches of the first file are a subset of the matches of the second
+    """
+    file1 = open(path1)
+    file2 = open(path2)
+
+    counter1 = numOfLinesInPattern(file1)
+    counter2 = numOfLinesInPattern(file2)
+
+    file1.seek(0)
+    file2.seek(0)
+
+    if counter1 == 0:
+        closeFiles(file1, file2)
+        return True
+    if counter1 != counter2:
+        closeFiles(file1, file2)
+        return False
+
+    set1 = set()
+    set2 = set()
+
+    fillSet(file1, set1, counter1)
+    fillSet(file2, set2, counter2)
+    closeFiles(file1, file2)
+
+    return set1 <= set2
+
+
 def fillSet(file, set: set, counter: int):
     """
     fill a set, each element of the set is x consecutive lines of the file, with x = counter
@@ -140,13 +191,15 @@ def fileCompare(pathA, pathB):
     return True
 
 
-def createTest(testName, patterns, events=None):
+def createTest(testName, patterns, events=None, eval_mechanism_params=EvaluationMechanismParameters()):
     if events == None:
         events = nasdaqEventStream.duplicate()
     else:
         events = events.duplicate()
-    pattern = patterns[0]
-    matches = generate_matches(pattern, events)
+    matches = []
+    for pattern in patterns:
+        matches += generate_matches(pattern, events.duplicate(), eval_mechanism_params.selection_strategy,
+                                    eval_mechanism_params.consumption_policy)
     file_output(matches, '../TestsExpected/%sMatches.txt' % testName)
     print("Finished creating test %s" % testName)
 
@@ -154,9 +207,10 @@ def createTest(testName, patterns, events=None):
 def runTest(testName, patterns, createTestFile=False,
             eval_mechanism_type=EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE,
             eval_mechanism_params=EvaluationMechanismParameters(),
-            events=None):
+            events=None, partition_key_func=None, partitions_count=None, time_segments_count=None,
+            allowed_lateness=None, reordering_buffer_size=None):
     if createTestFile:
-        createTest(testName, patterns, events)
+        createTest(testName, patterns, events, eval_mechanism_params)
 
     if events is None:
         events = nasdaqEventStream.duplicate()
@@ -179,11 +233,20 @@ def runTest(testName, patterns, createTestFile=False,
     elif testName == "NotEverywhere":
         events = custom3.duplicate()
 
-    # easy way to change negation mode in tests
-    eval_mechanism_params = EvaluationMechanismParameters(EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE,
-                                                          NegationMode.FIRST_CHANCE)
-
-    cep = CEP(patterns, eval_mechanism_type, eval_mechanism_params)
+    if type(eval_mechanism_params) == EvaluationMechanismParameters:
+        # easy way to change negation mode in tests
+        eval_mechanism_params = EvaluationMechanismParameters(eval_mechanism_type, NegationMode.FIRST_CHANCE,
+                                                              eval_mechanism_params.selection_strategy,
+                                                              eval_mechanism_params.consumption_policy,
+                                                              eval_mechanism_params.adaptation_params,
+                                                              eval_mechanism_params.statistics_collection_params,
+                                                              eval_mechanism_params.load_shedding_params,
+                                                              eval_mechanism_params.micro_batching)
+
+    cep = CEP(patterns, eval_mechanism_type, eval_mechanism_params,
+              partition_key_func=partition_key_func, partitions_count=partitions_count,
+              time_segments_count=time_segments_count, allowed_lateness=allowed_lateness,
+              reordering_buffer_size=reordering_buffer_size)
     running_time = cep.run(events)
     matches = cep.get_pattern_match_stream()
     file_output(matches, '%sMatches.txt' % testName)
@@ -800,6 +863,505 @@ def nonFrequencyTailoredPatternSearchTest(createTestFile=False):
     runTest('nonFrequencyTailored1', [pattern], createTestFile,
             eval_mechanism_type=EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE, events=nasdaqEventStream)
 
+
+def createSameMinutePattern():
+    """
+    This pattern is looking for Apple, Amazon and Google updates reported at the same minute.
+    PATTERN AND(AppleStockPriceUpdate a, AmazonStockPriceUpdate b, GoogleStockPriceUpdate c)
+    WHERE a.Date = b.Date AND b.Date = c.Date AND a.PeakPrice > b.PeakPrice
+    WITHIN 10 minutes
+    """
+    return Pattern(
+        AndOperator([QItem("AAPL", "a"), QItem("AMZN", "b"), QItem("GOOG", "c")]),
+        AndFormula(
+            EqFormula(IdentifierTerm("a", lambda x: x["Date"]), IdentifierTerm("b", lambda x: x["Date"])),
+            AndFormula(
+                EqFormula(IdentifierTerm("b", lambda x: x["Date"]), IdentifierTerm("c", lambda x: x["Date"])),
+                GreaterThanFormula(IdentifierTerm("a", lambda x: x["Peak Price"]),
+                                   IdentifierTerm("b", lambda x: x["Peak Price"]))
+            )
+        ),
+        timedelta(minutes=10)
+    )
+
+
+def sameMinutePatternSearchTest(createTestFile=False):
+    """
+    Apple, Amazon and Google updates reported at the same minute (see createSameMinutePattern).
+    """
+    runTest('sameMinute', [createSameMinutePattern()], createTestFile, events=nasdaqEventStream_AAPL_AMZN_GOOG)
+
+
+def createGoogleRiseAroundAmazonPattern():
+    """
+    This pattern is looking for a Google rise around an Amazon update. Its matches on the AAPL/AMZN/GOOG input are
+    expected in compactPayloadMatches.txt, against which the tests of the different evaluation modes are compared.
+    PATTERN SEQ(GoogleStockPriceUpdate a, AmazonStockPriceUpdate b, GoogleStockPriceUpdate c)
+    WHERE a.PeakPrice < c.PeakPrice AND b.Volume >= a.Volume
+    WITHIN 5 minutes
+    """
+    return Pattern(
+        SeqOperator([QItem("GOOG", "a"), QItem("AMZN", "b"), QItem("GOOG", "c")]),
+        AndFormula(
+            SmallerThanFormula(IdentifierTerm("a", lambda x: x["Peak Price"]),
+                               IdentifierTerm("c", lambda x: x["Peak Price"])),
+            GreaterThanEqFormula(IdentifierTerm("b", lambda x: x["Volume"]),
+                                 IdentifierTerm("a", lambda x: x["Volume"]))
+        ),
+        timedelta(minutes=5)
+    )
+
+
+def compactPayloadPatternSearchTest(createTestFile=False):
+    """
+    The Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern), on events with compact payloads.
+    """
+    runTest('compactPayload', [createGoogleRiseAroundAmazonPattern()], createTestFile,
+            events=nasdaqEventStream_AAPL_AMZN_GOOG_Compact)
+
+
+def lazyFileInputPatternSearchTest(createTestFile=False):
+    """
+    Apple, Amazon and Google updates reported at the same minute (see createSameMinutePattern), on events lazily read
+    from the input file. The file is read in chunks of about 1000 characters, such that the evaluation crosses many
+    chunk boundaries, and the stream is duplicated in the middle of a chunk.
+    """
+    chunk_size_hint = FileStream.CHUNK_SIZE_HINT
+    FileStream.CHUNK_SIZE_HINT = 1000
+    try:
+        with file_input("test/EventFiles/NASDAQ_AAPL_AMZN_GOOG.txt", MetastockDataFormatter(), lazy=True) as events:
+            next(events)
+            runTest('lazyFileInput', [createSameMinutePattern()], createTestFile, events=events)
+    finally:
+        FileStream.CHUNK_SIZE_HINT = chunk_size_hint
+
+
+def binaryFileInputPatternSearchTest(createTestFile=False):
+    """
+    The Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern), on events replayed from a binary
+    event file.
+    """
+    pattern = createGoogleRiseAroundAmazonPattern()
+    with tempfile.TemporaryDirectory() as binary_file_directory:
+        binary_file_path = os.path.join(binary_file_directory, "NASDAQ_AAPL_AMZN_GOOG.bin")
+        convert_to_binary_event_file("test/EventFiles/NASDAQ_AAPL_AMZN_GOOG.txt", MetastockDataFormatter(),
+                                     binary_file_path)
+        with binary_file_input(binary_file_path) as events:
+            runTest('compactPayload', [pattern], createTestFile, events=events)
+
+
+def multiPatternSearchTest(createTestFile=False):
+    """
+    PATTERN SEQ(GoogleStockPriceUpdate a, AmazonStockPriceUpdate b, GoogleStockPriceUpdate c)
+    WHERE   a.OpeningPrice < a.PeakPrice AND b.Volume > a.Volume AND c.OpeningPrice < c.PeakPrice
+    WITHIN 1 minute
+    and
+    PATTERN SEQ(GoogleStockPriceUpdate a, AmazonStockPriceUpdate b, AppleStockPriceUpdate c)
+    WHERE   a.OpeningPrice < a.PeakPrice AND b.Volume > a.Volume AND c.OpeningPrice < c.PeakPrice
+    WITHIN 1 minute
+    The subtree detecting SEQ(a, b) is shared by both patterns.
+    """
+    patterns = []
+    for third_event_type in ["GOOG", "AAPL"]:
+        patterns.append(Pattern(
+            SeqOperator([QItem("GOOG", "a"), QItem("AMZN", "b"), QItem(third_event_type, "c")]),
+            AndFormula(
+                SmallerThanFormula(IdentifierTerm("a", lambda x: x["Opening Price"]),
+                                   IdentifierTerm("a", lambda x: x["Peak Price"])),
+                AndFormula(
+                    GreaterThanFormula(IdentifierTerm("b", lambda x: x["Volume"]),
+                                       IdentifierTerm("a", lambda x: x["Volume"])),
+                    SmallerThanFormula(IdentifierTerm("c", lambda x: x["Opening Price"]),
+                                       IdentifierTerm("c", lambda x: x["Peak Price"]))
+                )
+            ),
+            timedelta(minutes=1)
+        ))
+    runTest('multiPattern', patterns, createTestFile, events=nasdaqEventStream_AAPL_AMZN_GOOG)
+
+
+def thresholdMultiPatternSearchTest(createTestFile=False):
+    """
+    PATTERN SEQ(GoogleStockPriceUpdate a, AmazonStockPriceUpdate b)
+    WHERE   a.PeakPrice > T AND b.PeakPrice < a.PeakPrice
+    WITHIN 1 minute
+    for T in 530, 540, 550 and 560. The conditions on a are evaluated together using a single threshold index.
+    """
+    patterns = []
+    for threshold in [530, 540, 550, 560]:
+        patterns.append(Pattern(
+            SeqOperator([QItem("GOOG", "a"), QItem("AMZN", "b")]),
+            AndFormula(
+                GreaterThanFormula(IdentifierTerm("a", lambda x: x["Peak Price"]), AtomicTerm(threshold)),
+                SmallerThanFormula(IdentifierTerm("b", lambda x: x["Peak Price"]),
+                                   IdentifierTerm("a", lambda x: x["Peak Price"]))
+            ),
+            timedelta(minutes=1)
+        ))
+    runTest('thresholdMultiPattern', patterns, createTestFile, events=nasdaqEventStream_AAPL_AMZN_GOOG)
+
+
+def sameCodeGettersMultiPatternSearchTest(createTestFile=False):
+    """
+    PATTERN SEQ(GoogleStockPriceUpdate a, AmazonStockPriceUpdate b)
+    WHERE   scale(a.PeakPrice) > 0
+    WITHIN 5 minutes
+    where the getters of both patterns share their code, but scale negates the price in the globals of the first
+    pattern and keeps it in those of the second. The leaves of the patterns must not be shared, such that the second
+    pattern finds the same matches as when evaluated alone, and the first finds none.
+    """
+    testName = "sameCodeGettersMultiPattern"
+    patterns = []
+    for scale in [lambda x: -x, lambda x: x]:
+        getter = eval('lambda x: scale(x["Peak Price"])', {"scale": scale})
+        patterns.append(Pattern(
+            SeqOperator([QItem("GOOG", "a"), QItem("AMZN", "b")]),
+            GreaterThanFormula(IdentifierTerm("a", getter), AtomicTerm(0)),
+            timedelta(minutes=5)
+        ))
+    actual_matches_paths = []
+    for i, workload in enumerate([patterns[1:], patterns]):
+        cep = CEP(workload)
+        cep.run(nasdaqEventStream_AAPL_AMZN_GOOG.duplicate())
+        file_output(cep.get_pattern_match_stream(), '%s%dMatches.txt' % (testName, i))
+        actual_matches_paths.append("test/Matches/%s%dMatches.txt" % (testName, i))
+    matches_counts = [countMatchesInFile(path) for path in actual_matches_paths]
+    is_successful = matches_counts[0] > 0 and matches_counts[0] == matches_counts[1]
+    print("Test %s result: %s" % (testName, "Succeeded" if is_successful else "Failed"))
+    for path in actual_matches_paths:
+        os.remove(path)
+
+
+def partitionedPatternSearchTest(createTestFile=False):
+    """
+    PATTERN SEQ(S a, S b, S c)
+    WHERE   a.PeakPrice < b.PeakPrice AND b.PeakPrice < c.PeakPrice
+    WITHIN 3 minutes
+    for S in GoogleStockPriceUpdate and AmazonStockPriceUpdate, evaluated in parallel on the events of each stock.
+    """
+    patterns = []
+    for event_type in ["GOOG", "AMZN"]:
+        patterns.append(Pattern(
+            SeqOperator([QItem(event_type, "a"), QItem(event_type, "b"), QItem(event_type, "c")]),
+            AndFormula(
+                SmallerThanFormula(IdentifierTerm("a", lambda x: x["Peak Price"]),
+                                   IdentifierTerm("b", lambda x: x["Peak Price"])),
+                SmallerThanFormula(IdentifierTerm("b", lambda x: x["Peak Price"]),
+                                   IdentifierTerm("c", lambda x: x["Peak Price"]))
+            ),
+            timedelta(minutes=3)
+        ))
+    runTest('partitioned', patterns, createTestFile, events=nasdaqEventStream_AAPL_AMZN_GOOG,
+            partition_key_func=lambda x: x["Stock Ticker"], partitions_count=2)
+
+
+def partitionsCountPatternSearchTest(createTestFile=False):
+    """
+    The matches of a partitioned evaluation under a consumption policy must not depend on the number of partitions.
+    Selection strategies, which would depend on it, must be rejected.
+    PATTERN SEQ(GOOG a, GOOG b)
+    WHERE   a.PeakPrice < b.PeakPrice
+    WITHIN 5 minutes
+    """
+    testName = "partitionsCount"
+    pattern = Pattern(
+        SeqOperator([QItem("GOOG", "a"), QItem("GOOG", "b")]),
+        SmallerThanFormula(IdentifierTerm("a", lambda x: x["Peak Price"]),
+                           IdentifierTerm("b", lambda x: x["Peak Price"])),
+        timedelta(minutes=5)
+    )
+    actual_matches_paths = []
+    for partitions_count in [2, 64]:
+        cep = CEP([pattern], EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE,
+                  EvaluationMechanismParameters(consumption_policy=ConsumptionPolicies.SINGLE_MATCH),
+                  partition_key_func=lambda x: x["Stock Ticker"], partitions_count=partitions_count)
+        cep.run(nasdaqEventStreamShort.duplicate())
+        file_output(cep.get_pattern_match_stream(), '%s%dMatches.txt' % (testName, partitions_count))
+        actual_matches_paths.append("test/Matches/%s%dMatches.txt" % (testName, partitions_count))
+    is_successful = compareFiles(*actual_matches_paths)
+    try:
+        CEP([pattern], EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE,
+            EvaluationMechanismParameters(selection_strategy=SelectionStrategies.STRICT_CONTIGUITY),
+            partition_key_func=lambda x: x["Stock Ticker"], partitions_count=64)
+        is_successful = False
+    except Exception:
+        pass
+    print("Test %s result: %s" % (testName, "Succeeded" if is_successful else "Failed"))
+    for path in actual_matches_paths:
+        os.remove(path)
+
+
+def timeSlicedPatternSearchTest(createTestFile=False):
+    """
+    The Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern), with the input, read lazily from
+    the file, sliced into time segments evaluated in parallel. Many matches span the boundaries of the segments.
+    """
+    pattern = createGoogleRiseAroundAmazonPattern()
+    runTest('compactPayload', [pattern], createTestFile, events=nasdaqEventStream_AAPL_AMZN_GOOG_Lazy,
+            time_segments_count=4)
+
+
+def lazyEvaluationPatternSearchTest(createTestFile=False):
+    """
+    The Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern), evaluated lazily, with the Amazon
+    events (the rarest in the input) looked up first.
+    """
+    pattern = createGoogleRiseAroundAmazonPattern()
+    pattern.set_statistics(StatisticsTypes.FREQUENCY_DICT, {"GOOG": 463, "AMZN": 442})
+    runTest('compactPayload', [pattern], createTestFile, eval_mechanism_type=EvaluationMechanismTypes.LAZY_EVALUATION,
+            events=nasdaqEventStream_AAPL_AMZN_GOOG_Compact)
+
+
+def strictContiguityPatternSearchTest(createTestFile=False):
+    """
+    PATTERN SEQ(AppleStockPriceUpdate a, AmazonStockPriceUpdate b, GoogleStockPriceUpdate c, AppleStockPriceUpdate d)
+    WHERE a.OpeningPrice > d.OpeningPrice AND b.PeakPrice > 70
+    WITHIN 3 minutes
+    with the events of each match being consecutive in the stream
+    """
+    pattern = Pattern(
+        SeqOperator([QItem("AAPL", "a"), QItem("AMZN", "b"), QItem("GOOG", "c"), QItem("AAPL", "d")]),
+        AndFormula(
+            GreaterThanFormula(IdentifierTerm("a", lambda x: x["Opening Price"]),
+                               IdentifierTerm("d", lambda x: x["Opening Price"])),
+            GreaterThanFormula(IdentifierTerm("b", lambda x: x["Peak Price"]), AtomicTerm(70))
+        ),
+        timedelta(minutes=3)
+    )
+    runTest('strictContiguity', [pattern], createTestFile,
+            eval_mechanism_params=EvaluationMechanismParameters(
+                selection_strategy=SelectionStrategies.STRICT_CONTIGUITY),
+            events=nasdaqEventStream_AAPL_AMZN_GOOG)
+
+
+def skipTillNextMatchPatternSearchTest(createTestFile=False):
+    """
+    PATTERN SEQ(GoogleStockPriceUpdate a, GoogleStockPriceUpdate b, GoogleStockPriceUpdate c)
+    WHERE a.PeakPrice < b.PeakPrice AND b.PeakPrice < c.PeakPrice
+    WITHIN 4 minutes
+    with each of b and c being the first rise following the previous event
+    """
+    pattern = Pattern(
+        SeqOperator([QItem("GOOG", "a"), QItem("GOOG", "b"), QItem("GOOG", "c")]),
+        AndFormula(
+            SmallerThanFormula(IdentifierTerm("a", lambda x: x["Peak Price"]),
+                               IdentifierTerm("b", lambda x: x["Peak Price"])),
+            SmallerThanFormula(IdentifierTerm("b", lambda x: x["Peak Price"]),
+                               IdentifierTerm("c", lambda x: x["Peak Price"]))
+        ),
+        timedelta(minutes=4)
+    )
+    runTest('skipTillNextMatch', [pattern], createTestFile,
+            eval_mechanism_params=EvaluationMechanismParameters(
+                selection_strategy=SelectionStrategies.SKIP_TILL_NEXT_MATCH),
+            events=nasdaqEventStream_AAPL_AMZN_GOOG)
+
+
+def singleMatchConsumptionPatternSearchTest(createTestFile=False):
+    """
+    The Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern), with each event participating in
+    at most one match.
+    """
+    runTest('singleMatchConsumption', [createGoogleRiseAroundAmazonPattern()], createTestFile,
+            eval_mechanism_params=EvaluationMechanismParameters(
+                consumption_policy=ConsumptionPolicies.SINGLE_MATCH),
+            events=nasdaqEventStream_AAPL_AMZN_GOOG)
+
+
+def adaptivePatternSearchTest(createTestFile=False):
+    """
+    The Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern), with a bushy tree re-optimized
+    every 20 minutes according to the statistics measured during the evaluation, starting from misleading statistics.
+    The test succeeds if the evaluation migrated to a new tree and the matches are not affected by the migrations.
+    """
+    testName = "adaptive"
+    pattern = createGoogleRiseAroundAmazonPattern()
+    selectivityMatrix = [[1.0, 1.0, 0.01], [1.0, 1.0, 1.0], [0.01, 1.0, 1.0]]
+    arrivalRates = [0.1, 0.001, 0.1]
+    pattern.set_statistics(StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES, (selectivityMatrix, arrivalRates))
+    eval_mechanism_type = EvaluationMechanismTypes.DYNAMIC_PROGRAMMING_BUSHY_TREE
+    cep = CEP([pattern], eval_mechanism_type, EvaluationMechanismParameters(
+        eval_mechanism_type, adaptation_params=AdaptationParameters(timedelta(minutes=20), 0.1)))
+    running_time = cep.run(nasdaqEventStream_AAPL_AMZN_GOOG.duplicate())
+    file_output(cep.get_pattern_match_stream(), '%sMatches.txt' % testName)
+    actual_matches_path = "test/Matches/%sMatches.txt" % testName
+    is_successful = cep.get_migrations_count() > 0 and \
+        compareFiles(actual_matches_path, "test/TestsExpected/compactPayloadMatches.txt")
+    print("Test %s result: %s, Time Passed: %s" % (testName, "Succeeded" if is_successful else "Failed",
+                                                   running_time))
+    os.remove(actual_matches_path)
+
+
+def collectedStatisticsPatternSearchTest(createTestFile=False):
+    """
+    The statistics of the Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern) are collected
+    during a first run and used for constructing the tree of the second.
+    """
+    pattern = createGoogleRiseAroundAmazonPattern()
+    eval_mechanism_params = EvaluationMechanismParameters(
+        statistics_collection_params=StatisticsCollectionParameters(timedelta(days=1), 50, 5))
+    cep = CEP([pattern], EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE, eval_mechanism_params)
+    cep.run(nasdaqEventStream_AAPL_AMZN_GOOG_Compact.duplicate())
+    pattern.set_statistics(StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES, cep.get_statistics()[0])
+    runTest('compactPayload', [pattern], createTestFile,
+            eval_mechanism_type=EvaluationMechanismTypes.DYNAMIC_PROGRAMMING_BUSHY_TREE,
+            events=nasdaqEventStream_AAPL_AMZN_GOOG)
+
+
+def sampledStatisticsPatternSearchTest(createTestFile=False):
+    """
+    The statistics of the Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern) are estimated
+    offline on a sample of the events before the evaluation.
+    """
+    pattern = createGoogleRiseAroundAmazonPattern()
+    selectivityMatrix = calculate_selectivity_matrix(pattern, nasdaqEventStream_AAPL_AMZN_GOOG_Compact,
+                                                     sample_size=1000, max_error=0.05)
+    arrivalRates = get_arrival_rates(pattern, nasdaqEventStream_AAPL_AMZN_GOOG_Compact)
+    pattern.set_statistics(StatisticsTypes.SELECTIVITY_MATRIX_AND_ARRIVAL_RATES, (selectivityMatrix, arrivalRates))
+    runTest('compactPayload', [pattern], createTestFile,
+            eval_mechanism_type=EvaluationMechanismTypes.DYNAMIC_PROGRAMMING_BUSHY_TREE,
+            events=nasdaqEventStream_AAPL_AMZN_GOOG)
+
+
+def loadSheddingPatternSearchTest(createTestFile=False):
+    """
+    The partial matches of the Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern) buffered by
+    each node and by the whole tree are bounded. Under a tight budget, the test succeeds if partial matches were
+    dropped and the found matches are a proper subset of the matches. Under a budget exceeding the number of partial
+    matches ever buffered, the test succeeds if no partial match was dropped and all the matches are found.
+    """
+    pattern = createGoogleRiseAroundAmazonPattern()
+    expected_matches_path = "test/TestsExpected/compactPayloadMatches.txt"
+    for strategy in LoadSheddingStrategies:
+        testName = "loadShedding%s" % strategy.name
+        eval_mechanism_params = EvaluationMechanismParameters(
+            load_shedding_params=LoadSheddingParameters(3, 8, strategy))
+        cep = CEP([pattern], EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE, eval_mechanism_params)
+        running_time = cep.run(nasdaqEventStream_AAPL_AMZN_GOOG.duplicate())
+        file_output(cep.get_pattern_match_stream(), '%sMatches.txt' % testName)
+        actual_matches_path = "test/Matches/%sMatches.txt" % testName
+        is_successful = cep.get_dropped_partial_matches_count() > 0 and \
+            countMatchesInFile(actual_matches_path) < countMatchesInFile(expected_matches_path) and \
+            isSubsetOfFile(actual_matches_path, expected_matches_path)
+        print("Test %s result: %s, Time Passed: %s" % (testName, "Succeeded" if is_successful else "Failed",
+                                                       running_time))
+        os.remove(actual_matches_path)
+    testName = "loadSheddingUnderBudget"
+    eval_mechanism_params = EvaluationMechanismParameters(load_shedding_params=LoadSheddingParameters(10000, 20000))
+    cep = CEP([pattern], EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE, eval_mechanism_params)
+    running_time = cep.run(nasdaqEventStream_AAPL_AMZN_GOOG.duplicate())
+    file_output(cep.get_pattern_match_stream(), '%sMatches.txt' % testName)
+    actual_matches_path = "test/Matches/%sMatches.txt" % testName
+    is_successful = cep.get_dropped_partial_matches_count() == 0 and \
+        compareFiles(actual_matches_path, expected_matches_path)
+    print("Test %s result: %s, Time Passed: %s" % (testName, "Succeeded" if is_successful else "Failed",
+                                                   running_time))
+    os.remove(actual_matches_path)
+
+
+def outOfOrderPatternSearchTest(createTestFile=False):
+    """
+    The Google rise around an Amazon update (see createGoogleRiseAroundAmazonPattern), where the events of every three
+    minutes arrive in reverse order and are reordered before the evaluation. In the first run all events arrive within
+    the allowed lateness, and all the matches are expected. In the second run, every 50th Google event is delayed by
+    100 events (about half an hour), far beyond the allowed lateness. These events must be dropped, and the matches
+    are expected to be those found on the ordered input without them.
+    """
+    pattern = createGoogleRiseAroundAmazonPattern()
+    orderedEvents = list(nasdaqEventStream_AAPL_AMZN_GOOG.duplicate())
+    events = Stream()
+    for i in range(0, len(orderedEvents), 9):
+        events.add_items(reversed(orderedEvents[i:i + 9]))
+    events.close()
+    runTest('compactPayload', [pattern], createTestFile, events=events, allowed_lateness=timedelta(minutes=10),
+            reordering_buffer_size=50)
+
+    testName = "lateEvents"
+    googleEvents = [event for event in orderedEvents[:-100] if event.payload["Stock Ticker"] == "GOOG"]
+    lateEvents = set(googleEvents[::50])
+    delayedEvents = {}
+    for i in range(len(orderedEvents)):
+        if orderedEvents[i] in lateEvents:
+            delayedEvents.setdefault(i + 100, []).append(orderedEvents[i])
+    events, timelyEvents = Stream(), Stream()
+    for i in range(len(orderedEvents)):
+        if orderedEvents[i] not in lateEvents:
+            events.add_item(orderedEvents[i])
+            timelyEvents.add_item(orderedEvents[i])
+        events.add_items(delayedEvents.get(i, []))
+    events.close()
+    timelyEvents.close()
+    expected_cep = CEP([pattern])
+    expected_cep.run(timelyEvents)
+    file_output(expected_cep.get_pattern_match_stream(), '%sExpectedMatches.txt' % testName)
+    cep = CEP([pattern], allowed_lateness=timedelta(minutes=10), reordering_buffer_size=50)
+    running_time = cep.run(events)
+    file_output(cep.get_pattern_match_stream(), '%sMatches.txt' % testName)
+    expected_matches_path = "test/Matches/%sExpectedMatches.txt" % testName
+    actual_matches_path = "test/Matches/%sMatches.txt" % testName
+    is_successful = cep.get_late_events_count() == len(lateEvents) and \
+        compareFiles(actual_matches_path, expected_matches_path) and \
+        countMatchesInFile(actual_matches_path) < countMatchesInFile("test/TestsExpected/compactPayloadMatches.txt")
+    print("Test %s result: %s, Time Passed: %s" % (testName, "Succeeded" if is_successful else "Failed",
+                                                   running_time))
+    os.remove(expected_matches_path)
+    os.remove(actual_matches_path)
+
+
+def microBatchPatternSearchTest(createTestFile=False):
+    """
+    Apple, Amazon and Google updates reported at the same minute (see createSameMinutePattern) and the Google rise around
+    an Amazon update (see createGoogleRiseAroundAmazonPattern), where the events of each minute are evaluated as a
+    batch. Both patterns are expected to yield the same matches as when evaluating the events one by one. The
+    micro-batch mode must reject the features it does not support.
+    """
+    eval_mechanism_params = EvaluationMechanismParameters(micro_batching=True)
+    runTest('sameMinute', [createSameMinutePattern()], createTestFile, eval_mechanism_params=eval_mechanism_params,
+            events=nasdaqEventStream_AAPL_AMZN_GOOG)
+    runTest('compactPayload', [createGoogleRiseAroundAmazonPattern()], createTestFile,
+            eval_mechanism_params=eval_mechanism_params, events=nasdaqEventStream_AAPL_AMZN_GOOG_Compact)
+    testName = "microBatchUnsupported"
+    is_successful = True
+    for unsupported_params in [
+            EvaluationMechanismParameters(micro_batching=True, consumption_policy=ConsumptionPolicies.SINGLE_MATCH),
+            EvaluationMechanismParameters(micro_batching=True, load_shedding_params=LoadSheddingParameters(10, 20))]:
+        try:
+            CEP([createGoogleRiseAroundAmazonPattern()], EvaluationMechanismTypes.TRIVIAL_LEFT_DEEP_TREE,
+                unsupported_params)
+            is_successful = False
+        except NotImplementedError:
+            pass
+    print("Test %s result: %s" % (testName, "Succeeded" if is_successful else "Failed"))
+
+
+def adaptiveConjunctionTest(createTestFile=False):
+    """
+    A compiled conjunction whose first conjunct is expensive and always satisfied, while the second is cheap and
+    rarely satisfied. The second conjunct must be moved first exactly once the statistics of the first reordering are
+    sampled, without changing the results of the conjunction.
+    WHERE   a.PeakPrice + 0 * (expensive calculation) > 0 AND a.PeakPrice > 530
+    """
+    testName = "adaptiveConjunction"
+    formula = AndFormula(
+        GreaterThanFormula(IdentifierTerm("a", lambda x: x["Peak Price"] + 0 * sum(range(1000))), AtomicTerm(0)),
+        GreaterThanFormula(IdentifierTerm("a", lambda x: x["Peak Price"]), AtomicTerm(530))
+    )
+    conjunction = formula.compile({"a": 0})
+    initial_order = conjunction.get_order()
+    events = list(nasdaqEventStream_AAPL_AMZN_GOOG.duplicate())
+    reordering_calls_count = AdaptiveConjunction.SAMPLING_INTERVAL * AdaptiveConjunction.SAMPLES_PER_REORDERING
+    is_successful = True
+    calls_count = 0
+    while calls_count <= reordering_calls_count:
+        for event in events:
+            if conjunction([event]) != formula.eval({"a": event.payload}):
+                is_successful = False
+            calls_count += 1
+            if (calls_count < reordering_calls_count) != (conjunction.get_order() == initial_order):
+                is_successful = False
+    print("Test %s result: %s" % (testName, "Succeeded" if is_successful else "Failed"))
+
+
 # ON NASDAQ SHORT
 def OneNotAtTheBeginningTest(createTestFile=False):
     """
@@ -1099,4 +1661,24 @@ dpBPatternSearchTest()
 dpLdPatternSearchTest()
 nonFrequencyTailoredPatternSearchTest()
 frequencyTailoredPatternSearchTest()
-
+sameMinutePatternSearchTest()
+compactPayloadPatternSearchTest()
+lazyFileInputPatternSearchTest()
+binaryFileInputPatternSearchTest()
+multiPatternSearchTest()
+thresholdMultiPatternSearchTest()
+sameCodeGettersMultiPatternSearchTest()
+partitionedPatternSearchTest()
+partitionsCountPatternSearchTest()
+timeSlicedPatternSearchTest()
+lazyEvaluationPatternSearchTest()
+strictContiguityPatternSearchTest()
+skipTillNextMatchPatternSearchTest()
+singleMatchConsumptionPatternSearchTest()
+adaptivePatternSearchTest()
+collectedStatisticsPatternSearchTest()
+sampledStatisticsPatternSearchTest()
+loadSheddingPatternSearchTest()
+outOfOrderPatternSearchTest()
+microBatchPatternSearchTest()
+adaptiveConjunctionTest()